@@ -0,0 +1,79 @@
+#!/usr/bin/env python3
+"""
+キャプチャ→送信の遅延と送信タスクの起床回数の計測
+キャプチャスレッドの代わりに一定レートで packet_info を投入し、送信されたバッチを記録する
+
+    python benchmarks/bench_batch_latency.py
+"""
+
+import asyncio
+import os
+import sys
+import threading
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from packet_capture_client import PacketCaptureClient  # noqa: E402
+
+RATES = (0, 20, 200, 2000)  # packets/s（0 = アイドル）
+DURATION = 3.0  # 秒
+
+
+class FakeWebSocket:
+    def __init__(self):
+        self.messages = 0
+
+    async def send(self, message):
+        self.messages += 1
+
+
+def produce(client: PacketCaptureClient, rate: float, stop: threading.Event):
+    """キャプチャスレッド相当：一定間隔で別フローのパケットを投入"""
+    if rate == 0:
+        return
+    interval = 1 / rate
+    next_time = time.perf_counter()
+    i = 0
+    while not stop.is_set():
+        client.enqueue_packet_info({
+            'timestamp': time.time(), 'size': 100, 'protocol': 'UDP',
+            'src_ip': f'10.0.{i // 250 % 250}.{i % 250 + 1}', 'dst_ip': '10.1.0.1',
+            'src_port': 40000 + i % 20000, 'dst_port': 5000, 'is_fragment': False
+        })
+        i += 1
+        next_time += interval
+        delay = next_time - time.perf_counter()
+        if delay > 0:
+            time.sleep(delay)
+
+
+async def measure(rate: float):
+    client = PacketCaptureClient()
+    client.is_capturing = True
+    client.ws = FakeWebSocket()
+    sender = asyncio.ensure_future(client.send_packet_batch())
+    await asyncio.sleep(0)
+
+    stop = threading.Event()
+    producer = threading.Thread(target=produce, args=(client, rate, stop), daemon=True)
+    producer.start()
+    await asyncio.sleep(DURATION)
+    stop.set()
+    producer.join()
+    sender.cancel()
+
+    latency = client.latency_summary() or {'p50_ms': 0, 'p99_ms': 0, 'max_ms': 0}
+    print(f"{rate:>8} {client.packet_count:>8} {client.ws.messages:>8} "
+          f"{client.sender_wakeups / DURATION:>10.1f} {latency['p50_ms']:>8.1f} "
+          f"{latency['p99_ms']:>8.1f} {latency['max_ms']:>8.1f}")
+
+
+def main():
+    print(f"{'pkt/s':>8} {'packets':>8} {'batches':>8} {'wakeups/s':>10} {'p50 ms':>8} {'p99 ms':>8} {'max ms':>8}")
+    for rate in RATES:
+        asyncio.run(measure(rate))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,100 @@
+#!/usr/bin/env python3
+"""
+キャプチャバックエンドの解析スループット比較（scapy vs raw/struct）
+合成したEthernetフレームを packet_info まで解析する速度を計測する
+
+    python benchmarks/bench_capture_parser.py
+"""
+
+import os
+import random
+import socket
+import struct
+import sys
+import timeit
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from scapy.all import ICMP, IP, TCP, UDP, Ether, IPv6  # noqa: E402
+
+from packet_capture_client import PacketCaptureClient, load_scapy, parse_frame  # noqa: E402
+
+load_scapy()  # scapyバックエンドの packet_handler が使う名前を読み込む
+
+FRAME_COUNT = 20000
+REPEAT = 3
+ETHER = Ether(src='02:00:00:00:00:01', dst='02:00:00:00:00:02')
+
+
+def build_frames(count: int):
+    """TCP/UDP/ICMP（IPv4）とTCP/UDP（IPv6）の合成フレーム"""
+    random.seed(42)
+    frames = []
+    for _ in range(count):
+        kind = random.random()
+        src4 = socket.inet_ntoa(struct.pack('!I', random.getrandbits(32)))
+        dst4 = socket.inet_ntoa(struct.pack('!I', random.getrandbits(32)))
+        sport = random.randint(1024, 65535)
+        dport = random.randint(1024, 65535)
+        payload = b'x' * random.choice([40, 400, 1200])
+        if kind < 0.5:
+            packet = ETHER / IP(src=src4, dst=dst4) / TCP(sport=sport, dport=dport, flags='A') / payload
+        elif kind < 0.75:
+            packet = ETHER / IP(src=src4, dst=dst4) / UDP(sport=sport, dport=dport) / payload
+        elif kind < 0.8:
+            packet = ETHER / IP(src=src4, dst=dst4) / ICMP()
+        elif kind < 0.9:
+            packet = ETHER / IPv6(src='2001:db8::1', dst='2001:db8::2') / TCP(sport=sport, dport=dport) / payload
+        else:
+            packet = ETHER / IPv6(src='2001:db8::1', dst='2001:db8::2') / UDP(sport=sport, dport=dport) / payload
+        frames.append(bytes(packet))
+    return frames
+
+
+def new_client() -> PacketCaptureClient:
+    client = PacketCaptureClient()
+    client.is_capturing = True
+    client.connection_rate_limit = 0  # 接続ごとのレート制限で間引かれないようにする
+    return client
+
+
+def run_scapy(frames):
+    """sniff(prn=...) と同じく、フレームを分解してから packet_handler に渡す"""
+    client = new_client()
+    for frame in frames:
+        client.packet_handler(Ether(frame))
+    return client
+
+
+def run_raw(frames):
+    client = new_client()
+    for frame in frames:
+        client.handle_frame(frame, len(frame))
+    return client
+
+
+def main():
+    frames = build_frames(FRAME_COUNT)
+
+    # IPv4フレームの解析結果が一致することを確認（scapy経路はIPv4のみ対応）
+    for frame in frames[:2000]:
+        packet = Ether(frame)
+        if not packet.haslayer(IP):
+            continue
+        info = parse_frame(frame, len(frame))
+        assert info['src_ip'] == packet[IP].src and info['dst_ip'] == packet[IP].dst
+        layer = packet[TCP] if packet.haslayer(TCP) else packet[UDP] if packet.haslayer(UDP) else None
+        if layer is not None:
+            assert (info['src_port'], info['dst_port']) == (layer.sport, layer.dport)
+
+    print(f"{'backend':>8} {'frames':>8} {'seconds':>8} {'frames/s':>10}")
+    results = {}
+    for name, runner in (('scapy', run_scapy), ('raw', run_raw)):
+        seconds = min(timeit.repeat(lambda: runner(frames), number=1, repeat=REPEAT))
+        results[name] = seconds
+        print(f"{name:>8} {FRAME_COUNT:>8} {seconds:>8.3f} {FRAME_COUNT / seconds:>10.0f}")
+    print(f"speedup: {results['scapy'] / results['raw']:.1f}x")
+
+
+if __name__ == '__main__':
+    main()
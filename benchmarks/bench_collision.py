@@ -0,0 +1,105 @@
+#!/usr/bin/env python3
+"""
+サーバー側当たり判定の比較（空間グリッド vs 総当たり）
+1ティックあたりの判定時間をプレイヤー数・弾幕数ごとに計測する
+
+    python benchmarks/bench_collision.py
+"""
+
+import os
+import random
+import sys
+import timeit
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from packet_hub import (  # noqa: E402
+    GAME_HEIGHT, GAME_WIDTH, GRAZE_RADIUS, PLAYER_HIT_RADIUS,
+    Bullet, GameClient, GameMode, HubServer, PlayerState, create_bullet_store, np
+)
+
+PLAYER_COUNTS = (10, 50)
+BULLET_COUNTS = (1000, 5000, 10000)
+REPEAT = 10
+
+
+def build_hub(store: str, player_count: int, bullet_count: int, invulnerable: bool) -> HubServer:
+    """ベンチマーク用のHubを生成"""
+    random.seed(42)
+    hub = HubServer(authoritative=True)
+    hub.bullets = create_bullet_store(store, bullet_count)
+    bullets = []
+    for _ in range(bullet_count):
+        bullets.append(Bullet(
+            id=hub.generate_bullet_id(),
+            x=random.uniform(0, GAME_WIDTH), y=random.uniform(-50, GAME_HEIGHT + 50),
+            vx=0, vy=100, size=random.choice([5, 10, 15]), protocol='TCP',
+            source='capture_0', port=50000, color='#FF4444'
+        ))
+    hub.bullets.add(bullets)
+    for i in range(player_count):
+        player_id = f'client_{i}'
+        hub.game_clients[player_id] = GameClient(
+            id=player_id, mode=GameMode.PLAYER, websocket=None,
+            player_state=PlayerState(id=player_id, name=player_id,
+                                     x=random.uniform(0, GAME_WIDTH), y=random.uniform(0, GAME_HEIGHT),
+                                     invulnerable=invulnerable,
+                                     last_move_time=float('inf')))  # 計測中に位置更新が途絶えた扱いにしない
+    return hub
+
+
+def brute_force(hub: HubServer):
+    """全プレイヤー × 全弾幕の総当たり判定（比較用、状態は変更しない）"""
+    bullets, xs, ys, sizes = hub.bullets.collision_data()
+    if np is not None and isinstance(xs, np.ndarray):
+        xs, ys, sizes = xs.tolist(), ys.tolist(), sizes.tolist()
+    hits = []
+    grazes = set()
+    for client in hub.game_clients.values():
+        player = client.player_state
+        for i in range(len(xs)):
+            dx = xs[i] - player.x
+            dy = ys[i] - player.y
+            distance_sq = dx * dx + dy * dy
+            radius = sizes[i] / 2
+            if not player.invulnerable and distance_sq <= (PLAYER_HIT_RADIUS + radius) ** 2:
+                hits.append((client.id, bullets[i].id))
+                break
+            if distance_sq <= (GRAZE_RADIUS + radius) ** 2:
+                grazes.add((client.id, bullets[i].id))
+    return hits, grazes
+
+
+def grid(hub: HubServer):
+    """空間グリッド判定（毎回グレイズ記録をリセットして同じ仕事量にする）"""
+    for client in hub.game_clients.values():
+        client.player_state.grazed_bullets.clear()
+    return hub.detect_collisions()
+
+
+def main():
+    stores = ['list'] + (['numpy'] if np is not None else [])
+    print(f"{'store':>6} {'players':>8} {'bullets':>8} {'brute ms':>9} {'grid ms':>8} {'speedup':>8}")
+    for store in stores:
+        for player_count in PLAYER_COUNTS:
+            for bullet_count in BULLET_COUNTS:
+                # 被弾するプレイヤーが一致することを確認
+                hub = build_hub(store, player_count, bullet_count, invulnerable=False)
+                expected_hits, _ = brute_force(hub)
+                assert {c.id for c, _ in grid(hub)} == {c for c, _ in expected_hits}
+
+                # 計測は無敵状態で行う（被弾で探索が打ち切られず、全弾幕のグレイズ判定を行う）
+                hub = build_hub(store, player_count, bullet_count, invulnerable=True)
+                _, expected_grazes = brute_force(hub)
+                grid(hub)
+                grazes = {(c.id, b) for c in hub.game_clients.values() for b in c.player_state.grazed_bullets}
+                assert grazes == expected_grazes
+
+                brute_ms = min(timeit.repeat(lambda: brute_force(hub), number=1, repeat=REPEAT)) * 1000
+                grid_ms = min(timeit.repeat(lambda: grid(hub), number=1, repeat=REPEAT)) * 1000
+                print(f"{store:>6} {player_count:>8} {bullet_count:>8} {brute_ms:>9.2f} {grid_ms:>8.2f} "
+                      f"{brute_ms / grid_ms:>7.1f}x")
+
+
+if __name__ == '__main__':
+    main()
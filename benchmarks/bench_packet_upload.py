@@ -0,0 +1,75 @@
+#!/usr/bin/env python3
+"""
+packet_data のアップロード形式比較（JSON vs バイナリ）
+1メッセージあたりのHub側処理時間（デコード・対象判定・間引き）と送信バイト数をバッチサイズごとに計測する
+
+    python benchmarks/bench_packet_upload.py
+"""
+
+import json
+import os
+import random
+import sys
+import timeit
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from packet_capture_client import encode_packet_upload  # noqa: E402
+from packet_hub import decode_packet_record, scan_packet_upload  # noqa: E402
+
+BATCH_SIZES = (15, 100, 1000)
+ADMITTED = 10  # 1メッセージで弾幕にするパケット数
+REPEAT = 200
+
+
+def build_packets(count: int) -> list:
+    """ベンチマーク用のパケット情報を生成"""
+    random.seed(42)
+    packets = []
+    for _ in range(count):
+        protocol = random.choice(['TCP', 'UDP', 'ICMP'])
+        icmp = protocol == 'ICMP'
+        packets.append({
+            'protocol': protocol,
+            'src_port': None if icmp else random.randint(1024, 65535),
+            'dst_port': None if icmp else random.choice([80, 443, random.randint(1024, 65535)]),
+            'size': random.randint(60, 1500),
+            'src_ip': f'192.168.1.{random.randint(1, 254)}',
+            'dst_ip': f'10.0.{random.randint(0, 3)}.{random.randint(1, 254)}'
+        })
+    return packets
+
+
+def hub_json(payload: str) -> list:
+    """JSON形式のHub側処理（全パケットをdictにデコードしてから判定・間引き）"""
+    eligible = []
+    for packet in json.loads(payload)['packets']:
+        port = packet.get('dst_port', 0) or packet.get('src_port', 0)
+        if packet.get('protocol') == 'ICMP' or (port and port > 1023):
+            eligible.append(packet)
+    return random.sample(eligible, min(ADMITTED, len(eligible)))
+
+
+def hub_binary(payload: bytes) -> list:
+    """バイナリ形式のHub側処理（判定・間引きの後、採用したレコードだけをデコード）"""
+    _, offsets, v6_start, _ = scan_packet_upload(payload)
+    sampled = random.sample(offsets, min(ADMITTED, len(offsets)))
+    return [decode_packet_record(payload, offset, v6_start, []) for offset in sampled]
+
+
+def main():
+    print(f"{'batch':>6} {'format':>7} {'hub us/msg':>11} {'bytes/msg':>10} {'bytes/packet':>13}")
+    for count in BATCH_SIZES:
+        packets = build_packets(count)
+        json_payload = json.dumps({'type': 'packet_data', 'source_id': 'capture_0', 'packets': packets})
+        binary_payload = encode_packet_upload(packets, {})
+        assert len(hub_json(json_payload)) == len(hub_binary(binary_payload))
+
+        for name, func, payload in (('json', hub_json, json_payload), ('binary', hub_binary, binary_payload)):
+            us = min(timeit.repeat(lambda: func(payload), number=1, repeat=REPEAT)) * 1e6
+            size = len(payload.encode('utf-8')) if isinstance(payload, str) else len(payload)
+            print(f"{count:>6} {name:>7} {us:>11.1f} {size:>10} {size / count:>13.1f}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,120 @@
+#!/usr/bin/env python3
+"""
+キャプチャクライアントの起動時間
+プロセス起動から Hub が最初の capture_auth を受信するまでの時間と、
+最初のキャプチャしたパケット（packet_data）を受信するまでの時間をバックエンドごとに計測する
+scapyバックエンドはHub接続後にscapyを読み込むため、後者でないと読み込み時間が含まれない
+（比較用に scapy.all を読み込むだけの時間も表示し、目標時間を超えたら終了コード1で終わる）
+
+    sudo python benchmarks/bench_startup.py
+"""
+
+import asyncio
+import json
+import os
+import socket
+import subprocess
+import sys
+import time
+
+import websockets
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+CLIENT = os.path.join(ROOT, 'packet_capture_client.py')
+
+BACKENDS = ('raw', 'scapy')
+INTERFACE = 'lo'
+REPEAT = 5
+TIMEOUT = 30.0
+STARTUP_TARGET = 1.0  # 秒（raw バックエンドでの capture_auth 到着までの目標時間）
+CAPTURE_TARGET = 2.0  # 秒（raw バックエンドで最初のパケット到着までの目標、起動時のフィルタレート計測1秒を含む）
+SCAPY_LOAD_TARGET = 0.4  # 秒（scapyバックエンドの最初のパケットが raw より遅れる時間の目標、scapy.all を読むと超える）
+TRAFFIC_INTERVAL = 0.005  # 秒（capture_auth 受信後にループバックへ送るUDPの間隔）
+TRAFFIC_PORT = 40000
+
+
+async def send_traffic(stop: asyncio.Event):
+    """キャプチャ開始を検出するため、弾幕対象のポート宛てUDPをループバックに送り続ける"""
+    sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    try:
+        i = 0
+        while not stop.is_set():
+            sock.sendto(b'x', ('127.0.0.1', TRAFFIC_PORT + i % 1000))  # 接続ごとのレート制限を避けてポートを変える
+            i += 1
+            await asyncio.sleep(TRAFFIC_INTERVAL)
+    finally:
+        sock.close()
+
+
+async def measure_startup(backend: str) -> tuple:
+    """フェイクHubを立ててクライアントを起動し、(capture_auth 受信までの秒数, 最初のパケット受信までの秒数) を返す"""
+    loop = asyncio.get_running_loop()
+    auth = loop.create_future()
+    first_packet = loop.create_future()
+    stop_traffic = asyncio.Event()
+
+    async def handler(websocket):
+        try:
+            async for message in websocket:
+                if isinstance(message, bytes):
+                    kind = 'packet_data'  # バイナリ形式の packet_data
+                else:
+                    kind = json.loads(message).get('type')
+                if kind == 'capture_auth' and not auth.done():
+                    auth.set_result(time.perf_counter())
+                    asyncio.ensure_future(send_traffic(stop_traffic))
+                elif kind == 'packet_data' and not first_packet.done():
+                    first_packet.set_result(time.perf_counter())
+        except websockets.ConnectionClosed:
+            pass  # 計測後にクライアントを終了させるため
+
+    async with websockets.serve(handler, 'localhost', 0) as server:
+        port = server.sockets[0].getsockname()[1]
+        started = time.perf_counter()
+        process = await asyncio.create_subprocess_exec(
+            sys.executable, CLIENT, '--hub', f'localhost:{port}', '--backend', backend,
+            '--interface', INTERFACE, '--no-discover',
+            stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        try:
+            auth_time = await asyncio.wait_for(auth, TIMEOUT)
+            packet_time = await asyncio.wait_for(first_packet, TIMEOUT)
+            return auth_time - started, packet_time - started
+        finally:
+            stop_traffic.set()
+            process.kill()
+            await process.wait()
+
+
+def measure_scapy_import() -> float:
+    """比較用: scapy.all を読み込むだけのプロセスの実行時間"""
+    started = time.perf_counter()
+    subprocess.run([sys.executable, '-c', 'import scapy.all'], check=True,
+                   stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    return time.perf_counter() - started
+
+
+def main():
+    print(f"{'startup':>24} {'auth s':>8} {'packet s':>9}")
+    print(f"{'import scapy.all':>24} {min(measure_scapy_import() for _ in range(REPEAT)):>8.3f}")
+    results = {}
+    for backend in BACKENDS:
+        runs = [asyncio.run(measure_startup(backend)) for _ in range(REPEAT)]
+        results[backend] = (min(auth for auth, _ in runs), min(packet for _, packet in runs))
+        print(f"{'client --backend ' + backend:>24} {results[backend][0]:>8.3f} {results[backend][1]:>9.3f}")
+
+    checks = [
+        ('raw auth', results['raw'][0], STARTUP_TARGET),
+        ('raw first packet', results['raw'][1], CAPTURE_TARGET),
+        ('scapy load (scapy - raw first packet)', results['scapy'][1] - results['raw'][1], SCAPY_LOAD_TARGET),
+    ]
+    failed = False
+    for name, seconds, target in checks:
+        ok = seconds <= target
+        failed |= not ok
+        print(f"target {name}: {target:.1f}s -> {'ok' if ok else 'REGRESSION'}")
+    if failed:
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,78 @@
+#!/usr/bin/env python3
+"""
+game_state のワイヤーフォーマット比較（JSON vs バイナリ）
+1ティックあたりのエンコード時間と送信バイト数を弾幕数ごとに計測する
+
+    python benchmarks/bench_wire_format.py
+"""
+
+import json
+import os
+import random
+import sys
+import timeit
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from packet_hub import (  # noqa: E402
+    Bullet, CaptureClient, GameClient, GameMode, HubServer, PlayerState,
+    create_bullet_store, encode_binary_state
+)
+
+BULLET_COUNTS = (500, 2000, 10000)
+PLAYER_COUNT = 8
+REPEAT = 20
+
+
+def build_hub(bullet_count: int) -> HubServer:
+    """ベンチマーク用のHubを生成"""
+    random.seed(42)
+    hub = HubServer()
+    hub.bullets = create_bullet_store('list', bullet_count)
+    for i in range(4):
+        hub.capture_clients[f'client_{i}'] = CaptureClient(
+            id=f'client_{i}', source_id=f'capture_{i}', source_name=f'host{i}_capture', websocket=None)
+    for i in range(PLAYER_COUNT):
+        player_id = f'client_{100 + i}'
+        hub.game_clients[player_id] = GameClient(
+            id=player_id, mode=GameMode.PLAYER, websocket=None,
+            player_state=PlayerState(id=player_id, name=f'Player{i}'))
+
+    bullets = []
+    for _ in range(bullet_count):
+        source = random.randrange(4)
+        protocol = random.choice(['TCP', 'UDP', 'ICMP'])
+        port = random.randint(1024, 65535)
+        bullets.append(Bullet(
+            id=hub.generate_bullet_id(),
+            x=random.uniform(0, 800), y=random.uniform(-50, 650),
+            vx=random.uniform(-50, 50), vy=random.choice([100, 150, 200]),
+            size=random.choice([5, 10, 15]), protocol=protocol,
+            source=f'capture_{source}', port=port, color='#FF4444',
+            src_ip=f'192.168.1.{random.randint(1, 254)}',
+            dst_ip=f'10.0.{random.randint(0, 3)}.{random.randint(1, 254)}',
+            src_port=port, dst_port=random.randint(1024, 65535),
+            src_name=f'host{source}_capture'
+        ))
+    hub.bullets.add(bullets)
+    return hub
+
+
+def main():
+    print(f"{'bullets':>8} {'format':>7} {'encode ms/tick':>15} {'bytes/tick':>11} {'bytes/bullet':>13}")
+    for count in BULLET_COUNTS:
+        hub = build_hub(count)
+        players = hub.get_players_state()
+        state = hub.get_game_state(players)
+
+        json_bytes = json.dumps(state).encode('utf-8')
+        binary_bytes = encode_binary_state(state, players)
+        json_ms = min(timeit.repeat(lambda: json.dumps(state), number=1, repeat=REPEAT)) * 1000
+        binary_ms = min(timeit.repeat(lambda: encode_binary_state(state, players), number=1, repeat=REPEAT)) * 1000
+
+        for name, ms, payload in (('json', json_ms, json_bytes), ('binary', binary_ms, binary_bytes)):
+            print(f"{count:>8} {name:>7} {ms:>15.2f} {len(payload):>11} {len(payload) / count:>13.1f}")
+
+
+if __name__ == '__main__':
+    main()
@@ -6,25 +6,984 @@ Hubサーバーにパケットデータを送信するクライアント
 
 import asyncio
 import json
+import os
 import time
 import argparse
 import sys
 import socket
 import struct
+import select
+import mmap
+import threading
+import bisect
+import multiprocessing
+from multiprocessing import shared_memory
 from typing import Optional, List, Dict, Any, Tuple
-from collections import deque
-from scapy.all import *
+from collections import deque, OrderedDict
 import websockets
 from websockets.client import WebSocketClientProtocol
+from websockets.protocol import State
 
 # マルチキャスト検索設定
 MULTICAST_GROUP = '239.255.42.99'  # プライベートマルチキャストアドレス
 MULTICAST_PORT = 9999  # 独自ポート（mDNSと競合しない）
 SERVICE_NAME = '_pcap-nyan-hub._tcp.local'
+DISCOVERY_WINDOW = 1.0  # 秒（DISCOVER送信後に全HubのANNOUNCEを集める時間）
+DISCOVERY_CAPTURE_COST = 0.005  # 秒（接続中のキャプチャクライアント1台をRTTに換算した重み）
+DISCOVERY_MIN_SCALE = 0.1  # spawn_scale の下限（生成目標を絞っているHubほどコストを高くする）
+
+# scapyバックエンドで使う名前（起動を速くするため load_scapy で必要になった時に読み込む）
+conf = sniff = IP = TCP = UDP = ICMP = None
+
+def load_scapy():
+    """scapyバックエンドで使うモジュールだけを読み込む（全レイヤー・contribを読み込む scapy.all は使わない）"""
+    global conf, sniff, IP, TCP, UDP, ICMP
+    if sniff is None:
+        from scapy.config import conf
+        from scapy.layers.inet import IP, TCP, UDP, ICMP
+        from scapy.sendrecv import sniff
+
+# rawキャプチャ設定（AF_PACKET、Linuxのみ）
+CAPTURE_BACKENDS = ('scapy', 'raw', 'ring')
+RAW_SNAPLEN = 256  # ヘッダ解析に必要な先頭バイト数（サイズはMSG_TRUNCで実長を取得）
+
+# ringキャプチャ設定（PACKET_RX_RING / TPACKET_V3）
+RING_BLOCK_SIZE = 1 << 20  # バイト（ページサイズの倍数）
+RING_BLOCK_COUNT = 64
+RING_FRAME_SIZE = 2048  # バイト（16の倍数、ブロックサイズを割り切れること）
+RING_BLOCK_TIMEOUT_MS = 50  # 埋まりきらないブロックをユーザー空間に渡すまでの時間
+RING_STATS_INTERVAL = 10.0  # 秒（カーネルのドロップ数の報告間隔）
+SOL_PACKET = 263
+PACKET_RX_RING = 5
+PACKET_STATISTICS = 6
+PACKET_VERSION = 10
+TPACKET_V3 = 2
+TP_STATUS_KERNEL = 0
+TP_STATUS_USER = 1
+_TPACKET_REQ3 = struct.Struct('7I')  # block_size, block_nr, frame_size, frame_nr, retire_blk_tov, sizeof_priv, feature_req_word
+_BLOCK_DESC = struct.Struct('3I')  # block_status, num_pkts, offset_to_first_pkt（ブロック先頭から8バイト目）
+_TPACKET3_HDR = struct.Struct('I8xIIxxxxH')  # next_offset, snaplen, len, mac
+_TPACKET_STATS_V3 = struct.Struct('3I')  # packets, drops, freeze_q_cnt
+ETH_P_ALL = 0x0003
+ETH_P_IP = 0x0800
+ETH_P_IPV6 = 0x86DD
+ETH_P_VLAN = (0x8100, 0x88A8)
+IPV6_EXTENSION_HEADERS = (0, 43, 60)  # Hop-by-Hop, Routing, Destination Options
+IPV6_FRAGMENT_HEADER = 44
+IP_PROTOCOLS = {6: 'TCP', 17: 'UDP', 1: 'ICMP', 58: 'ICMP'}
+TCP_RST = 0x04
+
+_UINT16 = struct.Struct('!H')
+
+# リンク層タイプ（pcapのLINKTYPE_*）
+DLT_NULL = 0
+DLT_EN10MB = 1
+DLT_RAW = 101
+DLT_LINUX_SLL = 113
+LINKTYPE_IP_OFFSETS = {DLT_NULL: 4, DLT_RAW: 0, 12: 0, 14: 0}  # IPヘッダが直接続くリンク層
+IP_VERSION_ETHERTYPES = {4: ETH_P_IP, 6: ETH_P_IPV6}
+SYSFS_NET_DIR = '/sys/class/net'  # インターフェースのハードウェアタイプ（<名前>/type）
+# AF_PACKETでbindするインターフェースのハードウェアタイプ（ARPHRD_*）→ リンク層タイプ
+# tun/WireGuard（ARPHRD_NONE）、PPP、IPIP/SITトンネル、rawip はリンク層ヘッダなしでIPヘッダから始まる
+ARPHRD_LINKTYPES = {1: DLT_EN10MB, 772: DLT_EN10MB,  # ETHER, LOOPBACK
+                    0xFFFE: DLT_RAW, 512: DLT_RAW, 519: DLT_RAW,  # NONE, PPP, RAWIP
+                    768: DLT_RAW, 769: DLT_RAW, 776: DLT_RAW}  # TUNNEL, TUNNEL6, SIT
+_IPV4_HEADER = struct.Struct('!B5xHxB2x4s4s')  # ver/ihl, flags+frag offset, protocol, src, dst
+_IPV6_HEADER = struct.Struct('!6xBx16s16s')  # next header, src, dst
+_PORTS = struct.Struct('!HH')
+
+# カーネル側フィルタ（Hubの process_packet_data で弾幕にならないパケットを事前に破棄）
+MIN_SPAWN_PORT = 1024  # Hubは宛先（0なら送信元）ポートが1023以下のTCP/UDPを捨てる
+FILTER_SAMPLE_SECONDS = 1.0  # 起動時にフィルタ前後のパケットレートを計測する時間
+SO_ATTACH_FILTER = 26
+BPF_ACCEPT = 0x40000
+
+def parse_frame(frame, length: int, linktype: int = DLT_EN10MB,
+                stats: Optional['PipelineStats'] = None) -> Optional[Dict[str, Any]]:
+    """フレームから packet_info を抽出（scapyを使わずstructで必要なフィールドのみ解析）
+
+    linktypeはEthernet（デフォルト）、Linux cooked、raw IP、BSD loopbackに対応。
+    弾幕にならないフレーム（IP以外、非先頭フラグメント、TCP RST、未対応プロトコル）はNoneを返す。
+    statsを渡すと非先頭フラグメントとTCP RSTの件数を数える。
+    """
+    try:
+        if linktype == DLT_EN10MB:
+            offset = 12
+            ethertype, = _UINT16.unpack_from(frame, offset)
+            while ethertype in ETH_P_VLAN:
+                offset += 4
+                ethertype, = _UINT16.unpack_from(frame, offset)
+            offset += 2
+        elif linktype == DLT_LINUX_SLL:
+            ethertype, = _UINT16.unpack_from(frame, 14)
+            offset = 16
+        else:
+            offset = LINKTYPE_IP_OFFSETS.get(linktype)
+            if offset is None:
+                return None
+            ethertype = IP_VERSION_ETHERTYPES.get(frame[offset] >> 4)
+
+        if ethertype == ETH_P_IP:
+            ver_ihl, flags_frag, proto, src, dst = _IPV4_HEADER.unpack_from(frame, offset)
+            fragment_offset = flags_frag & 0x1FFF
+            if fragment_offset:
+                if stats is not None:
+                    stats.fragment_skipped += 1
+                return None  # 非先頭フラグメント（ポート情報なし）
+            is_fragment = bool(flags_frag & 0x2000)
+            src_ip = socket.inet_ntoa(src)
+            dst_ip = socket.inet_ntoa(dst)
+            offset += (ver_ihl & 0x0F) * 4
+        elif ethertype == ETH_P_IPV6:
+            proto, src, dst = _IPV6_HEADER.unpack_from(frame, offset)
+            offset += 40
+            is_fragment = False
+            while proto in IPV6_EXTENSION_HEADERS or proto == IPV6_FRAGMENT_HEADER:
+                next_proto = frame[offset]
+                if proto == IPV6_FRAGMENT_HEADER:
+                    fragment, = _UINT16.unpack_from(frame, offset + 2)
+                    if fragment >> 3:
+                        if stats is not None:
+                            stats.fragment_skipped += 1
+                        return None
+                    is_fragment = bool(fragment & 0x1)
+                    offset += 8
+                else:
+                    offset += (frame[offset + 1] + 1) * 8
+                proto = next_proto
+            src_ip = socket.inet_ntop(socket.AF_INET6, src)
+            dst_ip = socket.inet_ntop(socket.AF_INET6, dst)
+        else:
+            return None
+
+        protocol = IP_PROTOCOLS.get(proto)
+        if protocol is None:
+            return None
+        src_port = dst_port = None
+        if protocol != 'ICMP':
+            src_port, dst_port = _PORTS.unpack_from(frame, offset)
+            if protocol == 'TCP' and frame[offset + 13] & TCP_RST:
+                if stats is not None:
+                    stats.rst_skipped += 1
+                return None
+    except (struct.error, IndexError):
+        return None  # 切り詰められたフレーム
+
+    return {
+        'timestamp': time.time(),
+        'size': length,
+        'protocol': protocol,
+        'src_ip': src_ip,
+        'dst_ip': dst_ip,
+        'src_port': src_port,
+        'dst_port': dst_port,
+        'is_fragment': is_fragment
+    }
+
+def build_capture_filter(min_port: int = MIN_SPAWN_PORT) -> str:
+    """Hubの弾幕生成ルールに対応するtcpdump形式のフィルタ式（build_bpf_program() と同じ条件）"""
+    ports = f"(dst portrange {min_port}-65535 or (dst port 0 and src portrange {min_port}-65535))"
+    # libpcapの vlan キーワードは以降の条件のオフセットを4バイトずらすため、必ず最後に置く
+    return (f"icmp or icmp6 or "
+            f"(ip and ip[6:2] & 0x1fff = 0 and ((tcp and tcp[13] & 0x04 = 0) or udp) and {ports}) or "
+            f"(ip6 and ((tcp and ip6[53] & 0x04 = 0) or udp) and {ports}) or "
+            f"(ip6 and (ip6[6] = 0 or ip6[6] = 43 or ip6[6] = 44 or ip6[6] = 60)) or "
+            f"vlan")
+
+def _assemble_bpf(program: List[tuple]) -> List[Tuple[int, int, int, int]]:
+    """ラベル（文字列）と (code, k, 真の飛び先, 偽の飛び先) の列をBPF命令列に変換"""
+    labels = {}
+    instructions = []
+    for item in program:
+        if isinstance(item, str):
+            labels[item] = len(instructions)
+        else:
+            instructions.append(item)
+    assembled = []
+    for i, (code, k, jt, jf) in enumerate(instructions):
+        jt = labels[jt] - i - 1 if jt else 0
+        jf = labels[jf] - i - 1 if jf else 0
+        assembled.append((code, jt, jf, k))
+    return assembled
+
+def build_bpf_program(min_port: int = MIN_SPAWN_PORT, linktype: int = DLT_EN10MB) -> List[Tuple[int, int, int, int]]:
+    """build_capture_filter() と同じ条件をclassic BPFで生成（libpcap不要）
+
+    linktypeはEthernet（DLT_EN10MB）かリンク層ヘッダなしのIP（DLT_RAW）。
+    VLANタグ付きフレームとIPv6拡張ヘッダ付きパケットは判定せずユーザー空間に渡す。
+    """
+    ldh, ldb, ldh_x, ldb_x, ldx_msh = 0x28, 0x30, 0x48, 0x50, 0xb1
+    jeq, jge, jset, ret, and_k = 0x15, 0x35, 0x45, 0x06, 0x54
+    if linktype == DLT_EN10MB:
+        ip = 14
+        link = [
+            (ldh, 12, None, None),
+            (jeq, ETH_P_IP, 'ipv4', None),
+            (jeq, ETH_P_IPV6, 'ipv6', None),
+            (jeq, ETH_P_VLAN[0], 'accept', None),
+            (jeq, ETH_P_VLAN[1], 'accept', 'drop'),
+        ]
+    elif linktype == DLT_RAW:
+        ip = 0
+        link = [
+            (ldb, 0, None, None),
+            (and_k, 0xF0, None, None),  # IPバージョン
+            (jeq, 0x40, 'ipv4', None),
+            (jeq, 0x60, 'ipv6', 'drop'),
+        ]
+    else:
+        raise ValueError(f"no BPF program for link type {linktype}")
+    return _assemble_bpf(link + [
+        'ipv4',
+        (ldh, ip + 6, None, None),
+        (jset, 0x1FFF, 'drop', None),  # 非先頭フラグメント
+        (ldb, ip + 9, None, None),
+        (jeq, 1, 'accept', None),  # ICMP
+        (jeq, 17, 'ipv4_ports', None),
+        (jeq, 6, None, 'drop'),
+        (ldx_msh, ip, None, None),  # X = IPヘッダ長
+        (ldb_x, ip + 13, None, None),
+        (jset, 0x04, 'drop', None),  # TCP RST
+        'ipv4_ports',
+        (ldx_msh, ip, None, None),
+        (ldh_x, ip + 2, None, None),
+        (jge, min_port, 'accept', None),
+        (jeq, 0, None, 'drop'),
+        (ldh_x, ip, None, None),
+        (jge, min_port, 'accept', 'drop'),
+
+        'ipv6',
+        (ldb, ip + 6, None, None),
+        (jeq, 58, 'accept', None),  # ICMPv6
+        (jeq, 17, 'ipv6_ports', None),
+        (jeq, 6, 'ipv6_tcp', None),
+        (jeq, 0, 'accept', None),  # 拡張ヘッダ
+        (jeq, 43, 'accept', None),
+        (jeq, 44, 'accept', None),
+        (jeq, 60, 'accept', 'drop'),
+        'ipv6_tcp',
+        (ldb, ip + 40 + 13, None, None),
+        (jset, 0x04, 'drop', None),
+        'ipv6_ports',
+        (ldh, ip + 40 + 2, None, None),
+        (jge, min_port, 'accept', None),
+        (jeq, 0, None, 'drop'),
+        (ldh, ip + 40, None, None),
+        (jge, min_port, 'accept', 'drop'),
+
+        'accept',
+        (ret, BPF_ACCEPT, None, None),
+        'drop',
+        (ret, 0, None, None),
+    ])
+
+def interface_linktype(interface: Optional[str]) -> Optional[int]:
+    """インターフェースのリンク層タイプ（/sys/class/net/<名前>/type のARPHRDから判定、未対応はNone）"""
+    if not interface:
+        return DLT_EN10MB
+    try:
+        with open(os.path.join(SYSFS_NET_DIR, interface, 'type')) as f:
+            hatype = int(f.read())
+    except (OSError, ValueError):
+        return DLT_EN10MB  # sysfsがない・読めない場合は従来通りEthernetとして扱う
+    return ARPHRD_LINKTYPES.get(hatype)
+
+def attach_bpf(sock: socket.socket, program: List[Tuple[int, int, int, int]]):
+    """BPF命令列をソケットに設定（SO_ATTACH_FILTER）"""
+    import ctypes
+    filters = ctypes.create_string_buffer(b''.join(struct.pack('HBBI', *insn) for insn in program))
+    fprog = struct.pack('HL', len(program), ctypes.addressof(filters))
+    sock.setsockopt(socket.SOL_SOCKET, SO_ATTACH_FILTER, fprog)
+
+# pcap / pcapng
+PCAP_MAGICS = {0xA1B2C3D4: 1e-6, 0xA1B23C4D: 1e-9}  # マジック → タイムスタンプ単位
+PCAPNG_SECTION_HEADER = 0x0A0D0D0A
+PCAPNG_BYTE_ORDER_MAGIC = 0x1A2B3C4D
+PCAPNG_INTERFACE_DESCRIPTION = 1
+PCAPNG_PACKET = 2  # 旧形式
+PCAPNG_SIMPLE_PACKET = 3
+PCAPNG_ENHANCED_PACKET = 6
+PCAPNG_OPTION_TSRESOL = 9
+
+def read_pcap_records(path: str):
+    """pcap/pcapngファイルを1レコードずつ読み出す（ファイル全体をメモリに載せない）
+
+    (タイムスタンプ秒, linktype, フレーム, 実パケット長) を順に返す。
+    """
+    with open(path, 'rb') as f:
+        head = f.read(4)
+        if len(head) < 4:
+            return
+        if struct.unpack('<I', head)[0] == PCAPNG_SECTION_HEADER:
+            yield from _read_pcapng(f)
+            return
+
+        for endian in '<>':
+            resolution = PCAP_MAGICS.get(struct.unpack(endian + 'I', head)[0])
+            if resolution is not None:
+                break
+        else:
+            raise ValueError(f"{path}: not a pcap or pcapng file")
+        linktype = struct.unpack(endian + '16xI', f.read(20))[0] & 0x0FFFFFFF
+        record = struct.Struct(endian + 'IIII')  # ts_sec, ts_frac, incl_len, orig_len
+        while True:
+            header = f.read(record.size)
+            if len(header) < record.size:
+                return
+            seconds, fraction, captured, length = record.unpack(header)
+            yield seconds + fraction * resolution, linktype, f.read(captured), length
+
+def _read_pcapng(f):
+    endian = '<'
+    interfaces: List[Tuple[int, float, int]] = []  # (linktype, タイムスタンプ単位, snaplen)
+    timestamp = 0.0
+    block_type = PCAPNG_SECTION_HEADER
+    while True:
+        # 先頭4バイト（ブロックタイプ）は読み込み済み
+        length_bytes = f.read(4)
+        if len(length_bytes) < 4:
+            return
+        if block_type == PCAPNG_SECTION_HEADER:
+            magic = f.read(4)
+            endian = '<' if struct.unpack('<I', magic)[0] == PCAPNG_BYTE_ORDER_MAGIC else '>'
+            total_length, = struct.unpack(endian + 'I', length_bytes)
+            body = magic + f.read(total_length - 12)
+            interfaces = []
+        else:
+            total_length, = struct.unpack(endian + 'I', length_bytes)
+            body = f.read(total_length - 8)
+        body = body[:-4]  # 末尾のブロック長
+
+        if block_type == PCAPNG_INTERFACE_DESCRIPTION:
+            linktype, snaplen = struct.unpack_from(endian + 'H2xI', body)
+            resolution = 1e-6
+            offset = 8
+            while offset + 4 <= len(body):
+                code, option_length = struct.unpack_from(endian + 'HH', body, offset)
+                if code == 0:
+                    break
+                if code == PCAPNG_OPTION_TSRESOL:
+                    value = body[offset + 4]
+                    resolution = 2.0 ** -(value & 0x7F) if value & 0x80 else 10.0 ** -value
+                offset += 4 + (option_length + 3) // 4 * 4
+            interfaces.append((linktype, resolution, snaplen))
+        elif block_type == PCAPNG_ENHANCED_PACKET:
+            interface, high, low, captured, length = struct.unpack_from(endian + '5I', body)
+            linktype, resolution, _ = interfaces[interface]
+            timestamp = ((high << 32) | low) * resolution
+            yield timestamp, linktype, body[20:20 + captured], length
+        elif block_type == PCAPNG_PACKET:
+            interface, high, low, captured, length = struct.unpack_from(endian + 'H2x4I', body)
+            linktype, resolution, _ = interfaces[interface]
+            timestamp = ((high << 32) | low) * resolution
+            yield timestamp, linktype, body[20:20 + captured], length
+        elif block_type == PCAPNG_SIMPLE_PACKET:
+            length, = struct.unpack_from(endian + 'I', body)
+            linktype, _, snaplen = interfaces[0]
+            yield timestamp, linktype, body[4:4 + min(length, snaplen or length)], length
+
+        type_bytes = f.read(4)
+        if len(type_bytes) < 4:
+            return
+        block_type, = struct.unpack(endian + 'I', type_bytes)
+
+MAX_FLOWS = 65536  # フローテーブルの上限（超過時は最も古いフローから削除）
+FLOW_EXPIRY_INTERVAL = 0.1  # 秒（期限切れフローの削除間隔）
+FLUSH_INTERVAL = 0.05  # 秒（最初のパケットからこの時間が経てばバッチが埋まらなくても送信）
+
+# Hubの生成目標（capture_stats.spawn_allowance.rate）への追従
+ADAPT_INTERVAL = 1.0  # 秒（レート制限・バッチサイズ・フラッシュ間隔の調整間隔）
+BATCH_PERIOD = 0.5  # 秒（生成目標でこの時間分のパケットを1バッチにまとめる）
+MIN_BATCH_SIZE = 1
+MAX_BATCH_SIZE = 50
+MAX_FLUSH_INTERVAL = 0.5  # 秒（生成目標が低い時のフラッシュ間隔の上限）
+BUFFER_OVERSAMPLE = 2.0  # 接続ごとのレート制限後に生成目標の何倍のパケットを残すか（間引きの選択肢）
+MIN_FLOW_INTERVAL = 0.05  # 秒（接続ごとのレート制限の下限）
+LATENCY_WINDOW = 1000  # キャプチャ→送信の遅延統計に使う直近のパケット数
+
+# パイプライン統計（--stats-socket、Hubへの capture_pipeline）
+PIPELINE_REPORT_INTERVAL = 10.0  # 秒
+HANDLER_TIME_BUCKETS_US = (1, 2, 5, 10, 20, 50, 100, 200, 500, 1000)  # ハンドラ処理時間ヒストグラムの上限（マイクロ秒）
+CAPTURE_THREAD_STAGES = ('captured', 'fragment_skipped', 'rst_skipped')  # キャプチャスレッドごとに数える段階
+CAPTURE_STAGES = ('captured', 'fragment_skipped', 'rst_skipped', 'rate_limited', 'buffered')  # キャプチャ側で数える段階
+PIPELINE_STAGE_ORDER = ('captured', 'fragment_skipped', 'rst_skipped', 'unsupported', 'rate_limited', 'buffered',
+                        'ring_overflow', 'buffer_overflow', 'batch_deferred', 'batch_dropped', 'spooled',
+                        'spool_dropped', 'sent', 'spool_sent')
+
+# フロー集計モード（--aggregate-flows）
+FLOW_WINDOW = 0.5  # 秒（フロー集計を送信する間隔）
+FLOW_SUMMARY_LIMIT = 256  # 1ウィンドウで送信するフロー数の上限（バイト数の多い順）
+
+# キャプチャプロセス → 送信プロセスの共有メモリリング（--capture-process）
+SHM_RING_SLOTS = 8192
+SHM_RING_HEADER_SIZE = 64  # head, tail, overflow（各uint64）, flow_interval（float64）+ 予備
+_SHM_COUNTER = struct.Struct('<Q')
+_SHM_FLOAT = struct.Struct('<d')
+_PACKET_RECORD = struct.Struct('<dIBBB16s16sHH')  # timestamp, size, protocol, flags, interface, src_ip, dst_ip, src_port, dst_port
+PROTOCOL_CODES = {'TCP': 1, 'UDP': 2, 'ICMP': 3}
+PROTOCOL_NAMES = {code: name for name, code in PROTOCOL_CODES.items()}
+RECORD_IPV6 = 0x01
+RECORD_FRAGMENT = 0x02
+RECORD_NO_PORTS = 0x04
+
+# Hubに接続できない間のディスクスプール（--spool）
+SPOOL_MAX_BYTES = 64 << 20  # スプール全体の上限（超えたら最も古いセグメントから削除）
+SPOOL_SEGMENT_BYTES = 1 << 20  # 1セグメントファイルの大きさ
+SPOOL_SEGMENT_FORMAT = 'spool-{:08d}.seg'
+SPOOL_INTERVAL = 0.1  # 秒（切断中に packet_buffer をスプールへ移す間隔、接続状態の確認間隔）
+SPOOL_DRAIN_INTERVAL = 0.5  # 秒（再接続後にスプールから送信する間隔）
+SPOOL_DRAIN_RATE = 20.0  # packets/s（再接続後のスプール送信レート、Hubの生成枠も超えない）
+
+# packet_data のバイナリ形式（packet_hub.py の PACKET_UPLOAD_* と一致させること）
+#   ヘッダ(8B): magic 'PU', version, IPv4レコード数, IPv6レコード数（uint16）
+#   IPv4レコード(16B) × IPv4数 → IPv6レコード(40B) × IPv6数
+#   レコード: protocol(PROTOCOL_CODES), interface(capture_auth.interfaces の番号+1、0: なし),
+#            src_port, dst_port, size, src_ip, dst_ip（ネットワークバイトオーダー）
+PACKET_ENCODINGS = ('json', 'binary')
+PACKET_UPLOAD_MAGIC = b'PU'
+PACKET_UPLOAD_VERSION = 1
+PACKET_UPLOAD_HEADER = struct.Struct('<2sBxHH')
+PACKET_UPLOAD_V4 = struct.Struct('<BBHHH4s4s')
+PACKET_UPLOAD_V6 = struct.Struct('<BBHHH16s16s')
+
+def packet_upload_info(packet_info: Dict[str, Any]) -> Dict[str, Any]:
+    """packet_data で送信するフィールド（タイムスタンプ・フローキーなどを除く）"""
+    packet_data = {
+        'protocol': packet_info['protocol'],
+        'src_port': packet_info['src_port'],
+        'dst_port': packet_info['dst_port'],
+        'size': packet_info['size'],
+        'src_ip': packet_info['src_ip'],
+        'dst_ip': packet_info['dst_ip']
+    }
+    if packet_info.get('interface'):
+        packet_data['interface'] = packet_info['interface']
+    return packet_data
+
+def flow_key(packet_info: Dict[str, Any]) -> tuple:
+    """双方向で同じになるフローキー（アドレスの小さい側を先にしたタプル）"""
+    src_ip = packet_info['src_ip']
+    dst_ip = packet_info['dst_ip']
+    if src_ip < dst_ip:
+        return (src_ip, packet_info['src_port'], dst_ip, packet_info['dst_port'], packet_info['protocol'])
+    return (dst_ip, packet_info['dst_port'], src_ip, packet_info['src_port'], packet_info['protocol'])
+
+class PipelineStats:
+    """キャプチャ→送信パイプラインの段階ごとのパケット数と、ハンドラ処理時間のヒストグラム"""
+
+    def __init__(self):
+        self.captured = 0          # ハンドラに届いたパケット
+        self.fragment_skipped = 0  # 非先頭フラグメント
+        self.rst_skipped = 0       # TCP RST
+        self.rate_limited = 0      # 接続ごとのレート制限
+        self.buffer_overflow = 0   # packet_buffer が満杯
+        self.batch_deferred = 0    # 同一接続の上限でバッチから持ち越し
+        self.batch_dropped = 0     # 2回目の持ち越しで破棄
+        self.spooled = 0           # Hubに接続できない間にスプールへ保存
+        self.spool_dropped = 0     # スプールの上限超過で削除
+        self.sent = 0              # Hubに送信
+        self.spool_sent = 0        # 再接続後にスプールから送信
+        self.handler_counts = [0] * (len(HANDLER_TIME_BUCKETS_US) + 1)
+        self.handler_time_us = 0.0
+
+    def observe_handler(self, seconds: float):
+        elapsed_us = seconds * 1e6
+        self.handler_counts[bisect.bisect_left(HANDLER_TIME_BUCKETS_US, elapsed_us)] += 1
+        self.handler_time_us += elapsed_us
+
+    def add_capture_counts(self, other: 'PipelineStats'):
+        """キャプチャスレッドで数える段階（CAPTURE_THREAD_STAGES）とハンドラ処理時間を加算"""
+        for stage in CAPTURE_THREAD_STAGES:
+            setattr(self, stage, getattr(self, stage) + getattr(other, stage))
+        self.handler_counts = [a + b for a, b in zip(self.handler_counts, other.handler_counts)]
+        self.handler_time_us += other.handler_time_us
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            'stages': {
+                'captured': self.captured,
+                'fragment_skipped': self.fragment_skipped,
+                'rst_skipped': self.rst_skipped,
+                'rate_limited': self.rate_limited,
+                'buffer_overflow': self.buffer_overflow,
+                'batch_deferred': self.batch_deferred,
+                'batch_dropped': self.batch_dropped,
+                'spooled': self.spooled,
+                'spool_dropped': self.spool_dropped,
+                'sent': self.sent,
+                'spool_sent': self.spool_sent
+            },
+            'handler_time_us': {
+                'buckets': list(HANDLER_TIME_BUCKETS_US),
+                'counts': list(self.handler_counts),
+                'sum': round(self.handler_time_us, 1)
+            }
+        }
+
+def histogram_percentile(buckets: List[float], counts: List[int], q: float) -> Optional[float]:
+    """ヒストグラムからq分位点が含まれるバケットの上限を返す（最大バケットを超える場合はinf）"""
+    total = sum(counts)
+    if not total:
+        return None
+    threshold = q * total
+    cumulative = 0
+    for bound, count in zip(list(buckets) + [float('inf')], counts):
+        cumulative += count
+        if cumulative >= threshold:
+            return bound
+    return float('inf')
+
+class FlowTable:
+    """フローごとの最終パケット時刻（接続単位のレート制限用）
+
+    最終更新順のOrderedDictで保持し、期限切れ・上限超過のフローは古い側から少しずつ削除する
+    （定期的な全体の作り直しをしない）。
+    """
+
+    def __init__(self, min_interval: float, ttl: float, max_flows: int = MAX_FLOWS):
+        self.min_interval = min_interval
+        self.ttl = ttl
+        self.max_flows = max_flows
+        self.last_seen: 'OrderedDict[tuple, float]' = OrderedDict()
+        self.evicted = 0  # 上限超過で削除したフロー数
+        self.next_expiry = 0.0
+
+    def __len__(self) -> int:
+        return len(self.last_seen)
+
+    def allow(self, key: tuple, now: float) -> bool:
+        """前回のパケットからmin_interval以上経過していれば記録してTrue"""
+        last_seen = self.last_seen
+        last = last_seen.get(key)
+        if last is not None:
+            if now - last < self.min_interval:
+                return False
+            last_seen.move_to_end(key)
+        last_seen[key] = now
+
+        if len(last_seen) > self.max_flows:
+            last_seen.popitem(last=False)
+            self.evicted += 1
+        if now >= self.next_expiry:
+            self.expire(now)
+        return True
+
+    def expire(self, now: float):
+        """ttlを過ぎたフローを古い順に削除（削除した分だけのコスト）"""
+        last_seen = self.last_seen
+        while last_seen:
+            oldest_key = next(iter(last_seen))
+            if now - last_seen[oldest_key] < self.ttl:
+                break
+            del last_seen[oldest_key]
+        self.next_expiry = now + FLOW_EXPIRY_INTERVAL
+
+def encode_packet_upload(packets: List[Dict[str, Any]], interface_index: Dict[str, int]) -> bytes:
+    """送信するパケット情報をバイナリ packet_data に変換"""
+    v4_records = []
+    v6_records = []
+    for packet in packets:
+        protocol = PROTOCOL_CODES[packet['protocol']]
+        interface = interface_index.get(packet.get('interface'), 0)
+        src_port = packet['src_port'] or 0
+        dst_port = packet['dst_port'] or 0
+        size = min(packet['size'], 0xFFFF)
+        if ':' in packet['src_ip']:
+            v6_records.append(PACKET_UPLOAD_V6.pack(
+                protocol, interface, src_port, dst_port, size,
+                socket.inet_pton(socket.AF_INET6, packet['src_ip']),
+                socket.inet_pton(socket.AF_INET6, packet['dst_ip'])))
+        else:
+            v4_records.append(PACKET_UPLOAD_V4.pack(
+                protocol, interface, src_port, dst_port, size,
+                socket.inet_aton(packet['src_ip']), socket.inet_aton(packet['dst_ip'])))
+    header = PACKET_UPLOAD_HEADER.pack(PACKET_UPLOAD_MAGIC, PACKET_UPLOAD_VERSION, len(v4_records), len(v6_records))
+    return header + b''.join(v4_records) + b''.join(v6_records)
+
+def resolve_interfaces(value: Optional[str]) -> List[Optional[str]]:
+    """--interface の値をキャプチャするインターフェースのリストに変換
+
+    カンマ区切りで複数指定可能。'any' はループバック以外の全インターフェース。
+    """
+    if not value:
+        if sys.platform == 'darwin':
+            return ['en0']  # macOS default
+        if sys.platform.startswith('linux'):
+            return ['eth0']  # Linux default
+        return [None]  # Windows - auto
+    if value == 'any':
+        if not hasattr(socket, 'if_nameindex'):
+            return [None]
+        names = [name for _, name in sorted(socket.if_nameindex()) if name != 'lo']
+        return names or [None]
+    return [name.strip() for name in value.split(',') if name.strip()]
+
+def pack_packet_record(buf, offset: int, packet_info: Dict[str, Any], interface_index: Dict[Optional[str], int]):
+    """packet_info を固定長レコード（_PACKET_RECORD）として書き込み"""
+    flags = 0
+    if ':' in packet_info['src_ip']:
+        flags |= RECORD_IPV6
+        src = socket.inet_pton(socket.AF_INET6, packet_info['src_ip'])
+        dst = socket.inet_pton(socket.AF_INET6, packet_info['dst_ip'])
+    else:
+        src = socket.inet_aton(packet_info['src_ip'])
+        dst = socket.inet_aton(packet_info['dst_ip'])
+    if packet_info.get('is_fragment'):
+        flags |= RECORD_FRAGMENT
+    if packet_info['src_port'] is None:
+        flags |= RECORD_NO_PORTS
+    _PACKET_RECORD.pack_into(
+        buf, offset, packet_info['timestamp'], packet_info['size'], PROTOCOL_CODES[packet_info['protocol']], flags,
+        interface_index.get(packet_info.get('interface'), 0), src, dst, packet_info['src_port'] or 0, packet_info['dst_port'] or 0)
+
+def unpack_packet_record(buf, offset: int, interfaces: List[Optional[str]]) -> Dict[str, Any]:
+    """固定長レコードを packet_info に戻す（interfaces はレコードのインターフェース番号 → 名前）"""
+    timestamp, size, protocol, flags, interface, src, dst, src_port, dst_port = _PACKET_RECORD.unpack_from(buf, offset)
+    if flags & RECORD_IPV6:
+        src_ip = socket.inet_ntop(socket.AF_INET6, src)
+        dst_ip = socket.inet_ntop(socket.AF_INET6, dst)
+    else:
+        src_ip = socket.inet_ntoa(src[:4])
+        dst_ip = socket.inet_ntoa(dst[:4])
+    no_ports = flags & RECORD_NO_PORTS
+    packet_info = {
+        'timestamp': timestamp,
+        'size': size,
+        'protocol': PROTOCOL_NAMES[protocol],
+        'src_ip': src_ip,
+        'dst_ip': dst_ip,
+        'src_port': None if no_ports else src_port,
+        'dst_port': None if no_ports else dst_port,
+        'is_fragment': bool(flags & RECORD_FRAGMENT),
+        'interface': interfaces[interface] if interface < len(interfaces) else None
+    }
+    packet_info['flow_key'] = flow_key(packet_info)
+    return packet_info
+
+class SharedPacketRing:
+    """固定長パケットレコードの単一生産者・単一消費者リング（multiprocessing.shared_memory上）
+
+    生産者（キャプチャプロセス）はhead、消費者（送信プロセス）はtailだけを進める。
+    満杯時は新しいパケットを捨ててoverflowに数える。生産者側はdequeと同じ append/len で使える。
+    """
+
+    maxlen = None  # dequeのmaxlenとは異なり、溢れた分はoverflowで数える
+
+    def __init__(self, name: Optional[str] = None, slots: int = SHM_RING_SLOTS,
+                 interfaces: List[Optional[str]] = ()):
+        create = name is None
+        self.slots = slots
+        # インターフェース名はリスト内の番号+1で記録（0: なし）
+        self.interfaces = [None] + list(interfaces)
+        self.interface_index = {name: index for index, name in enumerate(self.interfaces)}
+        self.shm = shared_memory.SharedMemory(
+            name=name, create=create, size=SHM_RING_HEADER_SIZE + slots * _PACKET_RECORD.size)
+        self.buf = self.shm.buf
+        if create:
+            self.buf[:SHM_RING_HEADER_SIZE] = bytes(SHM_RING_HEADER_SIZE)
+
+    @property
+    def name(self) -> str:
+        return self.shm.name
+
+    def _counter(self, offset: int) -> int:
+        return _SHM_COUNTER.unpack_from(self.buf, offset)[0]
+
+    @property
+    def overflow(self) -> int:
+        return self._counter(16)
+
+    @property
+    def flow_interval(self) -> float:
+        """送信プロセスが調整した接続ごとのレート制限（0: 未設定）"""
+        return _SHM_FLOAT.unpack_from(self.buf, 24)[0]
+
+    @flow_interval.setter
+    def flow_interval(self, value: float):
+        _SHM_FLOAT.pack_into(self.buf, 24, value)
+
+    def __len__(self) -> int:
+        return self._counter(0) - self._counter(8)
+
+    def append(self, packet_info: Dict[str, Any]):
+        """レコードを書き込み（生産者側）"""
+        head = self._counter(0)
+        if head - self._counter(8) >= self.slots:
+            _SHM_COUNTER.pack_into(self.buf, 16, self.overflow + 1)
+            return
+        pack_packet_record(self.buf, SHM_RING_HEADER_SIZE + (head % self.slots) * _PACKET_RECORD.size,
+                           packet_info, self.interface_index)
+        _SHM_COUNTER.pack_into(self.buf, 0, head + 1)  # レコードを書いてからheadを公開
+
+    def pop_many(self, limit: int) -> List[Dict[str, Any]]:
+        """最大limit件のレコードを packet_info として読み出し（消費者側）"""
+        tail = self._counter(8)
+        count = min(limit, self._counter(0) - tail)
+        packets = [unpack_packet_record(self.buf, SHM_RING_HEADER_SIZE + (index % self.slots) * _PACKET_RECORD.size,
+                                        self.interfaces)
+                   for index in range(tail, tail + count)]
+        _SHM_COUNTER.pack_into(self.buf, 8, tail + count)
+        return packets
+
+    def close(self):
+        self.buf = None
+        self.shm.close()
+
+class PacketSpool:
+    """Hubに接続できない間のパケットを固定長レコード（_PACKET_RECORD）で追記するディスク上のセグメントログ
+
+    連番のセグメントファイルに追記し、古いセグメントから読み出す。セグメント数が上限を超えると
+    最も古いセグメントを削除して dropped に数える（メモリ使用量は停止期間によらず一定）。
+    前回の実行で残ったセグメントも古い順に送信する。
+    """
+
+    def __init__(self, directory: str, max_bytes: int = SPOOL_MAX_BYTES, interfaces: List[Optional[str]] = ()):
+        os.makedirs(directory, exist_ok=True)
+        self.directory = directory
+        self.max_segments = max(2, max_bytes // SPOOL_SEGMENT_BYTES)
+        # インターフェース名はリスト内の番号+1で記録（0: なし）
+        self.interfaces = [None] + list(interfaces)
+        self.interface_index = {name: index for index, name in enumerate(self.interfaces)}
+        self.segments = deque(sorted(
+            int(name[6:-4]) for name in os.listdir(directory) if name.startswith('spool-') and name.endswith('.seg')))
+        # セグメントごとの有効バイト数（書き込み途中で終了した端数のレコードは使わない）
+        self.sizes = {segment: os.path.getsize(self.segment_path(segment)) // _PACKET_RECORD.size * _PACKET_RECORD.size
+                      for segment in self.segments}
+        self.pending = sum(self.sizes.values()) // _PACKET_RECORD.size
+        self.read_offset = 0  # 最も古いセグメント内の読み出し位置
+        self.dropped = 0
+        self.writer = None
+        self.open_segment(self.segments[-1] + 1 if self.segments else 0)
+
+    def segment_path(self, segment: int) -> str:
+        return os.path.join(self.directory, SPOOL_SEGMENT_FORMAT.format(segment))
+
+    def open_segment(self, segment: int):
+        if self.writer is not None:
+            self.writer.close()
+        self.writer = open(self.segment_path(segment), 'wb')
+        self.segments.append(segment)
+        self.sizes[segment] = 0
+
+    def remove_oldest(self):
+        segment = self.segments.popleft()
+        del self.sizes[segment]
+        self.read_offset = 0
+        os.unlink(self.segment_path(segment))
+
+    def __len__(self) -> int:
+        return self.pending
+
+    def append_many(self, packets: List[Dict[str, Any]]) -> int:
+        """パケットをスプールに追記し、上限超過で削除したレコード数を返す"""
+        data = bytearray(len(packets) * _PACKET_RECORD.size)
+        for index, packet_info in enumerate(packets):
+            pack_packet_record(data, index * _PACKET_RECORD.size, packet_info, self.interface_index)
+        self.writer.write(data)
+        self.writer.flush()
+        segment = self.segments[-1]
+        self.sizes[segment] += len(data)
+        self.pending += len(packets)
+        if self.sizes[segment] >= SPOOL_SEGMENT_BYTES:
+            self.open_segment(segment + 1)
+
+        evicted = 0
+        while len(self.segments) > self.max_segments:
+            evicted += (self.sizes[self.segments[0]] - self.read_offset) // _PACKET_RECORD.size
+            self.remove_oldest()
+        self.pending -= evicted
+        self.dropped += evicted
+        return evicted
+
+    def peek(self, limit: int) -> List[Dict[str, Any]]:
+        """古い順に最大limit件を読み出す（送信できたら commit で読み出し位置を進める）"""
+        packets = []
+        offset = self.read_offset
+        for segment in self.segments:
+            remaining = min(self.sizes[segment] - offset, (limit - len(packets)) * _PACKET_RECORD.size)
+            if remaining > 0:
+                with open(self.segment_path(segment), 'rb') as f:
+                    f.seek(offset)
+                    data = f.read(remaining)
+                packets.extend(unpack_packet_record(data, position, self.interfaces)
+                               for position in range(0, len(data) - _PACKET_RECORD.size + 1, _PACKET_RECORD.size))
+            if len(packets) >= limit:
+                break
+            offset = 0
+        return packets
+
+    def commit(self, count: int):
+        """peek で読み出したcount件を送信済みにする（読み終えたセグメントは削除）"""
+        self.pending -= count
+        self.read_offset += count * _PACKET_RECORD.size
+        while len(self.segments) > 1 and self.read_offset >= self.sizes[self.segments[0]]:
+            offset = self.read_offset - self.sizes[self.segments[0]]
+            self.remove_oldest()
+            self.read_offset = offset
+        segment = self.segments[0]
+        if self.read_offset >= self.sizes[segment]:
+            # 書き込み中のセグメントを読み終えたら先頭から書き直す
+            self.writer.truncate(0)
+            self.writer.seek(0)
+            self.sizes[segment] = 0
+            self.read_offset = 0
+
+    def close(self):
+        self.writer.close()
+
+def run_capture_process(ring_name: str, slots: int, wakeup, options: Dict[str, Any]):
+    """キャプチャプロセスのエントリポイント（解析・接続単位のレート制限後に共有メモリリングへ書き込む）"""
+    client = PacketCaptureClient(**options)
+    ring = SharedPacketRing(ring_name, slots, client.interfaces)
+    client.packet_buffer = ring
+    send_lock = threading.Lock()  # キャプチャスレッドの起床通知と統計送信が同じパイプを使う
+
+    def notify_sender():
+        try:
+            with send_lock:
+                wakeup.send_bytes(b'\x01')
+        except OSError:
+            client.is_capturing = False  # 送信プロセス終了
+
+    client.notify_sender = notify_sender
+    if client.aggregate_flows:
+        def record_flow(key: tuple, packet_info: Dict[str, Any]):
+            # 集計は送信プロセス側で行う（全パケットをリングに書き、空から埋まり始めた時だけ起こす）
+            ring.append(packet_info)
+            if len(ring) == 1:
+                notify_sender()
+        client.record_flow = record_flow
+    try:
+        # キャプチャ側の統計は1秒ごとにパイプで送信プロセスへ渡す
+        workers = client.start_capture_workers()
+        while any(worker.is_alive() for worker in workers) and client.is_capturing:
+            time.sleep(1.0)
+            if ring.flow_interval:
+                client.flow_table.min_interval = ring.flow_interval
+            snapshot = client.capture_stats_total().to_dict()
+            snapshot['stages']['buffered'] = client.packet_count
+            with send_lock:
+                wakeup.send_bytes(json.dumps(snapshot).encode())
+    except (KeyboardInterrupt, OSError):
+        pass
+    finally:
+        ring.close()
+
+class HubDiscoveryProtocol(asyncio.DatagramProtocol):
+    """DISCOVER に対する ANNOUNCE を集める（送信から受信までの時間をRTTとして記録）"""
+
+    def __init__(self):
+        self.sent_at = 0.0
+        self.hubs: Dict[Tuple[str, int], Dict[str, Any]] = {}
+
+    def datagram_received(self, data: bytes, addr):
+        received_at = time.perf_counter()
+        try:
+            message = json.loads(data.decode('utf-8'))
+        except (UnicodeDecodeError, ValueError):
+            return
+        if message.get('type') != 'ANNOUNCE':
+            return
+        # Hubが自分のIPを取得できなかった場合（localhost）は応答元のアドレスを使う
+        host = message.get('host')
+        if not host or host == 'localhost':
+            host = addr[0]
+        port = message.get('port')
+        key = (host, port)
+        if key not in self.hubs:
+            self.hubs[key] = dict(message, host=host, rtt=received_at - self.sent_at)
+
+    def error_received(self, exc):
+        print(f"Discovery error: {exc}")
+
+
+def hub_cost(hub: Dict[str, Any]) -> float:
+    """Hubの選択コスト（RTT + キャプチャクライアント数の重みを、Hubの生成目標の絞り具合で割る）"""
+    cost = hub['rtt'] + hub.get('captures_active', 0) * DISCOVERY_CAPTURE_COST
+    return cost / max(DISCOVERY_MIN_SCALE, hub.get('spawn_scale', 1.0))
+
+
+async def discover_hubs(window: float = DISCOVERY_WINDOW) -> List[Dict[str, Any]]:
+    """マルチキャストでHubを検索し、window秒の間に応答した全Hubをコストの低い順に返す"""
+    sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    try:
+        transport, protocol = await asyncio.get_running_loop().create_datagram_endpoint(
+            HubDiscoveryProtocol, sock=sock)
+    except OSError as e:
+        sock.close()
+        print(f"Discovery error: {e}")
+        return []
+    try:
+        protocol.sent_at = time.perf_counter()
+        transport.sendto(json.dumps({
+            'type': 'DISCOVER',
+            'service': SERVICE_NAME,
+            'client_type': 'capture'
+        }).encode('utf-8'), (MULTICAST_GROUP, MULTICAST_PORT))
+        await asyncio.sleep(window)
+    finally:
+        transport.close()
+    return sorted(protocol.hubs.values(), key=hub_cost)
+
 
 class PacketCaptureClient:
-    def __init__(self, hub_url: str = None, source_name: str = None):
+    def __init__(self, hub_url: str = None, source_name: str = None, interface: str = None,
+                 capture_backend: str = 'scapy', capture_filter: Optional[str] = None,
+                 ring_block_size: int = RING_BLOCK_SIZE, ring_block_count: int = RING_BLOCK_COUNT,
+                 ring_frame_size: int = RING_FRAME_SIZE, pcap_file: Optional[str] = None,
+                 replay_speed: float = 1.0, replay_loop: bool = False, capture_process: bool = False,
+                 shm_slots: int = SHM_RING_SLOTS, packet_encoding: str = 'json',
+                 aggregate_flows: bool = False, flow_window: float = FLOW_WINDOW,
+                 stats_socket: Optional[str] = None, spool_dir: Optional[str] = None,
+                 spool_bytes: int = SPOOL_MAX_BYTES, spool_rate: float = SPOOL_DRAIN_RATE):
         self.hub_url = hub_url or 'ws://localhost:8766'
+        # 接続候補のHub（自動検索時はコストの低い順、切断時は待たずに次の候補へ切り替える）
+        self.hub_urls = [self.hub_url]
+        self.hub_index = 0
+        self.auto_discover = False
+        self.reconnecting = False
+        # Hubに接続できない間のディスクスプール（run で作成、キャプチャプロセスでは使わない）
+        self.spool_dir = spool_dir
+        self.spool_bytes = spool_bytes
+        self.spool_rate = spool_rate
+        self.spool: Optional[PacketSpool] = None
+        # フロー集計モード（パケットの代わりにウィンドウごとのフロー集計を送信）
+        self.aggregate_flows = aggregate_flows
+        self.flow_window = flow_window
+        self.flow_counters: Dict[tuple, list] = {}  # フローキー -> [packet_info, packets, bytes, first_seen, last_seen]
+        self.flows_sent = 0
+        self.flows_truncated = 0  # FLOW_SUMMARY_LIMIT を超えて送信しなかったフロー数
+        # packet_data の形式（binaryはHubが capture_ack で受け入れるまでJSONで送信）
+        self.packet_encoding = packet_encoding
+        self.binary_upload = False
+        # キャプチャを別プロセスで実行（GILを共有しない）
+        self.capture_process = capture_process
+        self.shm_slots = shm_slots
+        self.shared_ring: Optional[SharedPacketRing] = None
+        self.stats = PipelineStats()
+        # キャプチャスレッドごとの統計（複数インターフェースのスレッドが同じカウンタを += で競合しないように）
+        self.thread_stats = threading.local()
+        self.worker_stats: List[PipelineStats] = []
+        self.capture_stats: Optional[Dict[str, Any]] = None  # キャプチャプロセスから届いた統計
+        self.stats_socket: Optional[str] = stats_socket  # ローカル統計ソケット（Unixソケットのパスまたはポート番号）
+        self.interface = interface
+        # カンマ区切り・'any' を展開（インターフェースごとにキャプチャワーカーを起動）
+        self.interfaces = resolve_interfaces(interface)
+        self.announced_interfaces = [] if pcap_file else [name for name in self.interfaces if name]
+        self.interface_index = {name: index + 1 for index, name in enumerate(self.announced_interfaces)}
+        # ファイル再生（指定時はライブキャプチャの代わりに使う）
+        self.pcap_file = pcap_file
+        self.replay_speed = replay_speed  # 0で待ち時間なし
+        self.replay_loop = replay_loop
+        self.capture_backend = capture_backend
+        self.ring_block_size = ring_block_size
+        self.ring_block_count = ring_block_count
+        self.ring_frame_size = ring_frame_size
+        self.kernel_packets = 0  # PACKET_STATISTICS の累計（ringバックエンド）
+        self.kernel_drops = 0
+        # None: Hubのルールから生成したBPF、'': フィルタなし、それ以外: tcpdump形式の式（libpcapで変換）
+        self.capture_filter = capture_filter
         self.source_name = source_name or f'{socket.gethostname()}_capture'
         self.source_id = f'capture_{int(time.time())}'
         self.ws: Optional[WebSocketClientProtocol] = None
@@ -35,17 +994,60 @@ class PacketCaptureClient:
         self.reconnect_attempts = 0
         self.max_reconnect_attempts = 10
         # Deduplication and rate limiting
-        self.connection_cache = {}  # Stores last packet time per connection
         self.connection_rate_limit = 0.3  # Minimum seconds between packets from same connection (300ms)
-        self.cache_cleanup_interval = 5.0  # Clean cache every 5 seconds
-        self.last_cache_cleanup = time.time()
-        self.skipped_packets = 0  # Debug counter
+        self.cache_cleanup_interval = 5.0  # Forget connections idle for 5 seconds
+        self.flow_table = FlowTable(self.connection_rate_limit, self.cache_cleanup_interval)
+        self.enqueue_lock = threading.Lock()  # 全キャプチャワーカーでフローテーブルとバッファを共有
+        # インターフェースごとのキャプチャスレッドの状態（'running' / 'stopped' / 'failed'）
+        self.worker_states: Dict[Optional[str], str] = {}
+        self.worker_lock = threading.Lock()
+        # 送信タスクの起床（キャプチャスレッドから call_soon_threadsafe で通知）
+        self.loop: Optional[asyncio.AbstractEventLoop] = None
+        self.packets_available: Optional[asyncio.Event] = None
+        self.sender_wakeups = 0
+        self.send_latencies = deque(maxlen=LATENCY_WINDOW)  # キャプチャ→送信（秒）
+        # Hubから通知される生成枠（capture_stats の spawn_allowance）
+        self.max_batch_size = 15
+        self.spawn_rate: Optional[float] = None
+        self.spawn_available = 0.0
+        self.spawn_allowance_time = 0.0
+        self.flush_interval = FLUSH_INTERVAL  # 生成目標に合わせて adapt_to_spawn_target で調整
         
-    def packet_handler(self, packet):
-        """パケットキャプチャハンドラ"""
+    def packet_handler(self, packet, interface: Optional[str] = None):
+        """パケットキャプチャハンドラ（scapyバックエンド用）"""
         if not self.is_capturing:
             return
-        
+        started = time.perf_counter()
+        stats = self.capture_thread_stats()
+        stats.captured += 1
+        packet_info = self.parse_packet(packet, interface, stats)
+        if packet_info is not None:
+            self.enqueue_packet_info(packet_info)
+        stats.observe_handler(time.perf_counter() - started)
+    
+    def capture_thread_stats(self) -> PipelineStats:
+        """呼び出したキャプチャスレッド専用の PipelineStats（初回に作成して worker_stats に登録）"""
+        stats = getattr(self.thread_stats, 'stats', None)
+        if stats is None:
+            stats = self.thread_stats.stats = PipelineStats()
+            with self.enqueue_lock:
+                self.worker_stats.append(stats)
+        return stats
+    
+    def capture_stats_total(self) -> PipelineStats:
+        """self.stats に全キャプチャスレッドの統計を合算したもの"""
+        total = PipelineStats()
+        total.__dict__.update(self.stats.__dict__)
+        with self.enqueue_lock:
+            workers = list(self.worker_stats)
+        for stats in workers:
+            total.add_capture_counts(stats)
+        return total
+    
+    def parse_packet(self, packet, interface: Optional[str] = None,
+                     stats: Optional[PipelineStats] = None) -> Optional[Dict[str, Any]]:
+        """scapyのパケットから packet_info を抽出（弾幕にならないパケットはNone）"""
+        stats = stats or self.capture_thread_stats()
         packet_info = {
             'timestamp': time.time(),
             'size': len(packet),
@@ -54,7 +1056,8 @@ class PacketCaptureClient:
             'dst_ip': None,
             'src_port': None,
             'dst_port': None,
-            'is_fragment': False
+            'is_fragment': False,
+            'interface': interface
         }
         
         if packet.haslayer(IP):
@@ -70,7 +1073,8 @@ class PacketCaptureClient:
             # Skip non-first fragments (they don't have port info)
             if is_fragmented and ip_layer.frag > 0:
                 # This is not the first fragment, skip it
-                return
+                stats.fragment_skipped += 1
+                return None
             
             if packet.haslayer(TCP):
                 packet_info['protocol'] = 'TCP'
@@ -80,7 +1084,8 @@ class PacketCaptureClient:
                 tcp_layer = packet[TCP]
                 # Skip retransmissions and duplicates (RST, duplicate ACKs)
                 if tcp_layer.flags & 0x04:  # RST flag
-                    return
+                    stats.rst_skipped += 1
+                    return None
             elif packet.haslayer(UDP):
                 packet_info['protocol'] = 'UDP'
                 packet_info['src_port'] = packet[UDP].sport
@@ -89,50 +1094,190 @@ class PacketCaptureClient:
                 packet_info['protocol'] = 'ICMP'
         
         if packet_info['protocol']:  # プロトコルが識別できた場合のみ
-            current_time = time.time()
-            
-            # Create connection identifier (bidirectional)
-            # Sort IPs and ports to handle bidirectional traffic
-            if packet_info['src_ip'] < packet_info['dst_ip']:
-                conn_id = f"{packet_info['src_ip']}:{packet_info['src_port']}-" \
-                         f"{packet_info['dst_ip']}:{packet_info['dst_port']}-" \
-                         f"{packet_info['protocol']}"
-            else:
-                conn_id = f"{packet_info['dst_ip']}:{packet_info['dst_port']}-" \
-                         f"{packet_info['src_ip']}:{packet_info['src_port']}-" \
-                         f"{packet_info['protocol']}"
-            
-            # Clean up old connections periodically
-            if current_time - self.last_cache_cleanup > self.cache_cleanup_interval:
-                # Remove connections older than cleanup interval
-                self.connection_cache = {
-                    k: v for k, v in self.connection_cache.items()
-                    if current_time - v < self.cache_cleanup_interval
-                }
-                self.last_cache_cleanup = current_time
-            
+            return packet_info
+        return None
+    
+    def handle_frame(self, frame, length: int, interface: Optional[str] = None, linktype: int = DLT_EN10MB):
+        """生フレームのハンドラ（raw/ringバックエンド用）"""
+        if not self.is_capturing:
+            return
+        started = time.perf_counter()
+        stats = self.capture_thread_stats()
+        stats.captured += 1
+        packet_info = parse_frame(frame, length, linktype, stats)
+        if packet_info is not None:
+            packet_info['interface'] = interface
+            self.enqueue_packet_info(packet_info)
+        stats.observe_handler(time.perf_counter() - started)
+    
+    def enqueue_packet_info(self, packet_info: Dict[str, Any]):
+        """接続ごとのレート制限を通過したパケット情報をバッファに追加"""
+        # 双方向のフローキー（バッチ送信時の接続数制限でも再利用）
+        key = flow_key(packet_info)
+        
+        if self.aggregate_flows:
+            # 全パケットを集計するため接続ごとのレート制限は行わない
+            with self.enqueue_lock:
+                self.record_flow(key, packet_info)
+                self.packet_count += 1
+            return
+        
+        with self.enqueue_lock:
             # Check rate limit for this connection
-            if conn_id in self.connection_cache:
-                last_packet_time = self.connection_cache[conn_id]
-                time_since_last = current_time - last_packet_time
-                
-                # Skip if too soon since last packet from this connection
-                if time_since_last < self.connection_rate_limit:
-                    self.skipped_packets += 1
-                    if self.skipped_packets % 100 == 0:  # Log every 100 skipped packets
-                        pass  # print(f"Rate limited: Skipped {self.skipped_packets} packets (last: {conn_id[:30]}...)")
-                    return  # Rate limited
+            if not self.flow_table.allow(key, packet_info['timestamp']):
+                self.stats.rate_limited += 1
+                return  # Rate limited
             
-            # Update last packet time for this connection
-            self.connection_cache[conn_id] = current_time
+            packet_info['flow_key'] = key
             
             # Add to buffer
+            if len(self.packet_buffer) == self.packet_buffer.maxlen:
+                self.stats.buffer_overflow += 1  # 最も古いパケットが押し出される
             self.packet_buffer.append(packet_info)
             self.packet_count += 1
+            
+            # バッファが空から埋まり始めた時とバッチ1回分溜まった時だけ送信タスクを起こす
+            size = len(self.packet_buffer)
+        if size == 1 or size == self.max_batch_size:
+            self.notify_sender()
+    
+    def record_flow(self, key: tuple, packet_info: Dict[str, Any]):
+        """フローのパケット数・バイト数・最初/最後の時刻を更新"""
+        counters = self.flow_counters.get(key)
+        timestamp = packet_info['timestamp']
+        if counters is None:
+            self.flow_counters[key] = [packet_info, 1, packet_info['size'], timestamp, timestamp]
+        else:
+            counters[1] += 1
+            counters[2] += packet_info['size']
+            counters[4] = timestamp
+    
+    def take_flow_summaries(self) -> List[Dict[str, Any]]:
+        """現在のウィンドウのフロー集計を取り出して送信形式に変換（バイト数の多い順）"""
+        with self.enqueue_lock:
+            counters, self.flow_counters = self.flow_counters, {}
+        flows = sorted(counters.values(), key=lambda counter: counter[2], reverse=True)
+        if len(flows) > FLOW_SUMMARY_LIMIT:
+            self.flows_truncated += len(flows) - FLOW_SUMMARY_LIMIT
+            flows = flows[:FLOW_SUMMARY_LIMIT]
+        summaries = []
+        for packet_info, packets, size, first_seen, last_seen in flows:
+            summary = {
+                'protocol': packet_info['protocol'],
+                'src_ip': packet_info['src_ip'],
+                'dst_ip': packet_info['dst_ip'],
+                'src_port': packet_info['src_port'],
+                'dst_port': packet_info['dst_port'],
+                'packets': packets,
+                'bytes': size,
+                'first_seen': int(first_seen * 1000),
+                'last_seen': int(last_seen * 1000)
+            }
+            if packet_info.get('interface'):
+                summary['interface'] = packet_info['interface']
+            summaries.append(summary)
+        return summaries
     
-    def start_capture(self, interface: str = None):
-        """パケットキャプチャ開始"""
+    async def send_flow_summaries(self):
+        """flow_window ごとにフロー集計を送信（フロー集計モード）"""
+        self.loop = asyncio.get_running_loop()
+        self.packets_available = asyncio.Event()
+        last_stats_time = time.time()
+        stats_interval = 10.0
+        reported_packets = 0
+        
+        while True:
+            try:
+                # ウィンドウ終了まで共有メモリリングのパケットを集計し続ける
+                deadline = time.monotonic() + self.flow_window
+                while True:
+                    self.drain_shared_ring()
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        break
+                    self.packets_available.clear()
+                    try:
+                        await asyncio.wait_for(self.packets_available.wait(), remaining)
+                    except asyncio.TimeoutError:
+                        pass
+                
+                flows = self.take_flow_summaries()
+                current_time = time.time()
+                if current_time - last_stats_time > stats_interval:
+                    print(f"[Flows] {self.packet_count - reported_packets} packets -> {self.flows_sent} flow summaries "
+                          f"({self.flows_truncated} flows over limit, {self.dropped_packets()} dropped)")
+                    reported_packets = self.packet_count
+                    self.flows_sent = 0
+                    last_stats_time = current_time
+                
+                if not flows or not self.ws:
+                    continue
+                await self.ws.send(json.dumps({
+                    'type': 'flow_data',
+                    'source_id': self.source_id,
+                    'window': self.flow_window,
+                    'flows': flows
+                }))
+                self.last_send_time = current_time
+                self.flows_sent += len(flows)
+                self.stats.sent += sum(flow['packets'] for flow in flows)
+            except websockets.exceptions.ConnectionClosed:
+                await self.reconnect()
+            except Exception as e:
+                pass  # print(f"\nError sending flows: {e}")
+                await asyncio.sleep(1)
+    
+    def notify_sender(self):
+        """キャプチャスレッドから送信タスクを起こす"""
+        loop = self.loop
+        if loop is None:
+            return
+        try:
+            loop.call_soon_threadsafe(self.packets_available.set)
+        except RuntimeError:
+            pass  # イベントループ終了済み
+    
+    def start_capture_workers(self) -> List[threading.Thread]:
+        """インターフェースごとのキャプチャスレッドを起動（ファイル再生時は1つ）"""
+        interfaces = [None] if self.pcap_file else self.interfaces
+        # スレッドの起動順に関係なく、全スレッドが起動前からキャプチャ中の状態にしておく
         self.is_capturing = True
+        self.worker_states = {interface: 'running' for interface in interfaces}
+        workers = []
+        for interface in interfaces:
+            worker = threading.Thread(target=self.run_capture_worker, args=(interface,), daemon=True,
+                                      name=f'capture-{interface or "default"}')
+            worker.start()
+            workers.append(worker)
+        return workers
+    
+    def run_capture_worker(self, interface: Optional[str]):
+        """1インターフェースのキャプチャスレッド
+
+        失敗したインターフェースは自分の状態だけを 'failed' にし、他のインターフェースの
+        キャプチャは続ける。全スレッドが終了した時にクライアント全体のキャプチャを止める。
+        """
+        failed = True
+        try:
+            failed = not self.start_capture(interface)
+        finally:
+            with self.worker_lock:
+                self.worker_states[interface] = 'failed' if failed else 'stopped'
+                running = sum(state == 'running' for state in self.worker_states.values())
+                if not running:
+                    self.is_capturing = False
+            if failed and len(self.worker_states) > 1:
+                print(f"Capture on {interface} failed ({running} interfaces still capturing)")
+    
+    def start_capture(self, interface: str = None) -> bool:
+        """パケットキャプチャ開始（キャプチャできずに終了した場合はFalse）"""
+        if self.pcap_file:
+            try:
+                self.replay_pcap()
+            except (OSError, ValueError) as e:
+                print(f"Replay error: {e}")
+                return False
+            return True
         
         # インターフェース自動検出
         if not interface:
@@ -145,12 +1290,217 @@ class PacketCaptureClient:
         
         # print(f"Starting packet capture on interface: {interface or 'auto'}")
         
+        self.log_filter_rate(interface)
+        
+        if self.capture_backend in ('raw', 'ring'):
+            try:
+                if self.capture_backend == 'ring':
+                    self.start_ring_capture(interface)
+                else:
+                    self.start_raw_capture(interface)
+                return True
+            except (AttributeError, OSError, ValueError) as e:  # AF_PACKET非対応OS・権限不足・リング設定不正
+                print(f"Raw capture unavailable ({e}). Falling back to scapy.")
+        
         try:
-            sniff(iface=interface, prn=self.packet_handler, store=False)
+            load_scapy()
+            if self.capture_filter is None and hasattr(socket, 'AF_PACKET'):
+                # libpcapなしで生成済みBPFを使うため、ソケットを開いてから設定する
+                listen_socket = conf.L2listen(iface=interface, nofilter=1)
+                linktype = interface_linktype(interface)
+                if linktype is None:
+                    print(f"{interface} is neither Ethernet nor raw IP; capturing without a kernel filter")
+                else:
+                    attach_bpf(listen_socket.ins, build_bpf_program(linktype=linktype))
+                sniff(opened_socket=listen_socket, prn=lambda packet: self.packet_handler(packet, interface),
+                      store=False)
+            else:
+                capture_filter = build_capture_filter() if self.capture_filter is None else self.capture_filter
+                sniff(iface=interface, prn=lambda packet: self.packet_handler(packet, interface), store=False,
+                      filter=capture_filter or None)
+        except ImportError as e:
+            print(f"scapy is not available ({e}). Install scapy or use --backend raw.")
+            return False
         except Exception as e:
             print(f"Capture error: {e}")
             print("Try running with sudo/administrator privileges")
-            self.is_capturing = False
+            return False
+        return True
+    
+    def attach_capture_filter(self, sock: socket.socket, interface: Optional[str], linktype: int = DLT_EN10MB):
+        """AF_PACKETソケットにキャプチャフィルタを設定"""
+        if self.capture_filter is None:
+            attach_bpf(sock, build_bpf_program(linktype=linktype))
+        elif self.capture_filter:
+            from scapy.arch.linux import attach_filter
+            attach_filter(sock, self.capture_filter, interface)
+    
+    def log_filter_rate(self, interface: Optional[str]):
+        """フィルタなし/ありのソケットを同時に開き、起動時のパケットレートを比較して表示（Linuxのみ）"""
+        if self.capture_filter == '' or not hasattr(socket, 'AF_PACKET'):
+            return
+        linktype = interface_linktype(interface)
+        if linktype is None and self.capture_filter is None:
+            return  # 生成済みBPFを使えないリンク層（キャプチャ開始時に表示）
+        sockets = []
+        try:
+            for filtered in (False, True):
+                sock = socket.socket(socket.AF_PACKET, socket.SOCK_RAW, socket.htons(ETH_P_ALL))
+                sockets.append(sock)
+                if interface:
+                    sock.bind((interface, 0))
+                if filtered:
+                    self.attach_capture_filter(sock, interface, linktype)
+                sock.setblocking(False)
+            counts = [0, 0]
+            deadline = time.monotonic() + FILTER_SAMPLE_SECONDS
+            while time.monotonic() < deadline:
+                readable, _, _ = select.select(sockets, [], [], max(0, deadline - time.monotonic()))
+                for sock in readable:
+                    index = sockets.index(sock)
+                    try:
+                        while True:
+                            sock.recv(1, socket.MSG_TRUNC)
+                            counts[index] += 1
+                    except BlockingIOError:
+                        pass
+        except Exception as e:
+            print(f"Capture filter rate check skipped: {e}")
+            return
+        finally:
+            for sock in sockets:
+                sock.close()
+        before, after = (count / FILTER_SAMPLE_SECONDS for count in counts)
+        dropped = 100 * (1 - after / before) if before else 0
+        label = f" [{interface}]" if len(self.interfaces) > 1 else ''
+        print(f"Capture filter{label}: {before:.0f} pkt/s -> {after:.0f} pkt/s "
+              f"({dropped:.0f}% dropped in kernel)")
+    
+    def replay_pcap(self):
+        """pcap/pcapngを元のパケット間隔（replay_speed倍）で再生し、ライブキャプチャと同じ経路でバッファに追加"""
+        stats = self.capture_thread_stats()
+        while self.is_capturing:
+            count = 0
+            start_time = None
+            for timestamp, linktype, frame, length in read_pcap_records(self.pcap_file):
+                if not self.is_capturing:
+                    return
+                if self.replay_speed > 0:
+                    if start_time is None:
+                        start_time = time.monotonic()
+                        first_timestamp = timestamp
+                    delay = start_time + (timestamp - first_timestamp) / self.replay_speed - time.monotonic()
+                    if delay > 0:
+                        time.sleep(delay)
+                stats.captured += 1
+                packet_info = parse_frame(frame, length, linktype, stats)
+                if packet_info is not None:
+                    self.enqueue_packet_info(packet_info)
+                count += 1
+            print(f"Replayed {count} packets from {self.pcap_file}")
+            if not self.replay_loop:
+                return
+    
+    def capture_linktype(self, interface: Optional[str]) -> int:
+        """raw/ringバックエンドで解析するリンク層タイプ（Ethernetとraw IP以外はValueError）"""
+        linktype = interface_linktype(interface)
+        if linktype is None:
+            raise ValueError(f"{interface} is neither Ethernet nor raw IP")
+        return linktype
+    
+    def start_raw_capture(self, interface: Optional[str]):
+        """AF_PACKETソケットからフレームを受信（バッファを使い回し、フレームごとのコピーをしない）"""
+        linktype = self.capture_linktype(interface)
+        sock = socket.socket(socket.AF_PACKET, socket.SOCK_RAW, socket.htons(ETH_P_ALL))
+        try:
+            if interface:
+                sock.bind((interface, 0))
+            self.attach_capture_filter(sock, interface, linktype)
+            sock.settimeout(1.0)  # is_capturing の確認用
+            buffer = bytearray(RAW_SNAPLEN)
+            view = memoryview(buffer)
+            handle_frame = self.handle_frame
+            while self.is_capturing:
+                try:
+                    length = sock.recv_into(buffer, RAW_SNAPLEN, socket.MSG_TRUNC)
+                except socket.timeout:
+                    continue
+                # 前のフレームの残りを読まないよう、受信したバイト数までに制限して解析
+                handle_frame(view[:min(length, RAW_SNAPLEN)], length, interface, linktype)
+        finally:
+            sock.close()
+    
+    def start_ring_capture(self, interface: Optional[str]):
+        """PACKET_RX_RING（TPACKET_V3）のmmapブロックリングからフレームを読む
+
+        ブロック内のフレームはmemoryviewのスライスとして解析し、コピーしない。
+        """
+        block_size = self.ring_block_size
+        block_count = self.ring_block_count
+        frame_size = self.ring_frame_size
+        if block_size % mmap.PAGESIZE or frame_size % 16 or block_size % frame_size:
+            raise ValueError(f"invalid ring geometry (block {block_size}, frame {frame_size}): "
+                             f"block size must be a multiple of {mmap.PAGESIZE} and of the frame size, "
+                             f"frame size a multiple of 16")
+
+        linktype = self.capture_linktype(interface)
+        sock = socket.socket(socket.AF_PACKET, socket.SOCK_RAW, socket.htons(ETH_P_ALL))
+        ring = None
+        view = None
+        try:
+            self.attach_capture_filter(sock, interface, linktype)
+            sock.setsockopt(SOL_PACKET, PACKET_VERSION, TPACKET_V3)
+            sock.setsockopt(SOL_PACKET, PACKET_RX_RING, _TPACKET_REQ3.pack(
+                block_size, block_count, frame_size, block_size // frame_size * block_count,
+                RING_BLOCK_TIMEOUT_MS, 0, 0))
+            ring = mmap.mmap(sock.fileno(), block_size * block_count,
+                             mmap.MAP_SHARED, mmap.PROT_READ | mmap.PROT_WRITE)
+            if interface:
+                sock.bind((interface, 0))
+            view = memoryview(ring)
+
+            handle_frame = self.handle_frame
+            block_index = 0
+            last_stats_time = time.monotonic()
+            while self.is_capturing:
+                now = time.monotonic()
+                if now - last_stats_time >= RING_STATS_INTERVAL:
+                    self.report_kernel_stats(sock)
+                    last_stats_time = now
+
+                block = block_index * block_size
+                status, packet_count, offset = _BLOCK_DESC.unpack_from(view, block + 8)
+                if not status & TP_STATUS_USER:
+                    select.select([sock], [], [], 1.0)
+                    continue
+
+                offset += block
+                for _ in range(packet_count):
+                    next_offset, snaplen, length, mac = _TPACKET3_HDR.unpack_from(view, offset)
+                    start = offset + mac
+                    handle_frame(view[start:start + snaplen], length, interface, linktype)
+                    offset += next_offset
+
+                # ブロックをカーネルに返却
+                struct.pack_into('I', view, block + 8, TP_STATUS_KERNEL)
+                block_index = (block_index + 1) % block_count
+        finally:
+            if view is not None:
+                view.release()
+            if ring is not None:
+                ring.close()
+            sock.close()
+    
+    def report_kernel_stats(self, sock: socket.socket):
+        """PACKET_STATISTICS（読み出しでリセットされる）を累計し、ドロップがあれば表示"""
+        packets, drops, _ = _TPACKET_STATS_V3.unpack(
+            sock.getsockopt(SOL_PACKET, PACKET_STATISTICS, _TPACKET_STATS_V3.size))
+        self.kernel_packets += packets
+        self.kernel_drops += drops
+        if drops:
+            print(f"[Ring] kernel dropped {drops}/{packets} packets "
+                  f"(total {self.kernel_drops}/{self.kernel_packets}); "
+                  f"consider larger --ring-block-size/--ring-blocks")
     
     async def connect_to_hub(self) -> bool:
         """Hubサーバーに接続"""
@@ -165,6 +1515,11 @@ class PacketCaptureClient:
                 'source_name': self.source_name,
                 'source_id': self.source_id
             }
+            if self.announced_interfaces:
+                auth_message['interfaces'] = self.announced_interfaces
+            if self.packet_encoding != 'json':
+                auth_message['packet_encoding'] = self.packet_encoding
+            self.binary_upload = False
             await self.ws.send(json.dumps(auth_message))
             
             # print(f"Connected to Hub as '{self.source_name}'")
@@ -175,94 +1530,289 @@ class PacketCaptureClient:
             print(f"Connection failed: {e}")
             return False
     
+    def batch_limit(self, now: float) -> int:
+        """次のバッチで送るパケット数（Hubの生成枠を超える分は送らない）"""
+        if self.spawn_rate is None:
+            return self.max_batch_size
+        budget = self.spawn_available + self.spawn_rate * (now - self.spawn_allowance_time)
+        return max(0, min(self.max_batch_size, int(budget)))
+    
+    def allowance_wait(self, now: float) -> float:
+        """生成枠が1パケット分回復するまでの待ち時間"""
+        if not self.spawn_rate:
+            return 1.0
+        budget = self.spawn_available + self.spawn_rate * (now - self.spawn_allowance_time)
+        return max(self.flush_interval, (1 - budget) / self.spawn_rate)
+    
+    async def adapt_to_spawn_target(self):
+        """Hubの生成目標に合わせて接続ごとのレート制限・バッチサイズ・フラッシュ間隔を調整
+
+        目標の BUFFER_OVERSAMPLE 倍を超えるパケットがレート制限を通過していれば制限を強め、
+        制限で捨てているのに目標に届かなければ緩める（Hubで破棄されるパケットを送らない）。
+        """
+        last_time = time.monotonic()
+        last_buffered, last_limited = self.buffered_and_limited()
+        while True:
+            await asyncio.sleep(ADAPT_INTERVAL)
+            now = time.monotonic()
+            buffered, limited = self.buffered_and_limited()
+            elapsed = now - last_time
+            buffered_rate = (buffered - last_buffered) / elapsed
+            limited_rate = (limited - last_limited) / elapsed
+            last_time, last_buffered, last_limited = now, buffered, limited
+            
+            rate = self.spawn_rate
+            if rate is None:
+                continue  # まだHubから生成目標が届いていない
+            self.max_batch_size = max(MIN_BATCH_SIZE, min(MAX_BATCH_SIZE, round(rate * BATCH_PERIOD)))
+            # 生成枠が1パケット分回復する間隔より頻繁にフラッシュしても送れない
+            self.flush_interval = min(MAX_FLUSH_INTERVAL, max(FLUSH_INTERVAL, 1 / rate)) if rate > 0 else MAX_FLUSH_INTERVAL
+            
+            interval = self.flow_table.min_interval
+            target = max(rate, 1.0) * BUFFER_OVERSAMPLE
+            if buffered_rate > target * 1.2:
+                interval *= min(2.0, buffered_rate / target)
+            elif buffered_rate < target * 0.5 and limited_rate > 0:
+                interval *= 0.8
+            interval = max(MIN_FLOW_INTERVAL, min(self.cache_cleanup_interval, interval))
+            self.flow_table.min_interval = interval
+            if self.shared_ring is not None:
+                self.shared_ring.flow_interval = interval  # キャプチャプロセスに反映
+    
+    def buffered_and_limited(self) -> Tuple[int, int]:
+        """レート制限を通過した累計パケット数と、制限で捨てた累計パケット数"""
+        if self.capture_stats is not None:
+            stages = self.capture_stats['stages']
+            return stages['buffered'], stages['rate_limited']
+        return self.packet_count, self.stats.rate_limited
+    
+    def latency_summary(self) -> Optional[Dict[str, float]]:
+        """直近のキャプチャ→送信遅延（ミリ秒）"""
+        if not self.send_latencies:
+            return None
+        ordered = sorted(self.send_latencies)
+        return {
+            'p50_ms': ordered[len(ordered) // 2] * 1000,
+            'p99_ms': ordered[min(len(ordered) - 1, int(len(ordered) * 0.99))] * 1000,
+            'max_ms': ordered[-1] * 1000
+        }
+    
+    def drain_shared_ring(self):
+        """共有メモリリングから packet_buffer の空き分だけ取り出す（溢れはリング側で数える）"""
+        ring = self.shared_ring
+        if ring is None:
+            return
+        if self.aggregate_flows:
+            # フロー集計モードはバッファを経由せず全件を集計
+            for packet_info in ring.pop_many(ring.slots):
+                self.record_flow(packet_info['flow_key'], packet_info)
+                self.packet_count += 1
+            return
+        free = self.packet_buffer.maxlen - len(self.packet_buffer)
+        if free > 0 and len(ring):
+            self.packet_buffer.extend(ring.pop_many(free))
+    
+    def pipeline_snapshot(self) -> Dict[str, Any]:
+        """段階ごとのパケット数と packet_handler の処理時間（キャプチャプロセス使用時はその値を使う）"""
+        snapshot = self.capture_stats_total().to_dict()
+        stages = snapshot['stages']
+        stages['buffered'] = self.packet_count
+        if self.capture_stats is not None:
+            for stage in CAPTURE_STAGES:
+                stages[stage] = self.capture_stats['stages'][stage]
+            snapshot['handler_time_us'] = self.capture_stats['handler_time_us']
+        stages['ring_overflow'] = self.shared_ring.overflow if self.shared_ring is not None else 0
+        # 解析できなかった・弾幕にならないプロトコルのパケット
+        stages['unsupported'] = max(0, stages['captured'] - stages['fragment_skipped'] - stages['rst_skipped']
+                                    - stages['rate_limited'] - stages['buffered'])
+        snapshot['stages'] = {stage: stages[stage] for stage in PIPELINE_STAGE_ORDER}
+        return snapshot
+    
+    async def report_pipeline_stats(self):
+        """PIPELINE_REPORT_INTERVAL ごとに段階ごとの件数を表示し、Hubに capture_pipeline を送信"""
+        previous = None
+        while True:
+            await asyncio.sleep(PIPELINE_REPORT_INTERVAL)
+            snapshot = self.pipeline_snapshot()
+            stages = snapshot['stages']
+            if stages != previous:
+                deltas = {stage: count - (previous or {}).get(stage, 0) for stage, count in stages.items()}
+                histogram = snapshot['handler_time_us']
+                p50 = histogram_percentile(histogram['buckets'], histogram['counts'], 0.5)
+                p99 = histogram_percentile(histogram['buckets'], histogram['counts'], 0.99)
+                handler = f" | handler p50<={p50:g}us p99<={p99:g}us" if p50 is not None else ''
+                print("[Pipeline] " + ' | '.join(f"{stage} {count}" for stage, count in deltas.items()) + handler)
+                if self.spawn_rate is not None and not self.aggregate_flows:
+                    print(f"[Budget] target {self.spawn_rate:g}/s | flow interval {self.flow_table.min_interval:.2f}s | "
+                          f"batch {self.max_batch_size} | flush {self.flush_interval * 1000:.0f}ms")
+                previous = stages
+            if self.ws:
+                try:
+                    await self.ws.send(json.dumps({
+                        'type': 'capture_pipeline',
+                        'source_id': self.source_id,
+                        **snapshot
+                    }))
+                except websockets.exceptions.ConnectionClosed:
+                    pass  # 再接続は送信タスクが行う
+    
+    async def start_stats_server(self):
+        """ローカル統計ソケット（接続するとパイプライン統計のJSONを1行返して閉じる）"""
+        async def handle(reader, writer):
+            writer.write(json.dumps(self.pipeline_snapshot()).encode() + b'\n')
+            try:
+                await writer.drain()
+            finally:
+                writer.close()
+        
+        if self.stats_socket.isdigit():
+            await asyncio.start_server(handle, '127.0.0.1', int(self.stats_socket))
+            print(f"Pipeline stats: tcp://127.0.0.1:{self.stats_socket}")
+        else:
+            if os.path.exists(self.stats_socket):
+                os.unlink(self.stats_socket)  # 前回の実行で残ったソケット
+            await asyncio.start_unix_server(handle, path=self.stats_socket)
+            print(f"Pipeline stats: {self.stats_socket}")
+    
+    def dropped_packets(self) -> int:
+        """バッファ・共有メモリリングの溢れで捨てたパケット数"""
+        dropped = self.stats.buffer_overflow
+        if self.shared_ring is not None:
+            dropped += self.shared_ring.overflow
+        return dropped
+    
+    async def wait_for_batch(self):
+        """バッファが空の間は待機し、バッチが埋まるか最初のパケットから flush_interval 経つまで待つ"""
+        buffer = self.packet_buffer
+        event = self.packets_available
+        self.drain_shared_ring()
+        while not buffer:
+            event.clear()
+            self.drain_shared_ring()
+            if buffer:  # clear前に追加されたパケットの通知を取りこぼさない
+                break
+            await event.wait()
+        
+        deadline = buffer[0]['timestamp'] + self.flush_interval
+        while len(buffer) < self.max_batch_size:
+            remaining = deadline - time.time()
+            if remaining <= 0:
+                break
+            event.clear()
+            self.drain_shared_ring()
+            if len(buffer) >= self.max_batch_size:
+                break
+            try:
+                await asyncio.wait_for(event.wait(), remaining)
+            except asyncio.TimeoutError:
+                break
+        self.sender_wakeups += 1
+    
+    def take_packet_batch(self, batch_limit: int) -> Tuple[List[Dict[str, Any]], Dict[tuple, int]]:
+        """バッファから送信するパケットを取り出す（同一接続は1バッチ2件まで、超過分は1回だけ持ち越す）
+
+        キャプチャスレッドの追加（enqueue_packet_info）と同じロックで取り出し・持ち越しを行い、
+        押し出し件数と送信タスクの起床判定がずれないようにする（待機を含まない短い処理）。
+        """
+        batch = []
+        sent_connections = {}  # Track connections sent in this batch
+        deferred = []  # 次のバッチに持ち越すパケット
+        stats = self.stats
+        with self.enqueue_lock:
+            while self.packet_buffer and len(batch) < batch_limit:
+                packet = self.packet_buffer.popleft()
+                
+                conn_id = packet['flow_key']
+                
+                # Allow up to 2 packets per connection in a batch for better flow
+                if conn_id in sent_connections and sent_connections[conn_id] >= 2:
+                    # 持ち越しは1回まで（同じ接続のパケットがバッファ内を循環し続けないように）
+                    if packet.get('deferred'):
+                        stats.batch_dropped += 1
+                    else:
+                        packet['deferred'] = True
+                        deferred.append(packet)
+                        stats.batch_deferred += 1
+                    continue
+                
+                # Count this connection
+                sent_connections[conn_id] = sent_connections.get(conn_id, 0) + 1
+                batch.append(packet)
+            
+            # 持ち越したパケットは元の順序でバッファの先頭に戻す（満杯なら新しい側から押し出される）
+            if deferred:
+                overflow = len(self.packet_buffer) + len(deferred) - self.packet_buffer.maxlen
+                if overflow > 0:
+                    stats.buffer_overflow += overflow
+                self.packet_buffer.extendleft(reversed(deferred))
+        return batch, sent_connections
+    
     async def send_packet_batch(self):
-        """パケットデータをバッチ送信"""
+        """パケットデータをバッチ送信（キャプチャスレッドからの通知で起床し、アイドル時は送信しない）"""
+        self.loop = asyncio.get_running_loop()
+        self.packets_available = asyncio.Event()
         last_stats_time = time.time()
         stats_interval = 10.0  # Show stats every 10 seconds
         
         while True:
+            batch = []
             try:
+                await self.wait_for_batch()
                 current_time = time.time()
                 
-                # Show statistics periodically
+                # Show statistics periodically（段階ごとの件数は report_pipeline_stats で表示）
                 if current_time - last_stats_time > stats_interval:
-                    active_connections = len(self.connection_cache)
-                    pass  # print(f"[Stats] Captured: {self.packet_count}, Skipped: {self.skipped_packets}, "
-                          # f"Active connections: {active_connections}, Buffer: {len(self.packet_buffer)}")
+                    latency = self.latency_summary()
+                    if latency:
+                        print(f"[Latency] capture->send p50 {latency['p50_ms']:.1f}ms "
+                              f"p99 {latency['p99_ms']:.1f}ms max {latency['max_ms']:.1f}ms")
                     last_stats_time = current_time
                 
-                # 200ms毎または30パケット溜まったら送信（間隔を延ばして分散）
-                if (current_time - self.last_send_time > 0.2 or len(self.packet_buffer) >= 30) and self.packet_buffer:
-                    
-                    if self.ws:
-                        # バッファからパケット取得（同一接続の連続パケットを更に制限）
-                        packets_to_send = []
-                        sent_connections = {}  # Track connections sent in this batch
-                        temp_buffer = []  # Packets to put back in buffer
-                        
-                        while self.packet_buffer and len(packets_to_send) < 15:  # Balanced at 15
-                            packet = self.packet_buffer.popleft()
-                            
-                            # Create connection identifier for batch deduplication
-                            if packet['src_ip'] < packet['dst_ip']:
-                                conn_id = f"{packet['src_ip']}:{packet['src_port']}-" \
-                                         f"{packet['dst_ip']}:{packet['dst_port']}-" \
-                                         f"{packet['protocol']}"
-                            else:
-                                conn_id = f"{packet['dst_ip']}:{packet['dst_port']}-" \
-                                         f"{packet['src_ip']}:{packet['src_port']}-" \
-                                         f"{packet['protocol']}"
-                            
-                            # Allow up to 2 packets per connection in a batch for better flow
-                            if conn_id in sent_connections and sent_connections[conn_id] >= 2:
-                                # Already sent 2 packets from this connection
-                                temp_buffer.append(packet)
-                                continue
-                            
-                            # Count this connection
-                            sent_connections[conn_id] = sent_connections.get(conn_id, 0) + 1
-                            
-                            # タイムスタンプを除外して送信
-                            packets_to_send.append({
-                                'protocol': packet['protocol'],
-                                'src_port': packet['src_port'],
-                                'dst_port': packet['dst_port'],
-                                'size': packet['size'],
-                                'src_ip': packet['src_ip'],
-                                'dst_ip': packet['dst_ip']
-                            })
-                        
-                        # Put temporary buffer packets back
-                        for packet in temp_buffer:
-                            self.packet_buffer.append(packet)
-                        
-                        if packets_to_send:
-                            message = {
-                                'type': 'packet_data',
-                                'source_id': self.source_id,
-                                'packets': packets_to_send
-                            }
-                            
-                            await self.ws.send(json.dumps(message))
-                            self.last_send_time = current_time
-                            
-                            # Debug: Show connection diversity in batch
-                            unique_connections = len(sent_connections)
-                            pass  # print(f"\n[Batch] Sent {len(packets_to_send)} packets from {unique_connections} unique connections")
-                            # 
-                            # # Show top connections if mostly from same source
-                            # if unique_connections < len(packets_to_send) / 2:
-                            #     print(f"  Warning: Low connection diversity ({unique_connections}/{len(packets_to_send)})")
-                            #     # Show first few connections for debugging
-                            #     for i, conn in enumerate(list(sent_connections.keys())[:3]):
-                            #         parts = conn.split('-')
-                            #         if len(parts) >= 2:
-                            #             print(f"    - {parts[0]} -> {parts[1]}")
+                if not self.ws:
+                    await asyncio.sleep(1)
+                    continue
+                
+                batch_limit = self.batch_limit(current_time)
+                if batch_limit == 0:
+                    await asyncio.sleep(self.allowance_wait(current_time))
+                    continue
                 
-                await asyncio.sleep(0.05)  # 50ms間隔でチェック
+                # バッファからパケット取得（同一接続の連続パケットを更に制限）
+                batch, sent_connections = self.take_packet_batch(batch_limit)
+                stats = self.stats
+                
+                if batch:
+                    # タイムスタンプを除外して送信
+                    packets_to_send = [packet_upload_info(packet) for packet in batch]
+                    if self.binary_upload:
+                        await self.ws.send(encode_packet_upload(packets_to_send, self.interface_index))
+                    else:
+                        message = {
+                            'type': 'packet_data',
+                            'source_id': self.source_id,
+                            'packets': packets_to_send
+                        }
+                        await self.ws.send(json.dumps(message))
+                    self.last_send_time = sent_time = time.time()
+                    self.spawn_available -= len(packets_to_send)
+                    self.send_latencies.extend(sent_time - packet['timestamp'] for packet in batch)
+                    stats.sent += len(packets_to_send)
+                    
+                    # Debug: Show connection diversity in batch
+                    unique_connections = len(sent_connections)
+                    pass  # print(f"\n[Batch] Sent {len(packets_to_send)} packets from {unique_connections} unique connections")
+                    # 
+                    # # Show top connections if mostly from same source
+                    # if unique_connections < len(packets_to_send) / 2:
+                    #     print(f"  Warning: Low connection diversity ({unique_connections}/{len(packets_to_send)})")
+                    #     # Show first few connections for debugging
+                    #     for i, conn in enumerate(list(sent_connections.keys())[:3]):
+                    #         print(f"    - {conn[0]}:{conn[1]} -> {conn[2]}:{conn[3]}")
                 
             except websockets.exceptions.ConnectionClosed:
                 pass  # print("\nConnection to Hub lost. Reconnecting...")
+                if self.spool is not None and batch:
+                    self.spool_packets(batch)  # 送れなかったバッチ
                 await self.reconnect()
             except Exception as e:
                 pass  # print(f"\nError sending packets: {e}")
@@ -276,7 +1826,15 @@ class PacketCaptureClient:
                     message = await self.ws.recv()
                     data = json.loads(message)
                     
-                    if data.get('type') == 'capture_stats':
+                    if data.get('type') == 'capture_ack':
+                        # Hubが受け入れた packet_data 形式に切り替え
+                        self.binary_upload = data.get('packet_encoding') == 'binary'
+                    elif data.get('type') == 'capture_stats':
+                        allowance = data.get('spawn_allowance')
+                        if allowance:
+                            self.spawn_rate = allowance['rate']
+                            self.spawn_available = allowance['available']
+                            self.spawn_allowance_time = time.time()
                         # 統計情報表示（別行で）
                         pass  # print(f"\n[Stats] Players: {data.get('connected_players', 0)} | "
                               # f"Active: {data.get('active_players', 0)} | "
@@ -294,106 +1852,232 @@ class PacketCaptureClient:
                 await asyncio.sleep(1)
     
     async def reconnect(self):
-        """再接続処理"""
+        """再接続処理（検索済みの他のHubがあれば待たずに切り替え、全て失敗したらバックオフ）"""
         if self.reconnect_attempts >= self.max_reconnect_attempts:
             pass  # print("\nMax reconnection attempts reached. Exiting...")
             return False
         
+        # 再接続中は spool_while_disconnected がバッファをスプールへ移す
+        self.reconnecting = True
+        try:
+            return await self.try_reconnect()
+        finally:
+            self.reconnecting = False
+    
+    async def try_reconnect(self) -> bool:
+        if await self.fail_over():
+            return True
+        
         self.reconnect_attempts += 1
         wait_time = min(2 ** self.reconnect_attempts, 30)  # 指数バックオフ（最大30秒）
         
         # print(f"\nReconnection attempt {self.reconnect_attempts}/{self.max_reconnect_attempts} in {wait_time}s...")
         await asyncio.sleep(wait_time)
         
+        if self.auto_discover:
+            await self.use_discovered_hubs()  # 負荷・RTTが変わっているため検索し直す
         if await self.connect_to_hub():
             pass  # print("Reconnected successfully!")
             return True
         return False
     
-    def discover_hub(self, timeout: float = 5.0) -> Optional[Tuple[str, int]]:
-        """マルチキャストでHubを検索"""
-        try:
-            # print(f"Searching for Hub server... (timeout: {timeout}s)")
-            
-            # UDPソケット作成
-            sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
-            sock.settimeout(timeout)
-            sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
-            
-            # 検索メッセージ送信
-            discover_msg = {
-                'type': 'DISCOVER',
-                'service': SERVICE_NAME,
-                'client_type': 'capture'
-            }
-            
-            sock.sendto(
-                json.dumps(discover_msg).encode('utf-8'),
-                (MULTICAST_GROUP, MULTICAST_PORT)
-            )
-            
-            # 応答待機
-            data, addr = sock.recvfrom(1024)
-            response = json.loads(data.decode('utf-8'))
-            
-            if response.get('type') == 'ANNOUNCE':
-                host = response.get('host')
-                port = response.get('port')
-                name = response.get('name', 'Unknown Hub')
-                players = response.get('players_online', 0)
-                captures = response.get('captures_active', 0)
-                
-                print(f"\nHub found: {name}")
-                print(f"  Address: {host}:{port}")
-                print(f"  Players online: {players}")
-                print(f"  Active captures: {captures}")
-                
-                sock.close()
-                return (host, port)
-                
-        except socket.timeout:
+    def hub_available(self) -> bool:
+        """Hubとの接続が開いているか"""
+        return self.ws is not None and self.ws.state is State.OPEN
+    
+    def spool_packets(self, packets: List[Dict[str, Any]]):
+        self.stats.spooled += len(packets)
+        self.stats.spool_dropped += self.spool.append_many(packets)
+    
+    async def spool_while_disconnected(self):
+        """再接続中は packet_buffer のパケットをスプールへ移す（停止期間によらずバッファを溢れさせない）"""
+        buffer = self.packet_buffer
+        spooling = False
+        while True:
+            event = self.packets_available
+            if not self.reconnecting or event is None:
+                if self.hub_available():
+                    spooling = False
+                await asyncio.sleep(SPOOL_INTERVAL)
+                continue
+            if not spooling:
+                print(f"[Spool] Hub unreachable, spooling packets to {self.spool.directory}")
+                spooling = True
+            event.clear()
+            while True:
+                self.drain_shared_ring()
+                if not buffer:
+                    break
+                self.spool_packets([buffer.popleft() for _ in range(len(buffer))])
+            try:
+                await asyncio.wait_for(event.wait(), SPOOL_INTERVAL)
+            except asyncio.TimeoutError:
+                pass
+    
+    async def drain_spool(self):
+        """接続中はスプールのパケットを古い順に spool_rate で送信（キャプチャ時刻をミリ秒で付ける）"""
+        spool = self.spool
+        burst = max(1.0, self.spool_rate * SPOOL_DRAIN_INTERVAL)
+        credit = 0.0
+        while True:
+            await asyncio.sleep(SPOOL_DRAIN_INTERVAL)
+            if not spool or self.reconnecting or not self.hub_available():
+                continue
+            credit = min(burst, credit + self.spool_rate * SPOOL_DRAIN_INTERVAL)
+            packets = spool.peek(min(int(credit), self.batch_limit(time.time())))
+            if not packets:
+                continue
+            try:
+                await self.ws.send(json.dumps({
+                    'type': 'packet_data',
+                    'source_id': self.source_id,
+                    'spooled': True,
+                    'packets': [dict(packet_upload_info(packet), timestamp=int(packet['timestamp'] * 1000))
+                                for packet in packets]
+                }))
+            except websockets.exceptions.ConnectionClosed:
+                continue  # 再接続は送信タスクが行う
+            spool.commit(len(packets))
+            credit -= len(packets)
+            self.spawn_available -= len(packets)
+            self.stats.spool_sent += len(packets)
+            if not spool:
+                print(f"[Spool] Drained ({self.stats.spool_sent} packets sent, {self.stats.spool_dropped} dropped)")
+    
+    async def fail_over(self) -> bool:
+        """検索済みの他のHubにコストの低い順で接続を試す"""
+        for _ in range(len(self.hub_urls) - 1):
+            self.hub_index = (self.hub_index + 1) % len(self.hub_urls)
+            self.hub_url = self.hub_urls[self.hub_index]
+            print(f"Failing over to Hub: {self.hub_url}")
+            if await self.connect_to_hub():
+                return True
+        return False
+    
+    async def use_discovered_hubs(self):
+        """Hubを検索し、接続候補をコストの低い順に更新"""
+        hubs = await discover_hubs()
+        if not hubs:
             print("No Hub found via multicast discovery")
-        except Exception as e:
-            print(f"Discovery error: {e}")
+            print(f"\nUsing default/configured Hub: {self.hub_url}")
+            return
         
-        if sock:
-            sock.close()
-        return None
+        print(f"\nHubs found: {len(hubs)}")
+        for hub in hubs:
+            print(f"  {hub.get('name', 'Unknown Hub')} {hub['host']}:{hub['port']} "
+                  f"(rtt {hub['rtt'] * 1000:.1f} ms, players {hub.get('players_online', 0)}, "
+                  f"captures {hub.get('captures_active', 0)}, spawn scale {hub.get('spawn_scale', 1.0):g})")
+        self.hub_urls = [f"ws://{hub['host']}:{hub['port']}" for hub in hubs]
+        self.hub_index = 0
+        self.hub_url = self.hub_urls[0]
+        print(f"\nUsing discovered Hub: {self.hub_url}")
     
     async def run(self, auto_discover: bool = True):
         """メインループ"""
         # 自動検索が有効な場合
-        if auto_discover and not self.hub_url.startswith('ws://localhost'):
-            discovered = self.discover_hub()
-            if discovered:
-                host, port = discovered
-                self.hub_url = f'ws://{host}:{port}'
-                print(f"\nUsing discovered Hub: {self.hub_url}")
-            else:
-                print(f"\nUsing default/configured Hub: {self.hub_url}")
+        self.auto_discover = auto_discover
+        if auto_discover:
+            await self.use_discovered_hubs()
         
-        # Hubに接続
-        if not await self.connect_to_hub():
+        # Hubに接続（失敗したら次の候補へ）
+        if not await self.connect_to_hub() and not await self.fail_over():
             print("Failed to connect to Hub. Please check if Hub is running.")
             return
         
-        # パケットキャプチャスレッド開始
-        import threading
-        capture_thread = threading.Thread(target=self.start_capture, daemon=True)
-        capture_thread.start()
+        if self.stats_socket:
+            try:
+                await self.start_stats_server()
+            except OSError as e:
+                print(f"Pipeline stats socket unavailable: {e}")
+        
+        # パケットキャプチャ開始（スレッドまたは別プロセス）
+        capture = None
+        if self.capture_process:
+            capture = self.start_capture_process()
+        else:
+            self.start_capture_workers()
+        
+        spool_tasks = []
+        if self.spool_dir:
+            if self.aggregate_flows:
+                print("--spool is ignored with --aggregate-flows")
+            else:
+                self.spool = PacketSpool(self.spool_dir, self.spool_bytes, self.announced_interfaces)
+                spool_tasks = [self.spool_while_disconnected(), self.drain_spool()]
+                if self.spool:
+                    print(f"[Spool] {len(self.spool)} packets left from a previous run")
         
         # 非同期タスク起動
         try:
             await asyncio.gather(
-                self.send_packet_batch(),
-                self.receive_messages()
+                self.send_flow_summaries() if self.aggregate_flows else self.send_packet_batch(),
+                self.receive_messages(),
+                self.report_pipeline_stats(),
+                *([] if self.aggregate_flows else [self.adapt_to_spawn_target()]),
+                *spool_tasks
             )
         except KeyboardInterrupt:
             print("\nShutting down...")
         finally:
             self.is_capturing = False
+            if capture is not None:
+                self.stop_capture_process(*capture)
+            if self.spool is not None:
+                self.spool.close()
             if self.ws:
                 await self.ws.close()
+    
+    def capture_options(self) -> Dict[str, Any]:
+        """キャプチャプロセスに渡す設定"""
+        return {
+            'interface': self.interface,
+            'capture_backend': self.capture_backend,
+            'capture_filter': self.capture_filter,
+            'ring_block_size': self.ring_block_size,
+            'ring_block_count': self.ring_block_count,
+            'ring_frame_size': self.ring_frame_size,
+            'pcap_file': self.pcap_file,
+            'replay_speed': self.replay_speed,
+            'replay_loop': self.replay_loop,
+            'aggregate_flows': self.aggregate_flows
+        }
+    
+    def start_capture_process(self):
+        """キャプチャプロセスを起動し、共有メモリリングとwakeupパイプを送信タスクにつなぐ"""
+        self.shared_ring = SharedPacketRing(slots=self.shm_slots, interfaces=self.interfaces)
+        receiver, sender = multiprocessing.Pipe(duplex=False)
+        process = multiprocessing.Process(
+            target=run_capture_process,
+            args=(self.shared_ring.name, self.shm_slots, sender, self.capture_options()),
+            daemon=True)
+        process.start()
+        sender.close()
+        
+        def on_wakeup():
+            try:
+                while receiver.poll():
+                    message = receiver.recv_bytes()
+                    if len(message) > 1:  # 起床通知以外はキャプチャプロセスの統計
+                        self.capture_stats = json.loads(message)
+            except (EOFError, OSError):
+                asyncio.get_running_loop().remove_reader(receiver.fileno())  # キャプチャプロセス終了
+                return
+            if self.packets_available is not None:
+                self.packets_available.set()
+        
+        asyncio.get_running_loop().add_reader(receiver.fileno(), on_wakeup)
+        return process, receiver
+    
+    def stop_capture_process(self, process, receiver):
+        try:
+            asyncio.get_running_loop().remove_reader(receiver.fileno())
+        except (RuntimeError, ValueError):
+            pass
+        process.terminate()
+        process.join(timeout=2)
+        receiver.close()
+        self.shared_ring.close()
+        self.shared_ring.shm.unlink()
 
 def get_local_ip() -> str:
     """ローカルIPアドレス取得"""
@@ -410,7 +2094,45 @@ def main():
     parser = argparse.ArgumentParser(description='PCAP-Nyan Packet Capture Client')
     parser.add_argument('--hub', type=str, help='Hub server URL (default: auto-discover or ws://localhost:8766)')
     parser.add_argument('--name', type=str, help='Source name for identification')
-    parser.add_argument('--interface', type=str, help='Network interface to capture')
+    parser.add_argument('--interface', type=str,
+                        help='Network interface(s) to capture: a name, a comma-separated list, or "any"')
+    parser.add_argument('--backend', choices=CAPTURE_BACKENDS, default='scapy',
+                        help='Capture backend (raw: AF_PACKET socket + struct parser, '
+                             'ring: TPACKET_V3 mmap ring + struct parser; Linux only, '
+                             'falls back to scapy when unavailable)')
+    parser.add_argument('--pcap', type=str, metavar='FILE',
+                        help='Replay a pcap/pcapng file instead of capturing live (no root required)')
+    parser.add_argument('--speed', type=float, default=1.0,
+                        help='Replay speed multiplier for --pcap (default: 1.0, 0 = as fast as possible)')
+    parser.add_argument('--loop', action='store_true', help='Replay --pcap in a loop')
+    parser.add_argument('--packet-encoding', choices=PACKET_ENCODINGS, default='json',
+                        help='packet_data upload format (binary: fixed-width records, used once the hub accepts it)')
+    parser.add_argument('--aggregate-flows', action='store_true',
+                        help='Send per-flow packet/byte counters every window instead of individual packets')
+    parser.add_argument('--flow-window', type=float, default=FLOW_WINDOW,
+                        help=f'Flow aggregation window in seconds (default: {FLOW_WINDOW})')
+    parser.add_argument('--stats-socket', type=str,
+                        help='Serve pipeline stats as JSON on a local Unix socket path, or on 127.0.0.1 if a port number')
+    parser.add_argument('--spool', type=str, metavar='DIR',
+                        help='Spool packets to segment files in DIR while the hub is unreachable and send them '
+                             'after reconnecting')
+    parser.add_argument('--spool-size', type=int, default=SPOOL_MAX_BYTES >> 20, metavar='MB',
+                        help=f'Maximum spool size; oldest segments are deleted beyond it (default: {SPOOL_MAX_BYTES >> 20})')
+    parser.add_argument('--spool-rate', type=float, default=SPOOL_DRAIN_RATE,
+                        help=f'Packets per second sent from the spool after reconnecting (default: {SPOOL_DRAIN_RATE:g})')
+    parser.add_argument('--capture-process', action='store_true',
+                        help='Capture and parse in a separate process that writes to a shared-memory ring')
+    parser.add_argument('--shm-slots', type=int, default=SHM_RING_SLOTS,
+                        help=f'Packet slots in the shared-memory ring (default: {SHM_RING_SLOTS})')
+    parser.add_argument('--ring-block-size', type=int, default=RING_BLOCK_SIZE,
+                        help=f'Ring block size in bytes (default: {RING_BLOCK_SIZE})')
+    parser.add_argument('--ring-blocks', type=int, default=RING_BLOCK_COUNT,
+                        help=f'Number of ring blocks (default: {RING_BLOCK_COUNT})')
+    parser.add_argument('--ring-frame-size', type=int, default=RING_FRAME_SIZE,
+                        help=f'Ring frame size in bytes (default: {RING_FRAME_SIZE})')
+    parser.add_argument('--filter', type=str, default=None,
+                        help='Capture filter in tcpdump syntax (default: generated from the hub spawn rules; '
+                             '"" to disable)')
     parser.add_argument('--no-discover', action='store_true', help='Disable auto-discovery')
     
     args = parser.parse_args()
@@ -434,6 +2156,9 @@ PCAP-Nyan Packet Capture Client
 Discovery: {'Enabled' if auto_discover else 'Disabled'}
 Hub Server: {hub_url or 'Auto-discover or ws://localhost:8766'}
 Source Name: {args.name or f'{socket.gethostname()}_capture'}
+Capture Backend: {f'pcap replay ({args.pcap}, x{args.speed:g}{", loop" if args.loop else ""})' if args.pcap else args.backend}
+Interfaces: {', '.join(name or 'auto' for name in resolve_interfaces(args.interface))}
+Capture Filter: {build_capture_filter() if args.filter is None else args.filter or 'none'}
 Local IP: {get_local_ip()}
 
 Note: Run with sudo/administrator privileges for packet capture
@@ -444,7 +2169,25 @@ Press Ctrl+C to stop
     
     client = PacketCaptureClient(
         hub_url=hub_url,
-        source_name=args.name
+        source_name=args.name,
+        interface=args.interface,
+        capture_backend=args.backend,
+        capture_filter=args.filter,
+        ring_block_size=args.ring_block_size,
+        ring_block_count=args.ring_blocks,
+        ring_frame_size=args.ring_frame_size,
+        pcap_file=args.pcap,
+        replay_speed=args.speed,
+        replay_loop=args.loop,
+        capture_process=args.capture_process,
+        shm_slots=args.shm_slots,
+        packet_encoding=args.packet_encoding,
+        aggregate_flows=args.aggregate_flows,
+        flow_window=args.flow_window,
+        stats_socket=args.stats_socket,
+        spool_dir=args.spool,
+        spool_bytes=args.spool_size << 20,
+        spool_rate=args.spool_rate
     )
     
     try:
@@ -11,21 +11,61 @@ import random
 import socket
 import struct
 import threading
-from typing import Dict, List, Optional, Any
+import argparse
+import bisect
+import math
+from typing import Dict, List, Optional, Any, Tuple
 from collections import deque
 import websockets
 from websockets.server import WebSocketServerProtocol
 from dataclasses import dataclass, field, asdict
 from enum import Enum
 
+try:
+    import numpy as np
+except ImportError:  # NumPyは任意依存（--bullet-store numpy 使用時のみ必要）
+    np = None
+
 # 定数
 WEBSOCKET_PORT = 8766
+METRICS_PORT = 8767  # Prometheus形式のメトリクス (HTTP GET /metrics)
 GAME_WIDTH = 800
 GAME_HEIGHT = 600
 UPDATE_RATE = 30  # fps
 MAX_BULLETS = 500
+BULLET_LIFETIME = 10.0  # 秒
 MAX_HP = 3
 INVULNERABILITY_TIME = 2.0  # 秒
+KEYFRAME_INTERVAL = 2.0  # 秒（差分モードでのキーフレーム送信間隔）
+PLAYER_HIT_RADIUS = 8  # サーバー判定時のプレイヤー当たり判定半径
+GRAZE_RADIUS = 30  # グレイズ判定半径
+GRAZE_SCORE = 100
+PLAYER_MOVE_TIMEOUT = 1.0  # 秒（player_move がこれより途絶えたプレイヤーはサーバー判定・グレイズ加点をしない）
+COLLISION_CELL_SIZE = 40  # GRAZE_RADIUS + 最大弾幕半径以上（3x3セルの探索で足りる大きさ）
+MAX_CATCH_UP_STEPS = 5  # 処理落ち時に1フレームで追加実行するシミュレーションステップの上限
+TICK_STATS_WINDOW = 300  # ティック統計のウィンドウ（30fpsで10秒分）
+TICK_REPORT_INTERVAL = 10.0  # 秒（処理落ちの警告間隔）
+TICK_WARN_RATIO = 0.8  # p99がティック予算のこの割合を超えたら警告
+TICK_HISTOGRAM_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.02, 0.0333, 0.05, 0.1, 0.25)  # 秒
+PACKET_RATE_TIME_CONSTANT = 5.0  # 秒（packet_rate のEWMA時定数）
+SOURCE_SPAWN_RATE = 30.0  # 弾幕/秒（ソースごとのトークンバケット）
+GLOBAL_SPAWN_RATE = 100.0  # 弾幕/秒（全ソース合計のトークンバケット）
+SPAWN_BURST = 1.0  # 秒（バケット容量 = レート × この秒数）
+# 生成目標（弾幕プールの使用率とティック処理時間の余裕に応じてソースごとのレートを絞る）
+SPAWN_BUDGET_INTERVAL = 1.0  # 秒（生成目標の再計算間隔）
+SPAWN_LOAD_TARGET = 0.8  # 弾幕プール（ソースごとは公平な取り分）の使用率がこれを超えると絞り始める
+SPAWN_HEADROOM_TARGET = 0.5  # ティック処理時間p99の残り余裕がこれを下回ると絞り始める
+SPAWN_MIN_SCALE = 0.1  # 生成目標の下限（基準レートに対する割合）
+MAX_RELIABLE_BACKLOG = 256  # クライアント毎の未送信イベント上限（超過時は切断）
+STATE_MESSAGE_TYPES = ('game_state', 'game_delta')  # 遅延時に古いものを破棄してよいメッセージ
+
+# キャプチャソースごとの配色（ソースインデックス順）
+SOURCE_COLORS = [
+    {'TCP': '#FF4444', 'UDP': '#4444FF', 'ICMP': '#44FF44', 'UNKNOWN': '#FFFF44'},  # Source 1: 明るい
+    {'TCP': '#CC0000', 'UDP': '#0000CC', 'ICMP': '#00CC00', 'UNKNOWN': '#CCCC00'},  # Source 2: 濃い
+    {'TCP': '#FF8888', 'UDP': '#8888FF', 'ICMP': '#88FF88', 'UNKNOWN': '#FFFF88'},  # Source 3: 薄い
+    {'TCP': '#FF00FF', 'UDP': '#00FFFF', 'ICMP': '#FFFF00', 'UNKNOWN': '#FF8800'},  # Source 4: ネオン
+]
 
 # マルチキャスト検索設定
 MULTICAST_GROUP = '239.255.42.99'  # プライベートマルチキャストアドレス
@@ -40,6 +80,14 @@ class GameMode(str, Enum):
     PLAYER = 'player'
     SPECTATOR = 'spectator'
 
+class WireEncoding(str, Enum):
+    JSON = 'json'
+    BINARY = 'binary'  # game_state / game_delta（キャプチャクライアントは packet_data）のみバイナリ、その他はJSON
+
+class StateMode(str, Enum):
+    SNAPSHOT = 'snapshot'  # 毎ティック全状態を送信（従来方式）
+    DELTA = 'delta'        # 生成/削除された弾幕と変更されたプレイヤー項目のみ送信
+
 @dataclass
 class PlayerState:
     id: str
@@ -54,6 +102,8 @@ class PlayerState:
     invulnerable_until: float = 0
     death_time: Optional[float] = None
     avatar: str = 'nyan_cat'
+    grazed_bullets: set = field(default_factory=set)  # サーバー判定でグレイズ済みの弾幕ID
+    last_move_time: Optional[float] = None  # 最後に player_move を受信した時刻
 
 @dataclass
 class Bullet:
@@ -84,6 +134,42 @@ class CaptureClient:
     packet_rate: float = 0
     last_packet_time: float = field(default_factory=time.time)
     total_packets: int = 0
+    spawned_bullets: int = 0
+    admitted_packets: int = 0
+    shed_packets: int = 0
+    sent_messages: int = 0
+    sent_bytes: int = 0
+    spawn_bucket: Optional['TokenBucket'] = None
+    spawn_scale: float = 1.0  # このソースの生成目標の倍率（update_spawn_budget で更新）
+    share_load: float = 0.0  # 公平な取り分（max_bullets / ソース数）に対するこのソースの弾幕数
+    interfaces: List[str] = field(default_factory=list)  # capture_auth で通知されたキャプチャ対象
+    interface_packets: Dict[str, int] = field(default_factory=dict)  # インターフェースごとの受信パケット数
+    packet_encoding: WireEncoding = WireEncoding.JSON  # capture_auth で合意した packet_data の形式
+    pipeline: Dict[str, Any] = field(default_factory=dict)  # 最新の capture_pipeline（段階ごとの件数・ハンドラ処理時間）
+    spooled_packets: int = 0  # 再接続後にスプールから届いたパケット数（packet_data.spooled）
+    invalid_flows: int = 0  # flow_data で破棄した不正なフローレコード数
+
+    def update_packet_rate(self, count: int, now: float):
+        """受信パケットレートをEWMAで更新（packets/s）"""
+        elapsed = now - self.last_packet_time
+        if elapsed <= 0:
+            return
+        alpha = 1 - math.exp(-elapsed / PACKET_RATE_TIME_CONSTANT)
+        self.packet_rate += alpha * (count / elapsed - self.packet_rate)
+    
+    def current_packet_rate(self, now: float) -> float:
+        """最後の受信からの経過時間で減衰させたパケットレート（受信が止まったソースは0に近づく）"""
+        elapsed = max(0.0, now - self.last_packet_time)
+        return self.packet_rate * math.exp(-elapsed / PACKET_RATE_TIME_CONSTANT)
+
+@dataclass
+class SourceInfo:
+    source_id: str
+    index: int
+    name: str
+    colors: Dict[str, str]
+    speed_modifier: float
+    client_id: str
 
 @dataclass
 class GameClient:
@@ -91,12 +177,831 @@ class GameClient:
     mode: GameMode
     websocket: WebSocketServerProtocol
     player_state: Optional[PlayerState] = None
+    state_mode: StateMode = StateMode.SNAPSHOT
+    needs_keyframe: bool = True
+    encoding: WireEncoding = WireEncoding.JSON
+    outbox: Optional['ClientOutbox'] = None
+
+def bullet_to_dict(b: Bullet, x: float, y: float, source_name: str) -> dict:
+    """game_state用の弾幕辞書を生成"""
+    return {
+        'id': b.id,
+        'x': x,
+        'y': y,
+        'vx': b.vx,
+        'vy': b.vy,
+        'size': b.size,
+        'protocol': b.protocol,
+        'source': b.source,
+        'source_name': source_name,
+        'port': b.port,
+        'color': b.color,
+        'src_ip': b.src_ip,
+        'dst_ip': b.dst_ip,
+        'src_port': b.src_port,
+        'dst_port': b.dst_port,
+        'src_name': b.src_name
+    }
+
+def fair_allocation(counts: List[int], capacity: int, source_cap: int) -> List[int]:
+    """ソースごとの弾幕数を容量内に収める割り当て数（max-min公平、各ソースはsource_cap以下）"""
+    allocation = [0] * len(counts)
+    remaining = capacity
+    order = sorted(range(len(counts)), key=counts.__getitem__)
+    for position, i in enumerate(order):
+        share = remaining // (len(order) - position)
+        allocation[i] = min(counts[i], share, source_cap)
+        remaining -= allocation[i]
+    return allocation
+
+def weighted_allocation(weights: List[float], caps: List[int], total: int) -> List[int]:
+    """totalを重みに比例して割り当て（各要素はcaps以下、端数は剰余の大きい順に配る）"""
+    allocation = [0] * len(weights)
+    active = [i for i in range(len(weights)) if caps[i] > 0 and weights[i] > 0]
+    remaining = min(total, sum(caps[i] for i in active))
+    while remaining > 0 and active:
+        weight_sum = sum(weights[i] for i in active)
+        shares = {i: remaining * weights[i] / weight_sum for i in active}
+        # 取り分が上限に届く要素は上限で確定し、残りを他の要素で分け直す
+        capped = [i for i in active if shares[i] >= caps[i] - allocation[i]]
+        if capped:
+            for i in capped:
+                remaining -= caps[i] - allocation[i]
+                allocation[i] = caps[i]
+            active = [i for i in active if i not in capped]
+            continue
+        for i in active:
+            allocation[i] += int(shares[i])
+            remaining -= int(shares[i])
+        for i in sorted(active, key=lambda i: shares[i] - int(shares[i]), reverse=True)[:remaining]:
+            allocation[i] += 1
+        break
+    return allocation
+
+def exit_steps(x: float, y: float, vx: float, vy: float, step: float) -> int:
+    """何ステップ後に画面外へ出るか（1ステップ後に画面外なら1、出ない場合は大きな値）"""
+    x1 = x + vx * step
+    y1 = y + vy * step
+    if not (0 <= x1 <= GAME_WIDTH and -50 <= y1 <= GAME_HEIGHT + 50):
+        return 1
+    steps = 1 << 30
+    # 画面内にいる最後のステップ + 1
+    if vy > 0:
+        steps = min(steps, int((GAME_HEIGHT + 50 - y) // (vy * step)) + 1)
+    elif vy < 0:
+        steps = min(steps, int((y + 50) // (-vy * step)) + 1)
+    if vx > 0:
+        steps = min(steps, int((GAME_WIDTH - x) // (vx * step)) + 1)
+    elif vx < 0:
+        steps = min(steps, int(x // (-vx * step)) + 1)
+    return steps
+
+class BulletStore:
+    """辞書ベースの弾幕プール（デフォルト）
+
+    弾幕は生成時の位置とステップ時刻だけを保持し、現在位置は読み出し時に計算する。
+    生成時にvx/vyから画面外に出るティック（寿命と早い方）を求めてバケットに登録するため、
+    削除のコストは生存数ではなく削除数に比例する。
+    容量超過時は最も多く弾幕を持つソースの古い弾幕から追い出す（ソースごとの公平な取り分）。
+    """
+
+    def __init__(self, max_bullets: int = MAX_BULLETS, source_share: Optional[float] = None,
+                 step: float = 1 / UPDATE_RATE):
+        self.max_bullets = max_bullets
+        # 1ソースが保持できる弾幕数の上限（Noneなら容量超過時の公平分配のみ）
+        self.source_cap = max(1, int(max_bullets * source_share)) if source_share else max_bullets
+        self.step = step
+        self.tick = 0
+        self.clock = 0.0
+        self.bullets: Dict[str, Bullet] = {}  # 挿入順 = 古い順
+        self.spawn_clock: Dict[str, float] = {}
+        self.by_source: Dict[str, Dict[str, Bullet]] = {}
+        self.expiry_buckets: Dict[int, List[str]] = {}
+        self.lifetime_ticks = max(1, round(BULLET_LIFETIME / step))
+        self._evicted: List[str] = []
+
+    def __len__(self) -> int:
+        return len(self.bullets)
+
+    def add(self, bullets: List[Bullet]):
+        """弾幕追加（容量・ソース上限を超える分は古い弾幕を追い出す）"""
+        step = self.step
+        for bullet in bullets:
+            source_bullets = self.by_source.get(bullet.source)
+            if source_bullets is None:
+                source_bullets = self.by_source[bullet.source] = {}
+            if len(source_bullets) >= self.source_cap:
+                self._evict_oldest(source_bullets)
+            elif len(self.bullets) >= self.max_bullets:
+                largest = max(self.by_source.values(), key=len)
+                self._evict_oldest(source_bullets if len(source_bullets) >= len(largest) else largest)
+
+            self.bullets[bullet.id] = bullet
+            self.spawn_clock[bullet.id] = self.clock
+            source_bullets[bullet.id] = bullet
+            steps = min(exit_steps(bullet.x, bullet.y, bullet.vx, bullet.vy, step), self.lifetime_ticks)
+            expire_tick = self.tick + steps
+            bucket = self.expiry_buckets.get(expire_tick)
+            if bucket is None:
+                self.expiry_buckets[expire_tick] = [bullet.id]
+            else:
+                bucket.append(bullet.id)
+
+    def _evict_oldest(self, source_bullets: Dict[str, Bullet]):
+        bullet_id = next(iter(source_bullets))
+        self._remove(bullet_id)
+        self._evicted.append(bullet_id)
+
+    def _remove(self, bullet_id: str) -> bool:
+        bullet = self.bullets.pop(bullet_id, None)
+        if bullet is None:
+            return False  # 追い出し済み
+        del self.spawn_clock[bullet_id]
+        source_bullets = self.by_source[bullet.source]
+        del source_bullets[bullet_id]
+        if not source_bullets:
+            del self.by_source[bullet.source]
+        return True
+
+    def update(self, delta_time: float, current_time: float) -> List[str]:
+        """ティックを進め、このティックで画面外・寿命切れになる弾幕を削除（削除した弾幕IDを返す）"""
+        self.tick += 1
+        self.clock += delta_time
+        removed_ids = self._evicted
+        self._evicted = []
+        for bullet_id in self.expiry_buckets.pop(self.tick, ()):
+            if self._remove(bullet_id):
+                removed_ids.append(bullet_id)
+        return removed_ids
+
+    def count_by_source(self, source_id: str) -> int:
+        """指定ソースの弾幕数"""
+        return len(self.by_source.get(source_id, ()))
+
+    def positions(self):
+        """現在位置（x, y のリスト）"""
+        clock = self.clock
+        spawn_clock = self.spawn_clock
+        xs = []
+        ys = []
+        for bullet_id, b in self.bullets.items():
+            elapsed = clock - spawn_clock[bullet_id]
+            xs.append(b.x + b.vx * elapsed)
+            ys.append(b.y + b.vy * elapsed)
+        return xs, ys
+
+    def collision_data(self):
+        """当たり判定用データ（弾幕オブジェクト, x, y, size）"""
+        bullets = list(self.bullets.values())
+        xs, ys = self.positions()
+        return bullets, xs, ys, [b.size for b in bullets]
+
+    def to_dicts(self, source_names: Dict[str, str]) -> List[dict]:
+        """game_state用の弾幕リスト"""
+        xs, ys = self.positions()
+        return [
+            bullet_to_dict(b, x, y, source_names.get(b.source, 'Unknown'))
+            for b, x, y in zip(self.bullets.values(), xs, ys)
+        ]
+
+class NumpyBulletStore:
+    """x, y, vx, vy, size, created_at, ソースインデックスを連続したNumPy配列で保持する弾幕ストア
+
+    位置積分・画面外判定・寿命判定はベクトル演算で一括処理する。
+    Bulletオブジェクトは文字列など静的な属性の保持にのみ使い、
+    x/yは生成時の値のまま更新しない（現在位置は配列側が正）。
+    """
+
+    FIELDS = ('x', 'y', 'vx', 'vy', 'size', 'created_at')
+
+    def __init__(self, max_bullets: int = MAX_BULLETS, source_share: Optional[float] = None,
+                 capacity: int = 1024):
+        if np is None:
+            raise RuntimeError("NumpyBulletStore requires numpy (pip install numpy)")
+        self.max_bullets = max_bullets
+        self.source_cap = max(1, int(max_bullets * source_share)) if source_share else max_bullets
+        self._count = 0
+        self._capacity = max(capacity, 16)
+        for name in self.FIELDS:
+            setattr(self, name, np.empty(self._capacity, dtype=np.float64))
+        self.source_index = np.empty(self._capacity, dtype=np.int32)
+        self.meta = np.empty(self._capacity, dtype=object)
+        # source_id ⇔ インデックス対応表
+        self._source_ids: List[str] = []
+        self._source_lookup: Dict[str, int] = {}
+
+    def __len__(self) -> int:
+        return self._count
+
+    def _source_to_index(self, source_id: str) -> int:
+        index = self._source_lookup.get(source_id)
+        if index is None:
+            index = len(self._source_ids)
+            self._source_ids.append(source_id)
+            self._source_lookup[source_id] = index
+        return index
+
+    def _grow(self, required: int):
+        capacity = self._capacity
+        while capacity < required:
+            capacity *= 2
+        for name in self.FIELDS + ('source_index', 'meta'):
+            old = getattr(self, name)
+            new = np.empty(capacity, dtype=old.dtype)
+            new[:self._count] = old[:self._count]
+            setattr(self, name, new)
+        self._capacity = capacity
+
+    def add(self, bullets: List[Bullet]):
+        """弾幕追加"""
+        if not bullets:
+            return
+        start = self._count
+        end = start + len(bullets)
+        if end > self._capacity:
+            self._grow(end)
+        for name in self.FIELDS:
+            getattr(self, name)[start:end] = [getattr(b, name) for b in bullets]
+        self.source_index[start:end] = [self._source_to_index(b.source) for b in bullets]
+        for i, b in enumerate(bullets, start):
+            self.meta[i] = b
+        self._count = end
+
+    def update(self, delta_time: float, current_time: float) -> List[str]:
+        """弾幕位置更新と画面外・寿命切れの削除（ベクトル演算、削除した弾幕IDを返す）"""
+        n = self._count
+        if n == 0:
+            return []
+        x = self.x[:n]
+        y = self.y[:n]
+        x += self.vx[:n] * delta_time
+        y += self.vy[:n] * delta_time
+
+        keep = (x >= 0) & (x <= GAME_WIDTH) & (y >= -50) & (y <= GAME_HEIGHT + 50)
+        keep &= (current_time - self.created_at[:n]) < BULLET_LIFETIME
+
+        indices = np.flatnonzero(keep)
+        if len(indices) > self.source_cap:
+            indices = self._fair_trim(indices)  # 最大数・ソース上限
+        if len(indices) == n:
+            return []
+        keep[:] = False
+        keep[indices] = True
+        removed_ids = [b.id for b in self.meta[:n][~keep]]
+        self._compact(indices)
+        return removed_ids
+
+    def _fair_trim(self, indices):
+        """各ソースの割り当て数まで新しい弾幕を残す（fair_allocation参照）"""
+        sources = self.source_index[indices]
+        counts = np.bincount(sources, minlength=len(self._source_ids))
+        allocation = fair_allocation(counts.tolist(), self.max_bullets, self.source_cap)
+        if allocation == counts.tolist():
+            return indices
+        # ソースごとに新しい順に並べ、ソース内の順位が割り当て数未満のものを残す
+        order = np.lexsort((-self.created_at[indices], sources))
+        sorted_sources = sources[order]
+        group_start = np.searchsorted(sorted_sources, sorted_sources, side='left')
+        rank = np.arange(len(order)) - group_start
+        selected = order[rank < np.asarray(allocation)[sorted_sources]]
+        return indices[np.sort(selected)]
+
+    def _compact(self, indices):
+        k = len(indices)
+        for name in self.FIELDS + ('source_index', 'meta'):
+            arr = getattr(self, name)
+            arr[:k] = arr[indices]
+        self.meta[k:self._count] = None  # 参照を解放
+        self._count = k
+
+    def count_by_source(self, source_id: str) -> int:
+        """指定ソースの弾幕数"""
+        index = self._source_lookup.get(source_id)
+        if index is None:
+            return 0
+        return int(np.count_nonzero(self.source_index[:self._count] == index))
+
+    def collision_data(self):
+        """当たり判定用データ（弾幕オブジェクト, x, y, size）。座標は配列のビューを返す"""
+        n = self._count
+        return self.meta[:n], self.x[:n], self.y[:n], self.size[:n]
+
+    def to_dicts(self, source_names: Dict[str, str]) -> List[dict]:
+        """game_state用の弾幕リスト"""
+        n = self._count
+        names = [source_names.get(source_id, 'Unknown') for source_id in self._source_ids]
+        return [
+            bullet_to_dict(b, x, y, names[s])
+            for b, x, y, s in zip(self.meta[:n], self.x[:n].tolist(), self.y[:n].tolist(),
+                                  self.source_index[:n].tolist())
+        ]
+
+class SpatialGrid:
+    """一様グリッドによる空間ハッシュ（弾幕の近傍検索用）
+
+    毎ティック弾幕をセルに振り分け、プレイヤー周辺の3x3セルのみを探索する。
+    """
+
+    STRIDE = 1 << 16  # セルキー = cx * STRIDE + cy
+
+    def __init__(self, cell_size: float = COLLISION_CELL_SIZE):
+        self.cell_size = cell_size
+        self.cells: Dict[int, Any] = {}
+
+    def build(self, xs, ys):
+        """弾幕インデックスをセルに振り分け（NumPy配列ならベクトル演算）"""
+        if np is not None and isinstance(xs, np.ndarray):
+            self._build_arrays(xs, ys)
+            return
+        cell_size = self.cell_size
+        stride = self.STRIDE
+        cells: Dict[int, List[int]] = {}
+        for i, (x, y) in enumerate(zip(xs, ys)):
+            key = int(x // cell_size) * stride + int(y // cell_size)
+            bucket = cells.get(key)
+            if bucket is None:
+                cells[key] = [i]
+            else:
+                bucket.append(i)
+        self.cells = cells
+
+    def _build_arrays(self, xs, ys):
+        keys = (xs // self.cell_size).astype(np.int64) * self.STRIDE + (ys // self.cell_size).astype(np.int64)
+        order = np.argsort(keys, kind='stable')
+        unique_keys, starts = np.unique(keys[order], return_index=True)
+        self.cells = dict(zip(unique_keys.tolist(), (c.tolist() for c in np.split(order, starts[1:]))))
+
+    def query(self, x: float, y: float) -> List[int]:
+        """(x, y) を含むセルと隣接8セルの弾幕インデックス"""
+        cx = int(x // self.cell_size)
+        cy = int(y // self.cell_size)
+        found = []
+        for dx in (-1, 0, 1):
+            base = (cx + dx) * self.STRIDE + cy
+            for dy in (-1, 0, 1):
+                bucket = self.cells.get(base + dy)
+                if bucket:
+                    found.extend(bucket)
+        return found
+
+def create_bullet_store(kind: str = 'list', max_bullets: int = MAX_BULLETS,
+                        source_share: Optional[float] = None):
+    """弾幕ストア生成（numpy未インストール時はlistにフォールバック）"""
+    if kind == 'numpy':
+        if np is not None:
+            return NumpyBulletStore(max_bullets, source_share)
+        print("Warning: numpy is not installed. Falling back to list bullet store.")
+    return BulletStore(max_bullets, source_share)
+
+# バイナリ形式（リトルエンディアン、各セクションは4バイト境界に整列）
+#   ヘッダ(32B): magic 'PN', version, kind(1=game_state, 2=game_delta), seq,
+#               timestamp(ms, float64), プレイヤー数, 弾幕数, 削除ID数, メタJSON長
+#   メタJSON: 文字列テーブル、capture_sources、players_removed
+#   プレイヤー: 固定長レコード × プレイヤー数
+#   弾幕: 列ごとの配列（uint32 id, float32 × 6, uint16 × 10）
+#   削除ID: uint32 × 削除ID数
+BINARY_MAGIC = b'PN'
+BINARY_VERSION = 1
+BINARY_KINDS = {'game_state': 1, 'game_delta': 2}
+BINARY_HEADER = struct.Struct('<2sBBIdIIII')
+# id, name, avatar(文字列インデックス), flags, hp, x, y, score, graze_count, death_time
+BINARY_PLAYER = struct.Struct('<HHHBbffiId')
+BINARY_BULLET_FLOATS = ('x', 'y', 'vx', 'vy', 'size')
+BINARY_BULLET_PORTS = ('port', 'src_port', 'dst_port')
+BINARY_BULLET_STRINGS = ('protocol', 'source', 'source_name', 'color', 'src_ip', 'dst_ip', 'src_name')
+
+# packet_data のバイナリ形式（packet_capture_client.py の PACKET_UPLOAD_* と一致させること）
+#   ヘッダ(8B): magic 'PU', version, IPv4レコード数, IPv6レコード数（uint16）
+#   IPv4レコード(16B) × IPv4数 → IPv6レコード(40B) × IPv6数
+#   レコード: protocol, interface(capture_auth.interfaces の番号+1、0: なし),
+#            src_port, dst_port, size, src_ip, dst_ip（ネットワークバイトオーダー）
+PACKET_UPLOAD_MAGIC = b'PU'
+PACKET_UPLOAD_VERSION = 1
+PACKET_UPLOAD_HEADER = struct.Struct('<2sBxHH')
+PACKET_UPLOAD_V4 = struct.Struct('<BBHHH4s4s')
+PACKET_UPLOAD_V6 = struct.Struct('<BBHHH16s16s')
+PACKET_UPLOAD_PREFIX = struct.Struct('<BBHH')  # protocol, interface, src_port, dst_port（対象判定用）
+PACKET_PROTOCOLS = {1: 'TCP', 2: 'UDP', 3: 'ICMP'}
+PACKET_PROTOCOL_ICMP = 3
+
+def scan_packet_upload(payload: bytes) -> Tuple[int, List[int], int, Dict[int, int]]:
+    """バイナリ packet_data から弾幕になり得るレコードのオフセットを抽出
+
+    レコードはdictにせず、protocolとポートだけを読んで判定する。
+    戻り値: (レコード総数, 対象レコードのオフセット, IPv6レコードの開始位置, インターフェース番号ごとの件数)
+    """
+    if len(payload) < PACKET_UPLOAD_HEADER.size:
+        raise ValueError(f"packet_data frame too short ({len(payload)} bytes)")
+    magic, version, v4_count, v6_count = PACKET_UPLOAD_HEADER.unpack_from(payload)
+    if magic != PACKET_UPLOAD_MAGIC or version != PACKET_UPLOAD_VERSION:
+        raise ValueError(f"unsupported packet_data frame (magic={magic!r}, version={version})")
+    v6_start = PACKET_UPLOAD_HEADER.size + v4_count * PACKET_UPLOAD_V4.size
+    if len(payload) != v6_start + v6_count * PACKET_UPLOAD_V6.size:
+        raise ValueError(f"packet_data frame length mismatch ({len(payload)} bytes)")
+    
+    offsets = []
+    interface_counts = {}
+    unpack_prefix = PACKET_UPLOAD_PREFIX.unpack_from
+    for start, count, record in ((PACKET_UPLOAD_HEADER.size, v4_count, PACKET_UPLOAD_V4),
+                                 (v6_start, v6_count, PACKET_UPLOAD_V6)):
+        for offset in range(start, start + count * record.size, record.size):
+            protocol, interface, src_port, dst_port = unpack_prefix(payload, offset)
+            if interface:
+                interface_counts[interface] = interface_counts.get(interface, 0) + 1
+            # JSON形式と同じ判定（ICMP以外のウェルノウンポートは弾幕にしない）
+            if protocol == PACKET_PROTOCOL_ICMP or (dst_port or src_port) > 1023:
+                offsets.append(offset)
+    return v4_count + v6_count, offsets, v6_start, interface_counts
+
+def decode_packet_record(payload: bytes, offset: int, v6_start: int, interfaces: List[str]) -> dict:
+    """バイナリ packet_data の1レコードをJSON形式と同じパケット情報に変換"""
+    if offset < v6_start:
+        protocol, interface, src_port, dst_port, size, src, dst = PACKET_UPLOAD_V4.unpack_from(payload, offset)
+        src_ip, dst_ip = socket.inet_ntoa(src), socket.inet_ntoa(dst)
+    else:
+        protocol, interface, src_port, dst_port, size, src, dst = PACKET_UPLOAD_V6.unpack_from(payload, offset)
+        src_ip, dst_ip = socket.inet_ntop(socket.AF_INET6, src), socket.inet_ntop(socket.AF_INET6, dst)
+    packet = {
+        'protocol': PACKET_PROTOCOLS.get(protocol, 'UNKNOWN'),
+        'src_port': src_port,
+        'dst_port': dst_port,
+        'size': size,
+        'src_ip': src_ip,
+        'dst_ip': dst_ip
+    }
+    if 0 < interface <= len(interfaces):
+        packet['interface'] = interfaces[interface - 1]
+    return packet
+
+MAX_PIPELINE_STAGES = 32  # capture_pipeline で受け付ける段階数の上限（メトリクスのラベル数を抑える）
+
+def _is_count(value) -> bool:
+    return isinstance(value, int) and not isinstance(value, bool) and value >= 0
+
+def validate_capture_pipeline(data: dict) -> Optional[Dict[str, Any]]:
+    """capture_pipeline の形と型を検証し、メトリクスで使う部分だけを返す（不正ならNone）"""
+    stages = data.get('stages')
+    if (not isinstance(stages, dict) or len(stages) > MAX_PIPELINE_STAGES
+            or not all(isinstance(stage, str) and _is_count(count) for stage, count in stages.items())):
+        return None
+    pipeline = {'stages': stages}
+    
+    histogram = data.get('handler_time_us')
+    if histogram is not None:
+        if not isinstance(histogram, dict):
+            return None
+        buckets = histogram.get('buckets')
+        counts = histogram.get('counts')
+        total = histogram.get('sum')
+        if (not isinstance(buckets, list) or not isinstance(counts, list)
+                or not all(isinstance(b, (int, float)) and not isinstance(b, bool) for b in buckets)
+                or any(a >= b for a, b in zip(buckets, buckets[1:]))
+                or len(counts) != len(buckets) + 1 or not all(_is_count(count) for count in counts)
+                or not isinstance(total, (int, float)) or isinstance(total, bool) or total < 0):
+            return None
+        pipeline['handler_time_us'] = {'buckets': buckets, 'counts': counts, 'sum': total}
+    return pipeline
+
+def validate_flow_record(flow) -> Optional[Dict[str, Any]]:
+    """flow_data の1フローの形と型を検証し、弾幕生成で使うフィールドだけを返す（不正ならNone）"""
+    if not isinstance(flow, dict):
+        return None
+    packets = flow.get('packets', 1)
+    size = flow.get('bytes', 0)
+    src_port = flow.get('src_port') or 0  # ICMPはポートなし（None）
+    dst_port = flow.get('dst_port') or 0
+    protocol = flow.get('protocol', 'UNKNOWN')
+    src_ip = flow.get('src_ip', '')
+    dst_ip = flow.get('dst_ip', '')
+    interface = flow.get('interface')
+    if (not _is_count(packets) or not _is_count(size)
+            or not all(_is_count(port) and port <= 0xFFFF for port in (src_port, dst_port))
+            or not all(isinstance(value, str) for value in (protocol, src_ip, dst_ip))
+            or (interface is not None and not isinstance(interface, str))):
+        return None
+    record = {'protocol': protocol, 'src_ip': src_ip, 'dst_ip': dst_ip, 'src_port': src_port,
+              'dst_port': dst_port, 'packets': max(1, packets), 'bytes': size}
+    if interface:
+        record['interface'] = interface
+    return record
+
+def _bullet_number(bullet_id: str) -> int:
+    return int(bullet_id[2:])  # 'b_123' -> 123
+
+def encode_binary_state(message: dict, full_players: Optional[Dict[str, dict]] = None) -> bytes:
+    """game_state / game_delta をバイナリ形式にエンコード
+
+    game_delta のプレイヤーは変更項目のみなので、full_players から完全なレコードを引く。
+    """
+    kind = BINARY_KINDS[message['type']]
+    timestamp = message['timestamp']
+    bullets = message['bullets'] if kind == 1 else message['spawned']
+    despawned = message.get('despawned', [])
+    players = message['players']
+    if full_players is not None:
+        players = {player_id: full_players[player_id] for player_id in players if player_id in full_players}
+
+    strings: Dict[Any, int] = {}
+    def intern(value) -> int:
+        index = strings.get(value)
+        if index is None:
+            index = strings[value] = len(strings)
+        return index
+
+    player_records = []
+    for player_id, p in players.items():
+        flags = (p['alive'] and 1) | (p['invulnerable'] and 2) | (p['death_time'] is not None and 4)
+        player_records.append(BINARY_PLAYER.pack(
+            intern(player_id), intern(p['name']), intern(p['avatar']), flags, p['hp'],
+            p['x'], p['y'], p['score'], p['graze_count'],
+            p['death_time'] if p['death_time'] is not None else 0.0
+        ))
+
+    n = len(bullets)
+    columns = [struct.pack(f'<{n}I', *[_bullet_number(b['id']) for b in bullets])]
+    for name in BINARY_BULLET_FLOATS:
+        columns.append(struct.pack(f'<{n}f', *[b[name] for b in bullets]))
+    # 生成時刻は timestamp からの相対ミリ秒（game_delta の spawned のみ）
+    columns.append(struct.pack(f'<{n}f', *[b.get('created_at', timestamp) - timestamp for b in bullets]))
+    for name in BINARY_BULLET_PORTS:
+        columns.append(struct.pack(f'<{n}H', *[b[name] or 0 for b in bullets]))
+    for name in BINARY_BULLET_STRINGS:
+        columns.append(struct.pack(f'<{n}H', *[intern(b[name]) for b in bullets]))
+
+    meta = {'strings': list(strings)}
+    if 'capture_sources' in message:
+        meta['capture_sources'] = message['capture_sources']
+    if 'players_removed' in message:
+        meta['players_removed'] = message['players_removed']
+    meta_bytes = json.dumps(meta, separators=(',', ':')).encode('utf-8')
+    meta_bytes += b' ' * (-len(meta_bytes) % 4)
+
+    header = BINARY_HEADER.pack(
+        BINARY_MAGIC, BINARY_VERSION, kind, message['seq'], float(timestamp),
+        len(player_records), n, len(despawned), len(meta_bytes)
+    )
+    return b''.join([
+        header, meta_bytes, *player_records, *columns,
+        struct.pack(f'<{len(despawned)}I', *[_bullet_number(i) for i in despawned])
+    ])
+
+def _escape_label(value) -> str:
+    """Prometheusラベル値のエスケープ"""
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+class TickStats:
+    """ティック処理時間の統計
+
+    フェーズ（simulate / serialize / broadcast）別と合計の処理時間を直近ウィンドウ分保持し、
+    p50 / p99 / 最大値と締め切り超過回数を集計する。
+    """
+
+    PHASES = ('simulate', 'serialize', 'broadcast', 'total')
+
+    def __init__(self, budget: float, window: int = TICK_STATS_WINDOW):
+        self.budget = budget
+        self.samples = {phase: deque(maxlen=window) for phase in self.PHASES}
+        self.ticks = 0
+        self.missed_deadlines = 0
+        self.catch_up_steps = 0  # 遅れを取り戻すために追加で実行したステップ数
+        self.skipped_steps = 0   # 追いつけずに破棄したステップ数
+        self.reported_missed = 0
+        # 合計処理時間のヒストグラム（メトリクス用、全期間）
+        self.histogram_counts = [0] * (len(TICK_HISTOGRAM_BUCKETS) + 1)
+        self.histogram_sum = 0.0
+
+    def record(self, simulate: float, serialize: float, broadcast: float, missed: bool):
+        self.ticks += 1
+        self.samples['simulate'].append(simulate)
+        self.samples['serialize'].append(serialize)
+        self.samples['broadcast'].append(broadcast)
+        total = simulate + serialize + broadcast
+        self.samples['total'].append(total)
+        self.histogram_counts[bisect.bisect_left(TICK_HISTOGRAM_BUCKETS, total)] += 1
+        self.histogram_sum += total
+        if missed:
+            self.missed_deadlines += 1
+
+    @staticmethod
+    def _percentile(sorted_values: List[float], q: float) -> float:
+        if not sorted_values:
+            return 0.0
+        return sorted_values[min(len(sorted_values) - 1, int(q * len(sorted_values)))]
+
+    def summary(self) -> dict:
+        """フェーズ別のp50/p99/最大（ミリ秒）と各カウンタ"""
+        phases = {}
+        for phase, samples in self.samples.items():
+            values = sorted(samples)
+            phases[phase] = {
+                'p50_ms': self._percentile(values, 0.5) * 1000,
+                'p99_ms': self._percentile(values, 0.99) * 1000,
+                'max_ms': (values[-1] if values else 0.0) * 1000
+            }
+        return {
+            'budget_ms': self.budget * 1000,
+            'ticks': self.ticks,
+            'missed_deadlines': self.missed_deadlines,
+            'catch_up_steps': self.catch_up_steps,
+            'skipped_steps': self.skipped_steps,
+            'phases': phases
+        }
+
+    def report(self):
+        """締め切り超過やp99が予算に迫っている場合に警告を出力"""
+        summary = self.summary()
+        total = summary['phases']['total']
+        missed = self.missed_deadlines - self.reported_missed
+        self.reported_missed = self.missed_deadlines
+        if missed or total['p99_ms'] > summary['budget_ms'] * TICK_WARN_RATIO:
+            phases = summary['phases']
+            print(f"[Tick] budget {summary['budget_ms']:.1f}ms | "
+                  f"p50 {total['p50_ms']:.1f}ms p99 {total['p99_ms']:.1f}ms max {total['max_ms']:.1f}ms | "
+                  f"simulate p99 {phases['simulate']['p99_ms']:.1f}ms "
+                  f"serialize p99 {phases['serialize']['p99_ms']:.1f}ms "
+                  f"broadcast p99 {phases['broadcast']['p99_ms']:.1f}ms | "
+                  f"missed {missed} skipped steps {self.skipped_steps}")
+
+@dataclass
+class TokenBucket:
+    """弾幕生成レート制限用のトークンバケット（rate: トークン/秒）"""
+    rate: float
+    capacity: float
+    tokens: float = 0.0
+    updated_at: float = field(default_factory=time.monotonic)
+
+    def __post_init__(self):
+        self.tokens = self.capacity
+
+    def refill(self, now: float):
+        elapsed = now - self.updated_at
+        if elapsed > 0:
+            self.tokens = min(self.capacity, self.tokens + elapsed * self.rate)
+            self.updated_at = now
+
+    @property
+    def available(self) -> int:
+        return int(self.tokens)
+
+    def consume(self, count: int):
+        self.tokens -= count
+
+class SourceRegistry:
+    """source_id → ソース情報（インデックス、名前、配色、速度補正）の対応表
+
+    接続/切断時にのみ更新し、パケット処理やgame_state生成ではO(1)で参照する。
+    インデックスは空きの最小値を割り当て、他ソースの切断で既存ソースの色が変わらないようにする。
+    """
 
-class HubServer:
     def __init__(self):
+        self.sources: Dict[str, SourceInfo] = {}
+        self.names: Dict[str, str] = {}  # source_id → 表示名（game_state用）
+        self._used_indices = set()
+
+    def __len__(self) -> int:
+        return len(self.sources)
+
+    def get(self, source_id: str) -> Optional[SourceInfo]:
+        return self.sources.get(source_id)
+
+    def register(self, source_id: str, name: str, client_id: str) -> SourceInfo:
+        """ソース登録（同じsource_idの再接続ではインデックスを引き継ぐ）"""
+        info = self.sources.get(source_id)
+        if info is None:
+            index = 0
+            while index in self._used_indices:
+                index += 1
+            self._used_indices.add(index)
+            info = SourceInfo(
+                source_id=source_id,
+                index=index,
+                name=name,
+                colors=SOURCE_COLORS[index % len(SOURCE_COLORS)],
+                speed_modifier=1 + (index * 0.1),  # ソースごとに10%速度変化
+                client_id=client_id
+            )
+            self.sources[source_id] = info
+        else:
+            info.name = name
+            info.client_id = client_id
+        self.names[source_id] = name
+        return info
+
+    def unregister(self, source_id: str, client_id: str):
+        """ソース削除（再接続で別クライアントに引き継がれている場合は何もしない）"""
+        info = self.sources.get(source_id)
+        if info is None or info.client_id != client_id:
+            return
+        del self.sources[source_id]
+        del self.names[source_id]
+        self._used_indices.discard(info.index)
+
+class ClientOutbox:
+    """クライアント毎の送信キュー
+
+    イベント（player_event, leaderboard, chat_broadcast 等）は順序通り全て送信し、
+    状態フレーム（game_state / game_delta）は未送信の最新1件のみ保持する。
+    送信はクライアント毎のタスクで独立して行うため、遅いクライアントが他を待たせない。
+    """
+
+    def __init__(self, client_id: str, websocket: WebSocketServerProtocol,
+                 max_reliable: int = MAX_RELIABLE_BACKLOG):
+        self.client_id = client_id
+        self.websocket = websocket
+        self.max_reliable = max_reliable
+        self.reliable: deque = deque()
+        self.state_frame = None
+        self.wakeup = asyncio.Event()
+        self.task: Optional[asyncio.Task] = None
+        self.closed = False
+        # 統計
+        self.sent_messages = 0
+        self.sent_bytes = 0
+        self.dropped_frames = 0
+
+    @property
+    def depth(self) -> int:
+        return len(self.reliable) + (self.state_frame is not None)
+
+    def start(self):
+        self.task = asyncio.create_task(self._writer())
+
+    def stop(self):
+        self.closed = True
+        if self.task:
+            self.task.cancel()
+
+    def push_reliable(self, payload):
+        """イベント追加（破棄しない、溢れた場合は切断）"""
+        if self.closed:
+            return
+        if len(self.reliable) >= self.max_reliable:
+            print(f"Send backlog exceeded for {self.client_id}, closing connection")
+            self.closed = True
+            asyncio.create_task(self.websocket.close(code=1013, reason='send backlog exceeded'))
+            return
+        self.reliable.append(payload)
+        self.wakeup.set()
+
+    def push_state(self, payload) -> bool:
+        """状態フレーム設定（未送信の古いフレームは破棄）。破棄した場合Trueを返す"""
+        if self.closed:
+            return False
+        dropped = self.state_frame is not None
+        if dropped:
+            self.dropped_frames += 1
+        self.state_frame = payload
+        self.wakeup.set()
+        return dropped
+
+    async def _writer(self):
+        try:
+            while not self.closed:
+                await self.wakeup.wait()
+                self.wakeup.clear()
+                while self.reliable or self.state_frame is not None:
+                    if self.reliable:
+                        payload = self.reliable.popleft()
+                    else:
+                        payload, self.state_frame = self.state_frame, None
+                    await self.websocket.send(payload)
+                    self.sent_messages += 1
+                    self.sent_bytes += len(payload)
+        except websockets.exceptions.ConnectionClosed:
+            # 切断処理は受信側（handle_client）で行う
+            pass
+        except Exception as e:
+            print(f"Error sending to client {self.client_id}: {e}")
+            await self.websocket.close()
+        finally:
+            self.closed = True
+
+class HubServer:
+    def __init__(self, bullet_store: str = 'list', authoritative: bool = False,
+                 metrics_port: int = METRICS_PORT, source_share: Optional[float] = None,
+                 source_spawn_rate: float = SOURCE_SPAWN_RATE, global_spawn_rate: float = GLOBAL_SPAWN_RATE):
         self.capture_clients: Dict[str, CaptureClient] = {}
+        self.sources = SourceRegistry()
+        # 弾幕生成のレート制限（ソースごと + 全体）
+        self.source_spawn_rate = source_spawn_rate
+        self.spawn_bucket = TokenBucket(global_spawn_rate, global_spawn_rate * SPAWN_BURST)
+        # サーバー側当たり判定（有効時はクライアントの player_hit / player_graze を無視）
+        self.authoritative = authoritative
+        self.collision_grid = SpatialGrid()
+        self.tick_stats = TickStats(1 / UPDATE_RATE)
+        # 生成目標の倍率（update_spawn_budget で更新）
+        self.spawn_scale = 1.0
+        self.spawn_load = 0.0
+        self.spawn_headroom = 1.0
+        self.metrics_port = metrics_port  # 0で無効
         self.game_clients: Dict[str, GameClient] = {}
-        self.bullets: List[Bullet] = []
+        self.bullets = create_bullet_store(bullet_store, source_share=source_share)
+        # 差分モード用（前回配信以降に生成/削除された弾幕、前回配信したプレイヤー状態）
+        self.tick = 0
+        self.pending_spawns: List[dict] = []
+        self.pending_despawns: List[str] = []
+        self.last_players: Dict[str, dict] = {}
+        self.last_capture_sources: Dict[str, dict] = {}
         self.bullet_id_counter = 0
         self.client_id_counter = 0
         self.start_time = time.time()
@@ -156,24 +1061,53 @@ class HubServer:
         """キャプチャクライアント処理"""
         source_id = auth_data.get('source_id', client_id)
         source_name = auth_data.get('source_name', f'Capture {client_id}')
+        interfaces = [str(name) for name in auth_data.get('interfaces') or []]
+        try:
+            packet_encoding = WireEncoding(auth_data.get('packet_encoding', 'json'))
+        except ValueError:
+            packet_encoding = WireEncoding.JSON
         
         client = CaptureClient(
             id=client_id,
             source_id=source_id,
             source_name=source_name,
             websocket=websocket,
-            ip_address=client_ip
+            ip_address=client_ip,
+            interfaces=interfaces,
+            packet_encoding=packet_encoding
         )
         self.capture_clients[client_id] = client
+        self.sources.register(source_id, source_name, client_id)
+        self.update_source_budget(client)
         
-        print(f"Capture client connected: {source_name} ({client_id}) from {client_ip}")
+        interface_text = f" [{', '.join(interfaces)}]" if interfaces else ''
+        print(f"Capture client connected: {source_name}{interface_text} ({client_id}) from {client_ip}")
+        
+        # 受け入れた packet_data 形式を通知（通知を受けるまでクライアントはJSONで送信）
+        if packet_encoding != WireEncoding.JSON:
+            await self.send_capture_message(client, {
+                'type': 'capture_ack',
+                'packet_encoding': packet_encoding.value
+            })
         
         # メッセージ処理ループ
         async for message in websocket:
+            if isinstance(message, bytes):
+                if packet_encoding == WireEncoding.BINARY:
+                    await self.process_binary_packet_data(client, message)
+                continue
             try:
                 data = json.loads(message)
                 if data.get('type') == 'packet_data':
                     await self.process_packet_data(client, data)
+                elif data.get('type') == 'flow_data':
+                    await self.process_flow_data(client, data)
+                elif data.get('type') == 'capture_pipeline':
+                    pipeline = validate_capture_pipeline(data)
+                    if pipeline is None:
+                        print(f"Invalid capture_pipeline from {client.source_name} ignored")
+                    else:
+                        client.pipeline = pipeline
             except json.JSONDecodeError:
                 continue
     
@@ -181,13 +1115,17 @@ class HubServer:
         """ゲームクライアント処理"""
         try:
             mode = GameMode(auth_data.get('mode', 'player'))
+            state_mode = StateMode(auth_data.get('state_mode', 'snapshot'))
+            encoding = WireEncoding(auth_data.get('encoding', 'json'))
             player_name = auth_data.get('player_name', f'Player {client_id}')
             avatar = auth_data.get('avatar', 'nyan_cat')
             
             client = GameClient(
                 id=client_id,
                 mode=mode,
-                websocket=websocket
+                websocket=websocket,
+                state_mode=state_mode,
+                encoding=encoding
             )
             
             # プレイヤーモードの場合、プレイヤー状態を作成
@@ -198,19 +1136,26 @@ class HubServer:
                     avatar=avatar
                 )
             
+            client.outbox = ClientOutbox(client_id, websocket)
+            client.outbox.start()
             self.game_clients[client_id] = client
             
             # 認証成功メッセージ送信
-            await self.send_json(websocket, {
+            client.outbox.push_reliable(json.dumps({
                 'type': 'auth_success',
                 'player_id': client_id,
+                'state_mode': state_mode.value,
+                'encoding': encoding.value,
                 'game_config': {
                     'max_bullets': MAX_BULLETS,
                     'game_width': GAME_WIDTH,
                     'game_height': GAME_HEIGHT,
-                    'difficulty': 1
+                    'difficulty': 1,
+                    'update_rate': UPDATE_RATE,
+                    'keyframe_interval': KEYFRAME_INTERVAL,
+                    'authoritative': self.authoritative
                 }
-            })
+            }))
             
             # 参加イベント通知
             if mode == GameMode.PLAYER:
@@ -242,19 +1187,24 @@ class HubServer:
             y = max(0, min(GAME_HEIGHT, data.get('y', client.player_state.y)))
             client.player_state.x = x
             client.player_state.y = y
+            client.player_state.last_move_time = time.time()
             
-        elif msg_type == 'player_hit' and client.player_state:
+        elif msg_type == 'player_hit' and client.player_state and not self.authoritative:
             await self.handle_player_hit(client, data.get('bullet_id'))
             
-        elif msg_type == 'player_graze' and client.player_state:
+        elif msg_type == 'player_graze' and client.player_state and not self.authoritative:
             client.player_state.graze_count += 1
-            client.player_state.score += 100
+            client.player_state.score += GRAZE_SCORE
             
         elif msg_type == 'game_control':
             action = data.get('action')
             if action == 'restart' and client.player_state:
                 await self.respawn_player(client)
         
+        elif msg_type == 'state_resync':
+            # 差分の取りこぼしを検出したクライアントへ次ティックでキーフレーム送信
+            client.needs_keyframe = True
+        
         elif msg_type == 'chat':
             await self.broadcast_chat(client.id, client.player_state.name if client.player_state else 'Spectator', data.get('message', ''))
     
@@ -298,25 +1248,119 @@ class HubServer:
     async def process_packet_data(self, client: CaptureClient, data: dict):
         """パケットデータ処理"""
         packets = data.get('packets', [])
-        new_bullets = []
+        if data.get('spooled'):
+            client.spooled_packets += len(packets)
         
-        # ソースごとの色とパターンを割り当て
-        source_index = list(self.capture_clients.keys()).index(client.id) if client.id in self.capture_clients else 0
-        source_colors = [
-            {'TCP': '#FF4444', 'UDP': '#4444FF', 'ICMP': '#44FF44', 'UNKNOWN': '#FFFF44'},  # Source 1: 明るい
-            {'TCP': '#CC0000', 'UDP': '#0000CC', 'ICMP': '#00CC00', 'UNKNOWN': '#CCCC00'},  # Source 2: 濃い
-            {'TCP': '#FF8888', 'UDP': '#8888FF', 'ICMP': '#88FF88', 'UNKNOWN': '#FFFF88'},  # Source 3: 薄い
-            {'TCP': '#FF00FF', 'UDP': '#00FFFF', 'ICMP': '#FFFF00', 'UNKNOWN': '#FF8800'},  # Source 4: ネオン
-        ]
-        colors = source_colors[source_index % len(source_colors)]
+        # インターフェースごとの受信数（1つのキャプチャクライアントが複数NICを監視する場合）
+        interface_packets = client.interface_packets
+        for packet in packets:
+            interface = packet.get('interface')
+            if interface:
+                interface_packets[interface] = interface_packets.get(interface, 0) + 1
+        
+        # 弾幕にならないパケット（ICMP以外のウェルノウンポート）を除外
+        eligible = []
+        for packet in packets:
+            port = packet.get('dst_port', 0) or packet.get('src_port', 0)
+            protocol = packet.get('protocol', 'UNKNOWN')
+            if protocol == 'ICMP' or (port and port > 1023):
+                eligible.append(packet)
+        
+        await self.spawn_packet_bullets(client, self.admit_sample(client, eligible), len(packets))
+    
+    async def process_binary_packet_data(self, client: CaptureClient, payload: bytes):
+        """バイナリ packet_data 処理（対象判定・間引きの後、採用したレコードだけをデコード）"""
+        try:
+            total, offsets, v6_start, interface_counts = scan_packet_upload(payload)
+        except (struct.error, ValueError) as e:
+            print(f"Invalid binary packet_data from {client.source_name}: {e}")
+            return
+        
+        interfaces = client.interfaces
+        for index, count in interface_counts.items():
+            if index <= len(interfaces):
+                name = interfaces[index - 1]
+                client.interface_packets[name] = client.interface_packets.get(name, 0) + count
+        packets = [decode_packet_record(payload, offset, v6_start, interfaces)
+                   for offset in self.admit_sample(client, offsets)]
+        await self.spawn_packet_bullets(client, packets, total)
+    
+    async def process_flow_data(self, client: CaptureClient, data: dict):
+        """フロー集計の処理（各フローのバイト数に比例して弾幕を割り当て、パケット数を上限とする）"""
+        flows = data.get('flows', [])
+        received = 0
+        invalid = 0
+        if not isinstance(flows, list):
+            flows = []
+            invalid = 1
+        eligible = []
+        interface_packets = client.interface_packets
+        for flow in flows:
+            # 不正なレコードは数えて捨てる（例外で接続を切らない）
+            flow = validate_flow_record(flow)
+            if flow is None:
+                invalid += 1
+                continue
+            packets = flow['packets']
+            received += packets
+            interface = flow.get('interface')
+            if interface:
+                interface_packets[interface] = interface_packets.get(interface, 0) + packets
+            port = flow['dst_port'] or flow['src_port']
+            if flow['protocol'] == 'ICMP' or port > 1023:
+                eligible.append(flow)
+        if invalid:
+            client.invalid_flows += invalid
+            print(f"Invalid flow records from {client.source_name} ignored ({invalid})")
         
-        # Process only a subset of packets if too many
-        max_packets_per_batch = 10  # Further reduced from 15 to 10
-        if len(packets) > max_packets_per_batch:
-            # Randomly sample to get more diversity
-            packets = random.sample(packets, max_packets_per_batch)
+        counts = [flow['packets'] for flow in eligible]
+        requested = sum(counts)
+        admitted = self.admit_packets(client, requested)
+        client.admitted_packets += admitted
+        client.shed_packets += requested - admitted
+        allocation = weighted_allocation([max(1, flow['bytes']) for flow in eligible], counts, admitted)
         
-        for i, packet in enumerate(packets):
+        # 割り当て数だけフローの代表パケットを並べる（サイズは平均パケットサイズ）
+        packets = []
+        for flow, count, bullets in zip(eligible, counts, allocation):
+            if not bullets:
+                continue
+            packet = {
+                'protocol': flow['protocol'],
+                'src_port': flow['src_port'],
+                'dst_port': flow['dst_port'],
+                'size': flow['bytes'] // count,
+                'src_ip': flow['src_ip'],
+                'dst_ip': flow['dst_ip']
+            }
+            if flow.get('interface'):
+                packet['interface'] = flow['interface']
+            packets.extend([packet] * bullets)
+        await self.spawn_packet_bullets(client, packets, received)
+    
+    def admit_sample(self, client: CaptureClient, eligible: list) -> list:
+        """トークンバケットで生成数を決定（超過分はランダムに間引いて多様性を保つ）"""
+        admitted = self.admit_packets(client, len(eligible))
+        client.admitted_packets += admitted
+        client.shed_packets += len(eligible) - admitted
+        if admitted < len(eligible):
+            eligible = random.sample(eligible, admitted)
+        return eligible
+    
+    async def spawn_packet_bullets(self, client: CaptureClient, eligible: List[dict], received: int):
+        """採用したパケットから弾幕を生成し、キャプチャ統計を返信"""
+        new_bullets = []
+        
+        # ソースごとの色とパターン（接続時に割り当て済み）
+        source = self.sources.get(client.source_id)
+        if source is None:
+            source = self.sources.register(client.source_id, client.source_name, client.id)
+        colors = source.colors
+        speed_modifier = source.speed_modifier
+        # 複数インターフェースのクライアントは弾幕の発射元名にインターフェースを付ける
+        multi_interface = len(client.interfaces) > 1
+        
+        for i, packet in enumerate(eligible):
             # ポート番号から位置決定
             port = packet.get('dst_port', 0) or packet.get('src_port', 0)
             
@@ -326,8 +1370,6 @@ class HubServer:
                 # ICMPパケットはランダムな位置に配置
                 x = random.uniform(0.1, 0.9) * GAME_WIDTH
                 port = 1  # ダミーのポート番号を設定
-            elif not port or port <= 1023:  # ウェルノウンポートはスキップ（ICMP以外）
-                continue
             else:
                 # 位置正規化
                 if port >= 49152:
@@ -336,7 +1378,6 @@ class HubServer:
                     x = ((port - 1024) / (49151 - 1024)) * GAME_WIDTH
             
             # プロトコル別の速度（ソースごとに少し変化）
-            speed_modifier = 1 + (source_index * 0.1)  # ソースごとに10%速度変化
             velocities = {
                 'TCP': {'vx': 0, 'vy': 100 * speed_modifier},
                 'UDP': {'vx': random.uniform(-50, 50), 'vy': 150 * speed_modifier},
@@ -373,53 +1414,164 @@ class HubServer:
                 dst_ip=packet.get('dst_ip', ''),
                 src_port=packet.get('src_port', 0),
                 dst_port=packet.get('dst_port', 0),
-                src_name=client.source_name
+                src_name=(f"{client.source_name}:{packet['interface']}"
+                          if multi_interface and packet.get('interface') else client.source_name)
             )
             
             new_bullets.append(bullet)
+            
+            # 差分モード用の生成レコード（原点・速度・生成時刻）
+            spawn = bullet_to_dict(bullet, bullet.x, bullet.y, client.source_name)
+            spawn['created_at'] = int(bullet.created_at * 1000)
+            self.pending_spawns.append(spawn)
         
         # 弾幕追加
-        self.bullets.extend(new_bullets)
+        self.bullets.add(new_bullets)
         
         # 統計更新
-        client.total_packets += len(packets)
-        client.last_packet_time = time.time()
+        now = time.time()
+        client.update_packet_rate(received, now)
+        client.total_packets += received
+        client.spawned_bullets += len(new_bullets)
+        client.last_packet_time = now
         
         # キャプチャ統計送信
-        await self.send_json(client.websocket, {
+        await self.send_capture_message(client, {
             'type': 'capture_stats',
             'connected_players': len([c for c in self.game_clients.values() if c.mode == GameMode.PLAYER]),
             'active_players': len([c for c in self.game_clients.values() if c.player_state and c.player_state.alive]),
             'total_bullets': len(self.bullets),
-            'bullets_from_source': len([b for b in self.bullets if b.source == client.source_id])
+            'bullets_from_source': self.bullets.count_by_source(client.source_id),
+            'spawn_allowance': self.get_spawn_allowance(client)
         })
     
-    def update_bullets(self, delta_time: float):
+    def admit_packets(self, client: CaptureClient, requested: int) -> int:
+        """ソースごと・全体のトークンバケットから生成可能な弾幕数を取得"""
+        now = time.monotonic()
+        bucket = client.spawn_bucket
+        if bucket is None:
+            bucket = client.spawn_bucket = TokenBucket(self.source_spawn_rate,
+                                                       self.source_spawn_rate * SPAWN_BURST)
+        bucket.refill(now)
+        bucket.rate = self.target_spawn_rate(client)  # 通知している生成目標で補充
+        self.spawn_bucket.refill(now)
+        admitted = min(requested, bucket.available, self.spawn_bucket.available)
+        bucket.consume(admitted)
+        self.spawn_bucket.consume(admitted)
+        return admitted
+    
+    def update_spawn_budget(self):
+        """弾幕プールの使用率とティック処理時間の余裕から生成目標の倍率を更新"""
+        self.spawn_load = len(self.bullets) / self.bullets.max_bullets
+        p99 = TickStats._percentile(sorted(self.tick_stats.samples['total']), 0.99)
+        self.spawn_headroom = max(0.0, 1 - p99 / self.tick_stats.budget)
+        load_scale = (1 - self.spawn_load) / (1 - SPAWN_LOAD_TARGET)
+        headroom_scale = self.spawn_headroom / SPAWN_HEADROOM_TARGET
+        self.spawn_scale = max(SPAWN_MIN_SCALE, min(1.0, load_scale, headroom_scale))
+        for client in self.capture_clients.values():
+            self.update_source_budget(client)
+    
+    def update_source_budget(self, client: CaptureClient):
+        """ソースごとの生成目標の倍率を更新
+
+        弾幕プールの使用率の代わりに、公平な取り分（max_bullets / ソース数）に対する
+        そのソースの弾幕数で絞るため、取り分を使い切ったソースから先に絞られる。
+        """
+        fair_share = self.bullets.max_bullets / max(1, len(self.capture_clients))
+        client.share_load = self.bullets.count_by_source(client.source_id) / fair_share
+        share_scale = (1 - client.share_load) / (1 - SPAWN_LOAD_TARGET)
+        headroom_scale = self.spawn_headroom / SPAWN_HEADROOM_TARGET
+        client.spawn_scale = max(SPAWN_MIN_SCALE, min(1.0, share_scale, headroom_scale))
+    
+    def target_spawn_rate(self, client: CaptureClient) -> float:
+        """ソースごとの生成目標（弾幕/秒）: 基準レート（全体レートの等分が上限）× そのソースの倍率"""
+        rate = min(self.source_spawn_rate, self.spawn_bucket.rate / max(1, len(self.capture_clients)))
+        return rate * client.spawn_scale
+    
+    def get_spawn_allowance(self, client: CaptureClient) -> dict:
+        """キャプチャクライアントに返す生成枠（rate: 生成目標 弾幕/秒、available: 現在送信できる数）"""
+        available = self.spawn_bucket.available
+        if client.spawn_bucket is not None:
+            available = min(available, client.spawn_bucket.available)
+        return {
+            'rate': round(self.target_spawn_rate(client), 3),
+            'available': available,
+            'load': round(self.spawn_load, 3),
+            'share_load': round(client.share_load, 3),
+            'headroom': round(self.spawn_headroom, 3)
+        }
+    
+    def update_bullets(self, delta_time: float, current_time: Optional[float] = None):
         """弾幕位置更新"""
-        current_time = time.time()
-        updated_bullets = []
-        
-        for bullet in self.bullets:
-            # 位置更新
-            bullet.x += bullet.vx * delta_time
-            bullet.y += bullet.vy * delta_time
-            
-            # 画面内チェック
-            if (0 <= bullet.x <= GAME_WIDTH and 
-                -50 <= bullet.y <= GAME_HEIGHT + 50 and
-                current_time - bullet.created_at < 10):  # 10秒で削除
-                updated_bullets.append(bullet)
+        if current_time is None:
+            current_time = time.time()
+        removed_ids = self.bullets.update(delta_time, current_time)
+        self.pending_despawns.extend(removed_ids)
         
-        self.bullets = updated_bullets[:MAX_BULLETS]  # 最大数制限
+        # 削除された弾幕のグレイズ記録を破棄
+        if self.authoritative and removed_ids:
+            removed = set(removed_ids)
+            for client in self.game_clients.values():
+                if client.player_state and client.player_state.grazed_bullets:
+                    client.player_state.grazed_bullets -= removed
         
         # 無敵時間更新
         for client in self.game_clients.values():
             if client.player_state and client.player_state.invulnerable:
-                if time.time() >= client.player_state.invulnerable_until:
+                if current_time >= client.player_state.invulnerable_until:
                     client.player_state.invulnerable = False
     
-    def get_game_state(self) -> dict:
-        """ゲーム状態取得"""
+    def has_fresh_position(self, player: PlayerState, now: float) -> bool:
+        """player_move による位置が新しいか
+
+        位置は player_move でしか更新されないため、送ってこない・途絶えたプレイヤーは
+        古い位置で判定せず、被弾もグレイズ加点もしない（クライアント申告は常に無視する）。
+        """
+        return player.last_move_time is not None and now - player.last_move_time < PLAYER_MOVE_TIMEOUT
+    
+    def detect_collisions(self) -> List[tuple]:
+        """サーバー側の被弾・グレイズ判定（空間グリッドで近傍の弾幕のみ検査）
+
+        グレイズはその場でスコアに反映し、被弾した (クライアント, 弾幕ID) のリストを返す。
+        """
+        now = time.time()
+        players = [c for c in self.game_clients.values()
+                   if c.player_state and c.player_state.alive and self.has_fresh_position(c.player_state, now)]
+        if not players or not len(self.bullets):
+            return []
+        
+        bullets, xs, ys, sizes = self.bullets.collision_data()
+        self.collision_grid.build(xs, ys)
+        if np is not None and isinstance(xs, np.ndarray):
+            xs, ys, sizes = xs.tolist(), ys.tolist(), sizes.tolist()
+        
+        hits = []
+        for client in players:
+            player = client.player_state
+            px, py = player.x, player.y
+            for i in self.collision_grid.query(px, py):
+                dx = xs[i] - px
+                dy = ys[i] - py
+                distance_sq = dx * dx + dy * dy
+                radius = sizes[i] / 2
+                if not player.invulnerable and distance_sq <= (PLAYER_HIT_RADIUS + radius) ** 2:
+                    hits.append((client, bullets[i].id))
+                    break
+                if distance_sq <= (GRAZE_RADIUS + radius) ** 2:
+                    bullet_id = bullets[i].id
+                    if bullet_id not in player.grazed_bullets:
+                        player.grazed_bullets.add(bullet_id)
+                        player.graze_count += 1
+                        player.score += GRAZE_SCORE
+        return hits
+    
+    async def apply_collisions(self):
+        """サーバー側判定の被弾を反映"""
+        for client, bullet_id in self.detect_collisions():
+            await self.handle_player_hit(client, bullet_id)
+    
+    def get_players_state(self) -> Dict[str, dict]:
+        """プレイヤー状態取得"""
         players = {}
         for client in self.game_clients.values():
             if client.player_state:
@@ -435,45 +1587,110 @@ class HubServer:
                     'invulnerable': client.player_state.invulnerable,
                     'death_time': client.player_state.death_time
                 }
-        
-        bullets = [
-            {
-                'id': b.id,
-                'x': b.x,
-                'y': b.y,
-                'vx': b.vx,
-                'vy': b.vy,
-                'size': b.size,
-                'protocol': b.protocol,
-                'source': b.source,
-                'source_name': self.capture_clients[next((k for k, v in self.capture_clients.items() if v.source_id == b.source), '')].source_name if b.source in [c.source_id for c in self.capture_clients.values()] else 'Unknown',
-                'port': b.port,
-                'color': b.color,
-                'src_ip': b.src_ip,
-                'dst_ip': b.dst_ip,
-                'src_port': b.src_port,
-                'dst_port': b.dst_port,
-                'src_name': b.src_name
-            }
-            for b in self.bullets
-        ]
-        
+        return players
+    
+    def get_capture_sources_state(self) -> Dict[str, dict]:
+        """キャプチャソース状態取得"""
         capture_sources = {}
+        now = time.time()
         for client in self.capture_clients.values():
             capture_sources[client.source_id] = {
                 'name': client.source_name,
-                'active': time.time() - client.last_packet_time < 5,
-                'packet_rate': client.packet_rate,
+                'active': now - client.last_packet_time < 5,
+                'packet_rate': client.current_packet_rate(now),
                 'ip_address': getattr(client, 'ip_address', 'unknown')
             }
+        return capture_sources
+    
+    def get_game_state(self, players: Optional[Dict[str, dict]] = None,
+                       capture_sources: Optional[Dict[str, dict]] = None) -> dict:
+        """ゲーム状態取得"""
+        bullets = self.bullets.to_dicts(self.sources.names)
         
         return {
             'type': 'game_state',
             'timestamp': int(time.time() * 1000),
-            'players': players,
+            'seq': self.tick,
+            'players': players if players is not None else self.get_players_state(),
             'bullets': bullets,
-            'capture_sources': capture_sources
+            'capture_sources': capture_sources if capture_sources is not None else self.get_capture_sources_state()
+        }
+    
+    def get_game_delta(self, players: Dict[str, dict], capture_sources: Dict[str, dict]) -> dict:
+        """前回配信からの差分取得（生成/削除された弾幕、変更されたプレイヤー項目）"""
+        # 同一ティック内で生成・削除された弾幕は送らない
+        despawned = set(self.pending_despawns)
+        spawned = [b for b in self.pending_spawns if b['id'] not in despawned]
+        spawned_ids = {b['id'] for b in self.pending_spawns}
+        
+        changed_players = {}
+        for player_id, player in players.items():
+            previous = self.last_players.get(player_id)
+            if previous is None:
+                changed_players[player_id] = player
+            else:
+                changed = {k: v for k, v in player.items() if previous.get(k) != v}
+                if changed:
+                    changed_players[player_id] = changed
+        
+        delta = {
+            'type': 'game_delta',
+            'timestamp': int(time.time() * 1000),
+            'seq': self.tick,
+            'spawned': spawned,
+            'despawned': [bullet_id for bullet_id in self.pending_despawns if bullet_id not in spawned_ids],
+            'players': changed_players,
+            'players_removed': [player_id for player_id in self.last_players if player_id not in players]
         }
+        if capture_sources != self.last_capture_sources:
+            delta['capture_sources'] = capture_sources
+        return delta
+    
+    async def broadcast_game_state(self):
+        """ゲーム状態配信（スナップショット/差分モード別）"""
+        self.enqueue_frames(self.serialize_game_state())
+    
+    def serialize_game_state(self) -> List[tuple]:
+        """ゲーム状態をモード別に一度ずつシリアライズ（(type, 送信先, JSON, バイナリ) のリスト）"""
+        self.tick += 1
+        players = self.get_players_state()
+        capture_sources = self.get_capture_sources_state()
+        
+        keyframe_ticks = max(1, int(KEYFRAME_INTERVAL * UPDATE_RATE))
+        if self.tick % keyframe_ticks == 0:
+            for client in self.game_clients.values():
+                client.needs_keyframe = True
+        
+        snapshot_clients = []
+        delta_clients = []
+        for client in self.game_clients.values():
+            if client.state_mode == StateMode.DELTA and not client.needs_keyframe:
+                delta_clients.append(client)
+            else:
+                snapshot_clients.append(client)
+                client.needs_keyframe = False
+        
+        frames = []
+        if delta_clients:
+            delta = self.get_game_delta(players, capture_sources)
+            frames.append(('game_delta', delta_clients, *self.serialize_message(delta, delta_clients, players)))
+        
+        if snapshot_clients:
+            game_state = self.get_game_state(players, capture_sources)
+            frames.append(('game_state', snapshot_clients,
+                           *self.serialize_message(game_state, snapshot_clients, players)))
+        
+        # 次ティックの差分基準を更新
+        self.pending_spawns.clear()
+        self.pending_despawns.clear()
+        self.last_players = players
+        self.last_capture_sources = capture_sources
+        return frames
+    
+    def enqueue_frames(self, frames: List[tuple]):
+        """シリアライズ済みフレームを各クライアントの送信キューに積む"""
+        for frame in frames:
+            self.enqueue_message(*frame)
     
     async def update_leaderboard(self):
         """リーダーボード更新"""
@@ -534,42 +1751,126 @@ class HubServer:
         }
         await self.broadcast_to_game_clients(chat_message)
     
-    async def broadcast_to_game_clients(self, message: dict):
-        """全ゲームクライアントに配信"""
+    def serialize_message(self, message: dict, clients: List[GameClient],
+                          players: Optional[Dict[str, dict]] = None) -> Tuple[Optional[str], Optional[bytes]]:
+        """送信先が必要とする形式でのみ一度ずつシリアライズ（JSON, バイナリ）"""
+        binary_payload = None
+        if message.get('type') in STATE_MESSAGE_TYPES and any(c.encoding == WireEncoding.BINARY for c in clients):
+            try:
+                binary_payload = encode_binary_state(message, players)
+            except struct.error as e:
+                # 文字列テーブル溢れ等はJSONにフォールバック
+                print(f"Binary encode failed, falling back to JSON: {e}")
+        
+        text_payload = None
+        if binary_payload is None or any(c.encoding != WireEncoding.BINARY for c in clients):
+            text_payload = json.dumps(message)
+        return text_payload, binary_payload
+    
+    async def broadcast_to_game_clients(self, message: dict, clients: Optional[List[GameClient]] = None):
+        """全ゲームクライアント（または指定クライアント）に配信
+
+        メッセージは一度だけシリアライズし、各クライアントの送信キューに積む。
+        """
         if not self.game_clients:
             return
-            
-        disconnected = []
+        
         # リストのコピーを作成して反復中の変更を防ぐ
-        clients = list(self.game_clients.items())
+        targets = list(self.game_clients.values()) if clients is None else list(clients)
+        self.enqueue_message(message.get('type'), targets, *self.serialize_message(message, targets))
+    
+    def enqueue_message(self, message_type: str, clients: List[GameClient],
+                        text_payload: Optional[str], binary_payload: Optional[bytes]):
+        """シリアライズ済みメッセージを各クライアントの送信キューに積む"""
+        is_state = message_type in STATE_MESSAGE_TYPES
+        is_keyframe = message_type == 'game_state'
         
-        for client_id, client in clients:
-            try:
-                await self.send_json(client.websocket, message)
-            except (websockets.exceptions.ConnectionClosed, ConnectionResetError, BrokenPipeError):
-                disconnected.append(client_id)
-            except Exception as e:
-                print(f"Error broadcasting to client {client_id}: {e}")
-                disconnected.append(client_id)
-        
-        for client_id in disconnected:
-            await self.handle_disconnect(client_id)
+        for client in clients:
+            if not client.outbox:
+                continue
+            if binary_payload is not None and client.encoding == WireEncoding.BINARY:
+                payload = binary_payload
+            else:
+                payload = text_payload
+            
+            if not is_state:
+                client.outbox.push_reliable(payload)
+            elif client.outbox.push_state(payload) and not is_keyframe:
+                # 未送信の差分を破棄したので次ティックでキーフレームを送る
+                client.needs_keyframe = True
+    
+    def get_broadcast_stats(self) -> Dict[str, dict]:
+        """クライアント毎の送信キュー統計"""
+        return {
+            client_id: {
+                'queue_depth': client.outbox.depth,
+                'dropped_frames': client.outbox.dropped_frames,
+                'sent_messages': client.outbox.sent_messages,
+                'sent_bytes': client.outbox.sent_bytes
+            }
+            for client_id, client in self.game_clients.items() if client.outbox
+        }
+    
+    async def simulate_step(self, delta_time: float):
+        """1シミュレーションステップ"""
+        # 弾幕更新
+        self.update_bullets(delta_time)
+        
+        # サーバー側当たり判定
+        if self.authoritative:
+            await self.apply_collisions()
     
     async def game_update_loop(self):
-        """ゲーム更新ループ（30fps）"""
+        """ゲーム更新ループ（30fps、単調時計による固定タイムステップ）
+
+        締め切りは開始時刻からの固定間隔で決まるため、処理時間やsleepの誤差が蓄積しない。
+        遅れた場合は最大 MAX_CATCH_UP_STEPS ステップまで追加でシミュレーションし、
+        それ以上の遅れは破棄する（配信はフレームごとに1回）。
+        """
+        step = 1 / UPDATE_RATE
+        next_tick = time.monotonic()
+        next_report = next_tick + TICK_REPORT_INTERVAL
+        next_budget = next_tick + SPAWN_BUDGET_INTERVAL
+        
         while True:
-            start_time = time.time()
+            tick_start = time.monotonic()
+            if tick_start < next_tick:
+                await asyncio.sleep(next_tick - tick_start)
+                continue
+            
+            # シミュレーション（遅れた分は上限付きで追いつく）
+            steps = 0
+            while next_tick <= tick_start and steps < MAX_CATCH_UP_STEPS:
+                await self.simulate_step(step)
+                next_tick += step
+                steps += 1
+            self.tick_stats.catch_up_steps += steps - 1
+            if next_tick <= tick_start:
+                skipped = int((tick_start - next_tick) // step) + 1
+                next_tick += skipped * step
+                self.tick_stats.skipped_steps += skipped
+            simulated = time.monotonic()
             
-            # 弾幕更新
-            self.update_bullets(1/UPDATE_RATE)
+            # ゲーム状態シリアライズ・配信
+            frames = self.serialize_game_state()
+            serialized = time.monotonic()
+            self.enqueue_frames(frames)
+            tick_end = time.monotonic()
             
-            # ゲーム状態配信
-            game_state = self.get_game_state()
-            await self.broadcast_to_game_clients(game_state)
+            self.tick_stats.record(simulated - tick_start, serialized - simulated, tick_end - serialized,
+                                   missed=tick_end > next_tick)
+            if tick_end >= next_budget:
+                self.update_spawn_budget()
+                next_budget = tick_end + SPAWN_BUDGET_INTERVAL
+            if tick_end >= next_report:
+                self.tick_stats.report()
+                next_report = tick_end + TICK_REPORT_INTERVAL
             
-            # FPS維持
-            elapsed = time.time() - start_time
-            await asyncio.sleep(max(0, 1/UPDATE_RATE - elapsed))
+            await asyncio.sleep(max(0, next_tick - time.monotonic()))
+    
+    def get_tick_stats(self) -> dict:
+        """ティック処理時間の統計"""
+        return self.tick_stats.summary()
     
     async def handle_disconnect(self, client_id: str):
         """クライアント切断処理"""
@@ -579,6 +1880,8 @@ class HubServer:
         try:
             if client_id in self.game_clients:
                 client = self.game_clients.get(client_id)
+                if client and client.outbox:
+                    client.outbox.stop()
                 if client and client.player_state:
                     # 他のクライアントに通知（切断されたクライアント以外）
                     temp_clients = self.game_clients.copy()
@@ -594,7 +1897,8 @@ class HubServer:
                 print(f"Game client disconnected: {client_id}")
                 
             elif client_id in self.capture_clients:
-                del self.capture_clients[client_id]
+                client = self.capture_clients.pop(client_id)
+                self.sources.unregister(client.source_id, client_id)
                 print(f"Capture client disconnected: {client_id}")
         except Exception as e:
             print(f"Error handling disconnect for {client_id}: {e}")
@@ -609,6 +1913,18 @@ class HubServer:
         except Exception as e:
             print(f"Error sending JSON: {e}")
     
+    async def send_capture_message(self, client: CaptureClient, data: dict):
+        """キャプチャクライアントへの送信（送信量を計測）"""
+        payload = json.dumps(data)
+        client.sent_messages += 1
+        client.sent_bytes += len(payload)
+        try:
+            await client.websocket.send(payload)
+        except websockets.exceptions.ConnectionClosed:
+            pass
+        except Exception as e:
+            print(f"Error sending JSON: {e}")
+    
     async def send_error(self, websocket: WebSocketServerProtocol, code: str, message: str):
         """エラーメッセージ送信"""
         await self.send_json(websocket, {
@@ -617,6 +1933,129 @@ class HubServer:
             'message': message
         })
     
+    def render_metrics(self) -> str:
+        """メトリクスをPrometheusテキスト形式で出力（スクレイプ時にのみ集計）"""
+        lines = []
+        
+        def metric(name: str, kind: str, help_text: str, samples):
+            lines.append(f"# HELP {name} {help_text}")
+            lines.append(f"# TYPE {name} {kind}")
+            for labels, value in samples:
+                label_text = ','.join(f'{k}="{_escape_label(v)}"' for k, v in labels.items())
+                lines.append(f"{name}{{{label_text}}} {value}" if label_text else f"{name} {value}")
+        
+        now = time.time()
+        captures = list(self.capture_clients.values())
+        source_labels = [({'source': c.source_id, 'name': c.source_name}, c) for c in captures]
+        metric('pcapnyan_packets_ingested_total', 'counter', 'Packets received from capture sources',
+               [(labels, c.total_packets) for labels, c in source_labels])
+        metric('pcapnyan_bullets_spawned_total', 'counter', 'Bullets spawned from capture sources',
+               [(labels, c.spawned_bullets) for labels, c in source_labels])
+        metric('pcapnyan_packets_admitted_total', 'counter', 'Packets admitted by the spawn rate limiter',
+               [(labels, c.admitted_packets) for labels, c in source_labels])
+        metric('pcapnyan_packets_shed_total', 'counter', 'Packets shed by the spawn rate limiter',
+               [(labels, c.shed_packets) for labels, c in source_labels])
+        metric('pcapnyan_interface_packets_total', 'counter', 'Packets received per capture interface',
+               [(dict(labels, interface=interface), count)
+                for labels, c in source_labels for interface, count in c.interface_packets.items()])
+        metric('pcapnyan_invalid_flows_total', 'counter', 'Malformed flow_data records dropped',
+               [(labels, c.invalid_flows) for labels, c in source_labels])
+        metric('pcapnyan_spooled_packets_total', 'counter', 'Packets received from capture client spools after an outage',
+               [(labels, c.spooled_packets) for labels, c in source_labels])
+        metric('pcapnyan_source_packet_rate', 'gauge', 'EWMA of packets received per second',
+               [(labels, round(c.current_packet_rate(now), 3)) for labels, c in source_labels])
+        metric('pcapnyan_bullets_alive', 'gauge', 'Bullets currently alive', [({}, len(self.bullets))])
+        metric('pcapnyan_spawn_target_rate', 'gauge', 'Per-source spawn target published to capture clients',
+               [(labels, round(self.target_spawn_rate(c), 3)) for labels, c in source_labels])
+        metric('pcapnyan_capture_pipeline_packets_total', 'counter',
+               'Packets per capture client pipeline stage (reported by capture clients)',
+               [(dict(labels, stage=stage), count)
+                for labels, c in source_labels for stage, count in c.pipeline.get('stages', {}).items()])
+        
+        # キャプチャクライアントの packet_handler 処理時間（マイクロ秒のヒストグラムを秒に変換）
+        lines.append("# HELP pcapnyan_capture_handler_seconds Time spent in the capture client packet handler")
+        lines.append("# TYPE pcapnyan_capture_handler_seconds histogram")
+        for labels, c in source_labels:
+            histogram = c.pipeline.get('handler_time_us')
+            if not histogram:
+                continue
+            label_text = ','.join(f'{k}="{_escape_label(v)}"' for k, v in labels.items())
+            cumulative = 0
+            for bound, count in zip(histogram['buckets'] + ['+Inf'], histogram['counts']):
+                cumulative += count
+                le = bound if bound == '+Inf' else bound / 1e6
+                lines.append(f'pcapnyan_capture_handler_seconds_bucket{{{label_text},le="{le}"}} {cumulative}')
+            lines.append(f"pcapnyan_capture_handler_seconds_sum{{{label_text}}} {histogram['sum'] / 1e6}")
+            lines.append(f"pcapnyan_capture_handler_seconds_count{{{label_text}}} {cumulative}")
+        
+        stats = self.tick_stats
+        buckets = []
+        cumulative = 0
+        for bound, count in zip(TICK_HISTOGRAM_BUCKETS, stats.histogram_counts):
+            cumulative += count
+            buckets.append(({'le': str(bound)}, cumulative))
+        buckets.append(({'le': '+Inf'}, stats.ticks))
+        lines.append("# HELP pcapnyan_tick_duration_seconds Game loop tick duration (simulate + serialize + broadcast)")
+        lines.append("# TYPE pcapnyan_tick_duration_seconds histogram")
+        for labels, value in buckets:
+            lines.append(f'pcapnyan_tick_duration_seconds_bucket{{le="{labels["le"]}"}} {value}')
+        lines.append(f"pcapnyan_tick_duration_seconds_sum {stats.histogram_sum}")
+        lines.append(f"pcapnyan_tick_duration_seconds_count {stats.ticks}")
+        metric('pcapnyan_tick_missed_deadlines_total', 'counter', 'Ticks that finished after their deadline',
+               [({}, stats.missed_deadlines)])
+        metric('pcapnyan_tick_skipped_steps_total', 'counter', 'Simulation steps dropped while catching up',
+               [({}, stats.skipped_steps)])
+        
+        game_clients = [c for c in self.game_clients.values() if c.outbox]
+        sent_bytes = [({'client': c.id, 'type': 'game'}, c.outbox.sent_bytes) for c in game_clients]
+        sent_bytes += [({'client': c.id, 'type': 'capture'}, c.sent_bytes) for c in captures]
+        sent_messages = [({'client': c.id, 'type': 'game'}, c.outbox.sent_messages) for c in game_clients]
+        sent_messages += [({'client': c.id, 'type': 'capture'}, c.sent_messages) for c in captures]
+        metric('pcapnyan_client_sent_bytes_total', 'counter', 'Bytes sent per client', sent_bytes)
+        metric('pcapnyan_client_sent_messages_total', 'counter', 'Messages sent per client', sent_messages)
+        metric('pcapnyan_broadcast_queue_depth', 'gauge', 'Unsent messages in each game client outbox',
+               [({'client': c.id}, c.outbox.depth) for c in game_clients])
+        metric('pcapnyan_broadcast_dropped_frames_total', 'counter', 'Stale state frames dropped per game client',
+               [({'client': c.id}, c.outbox.dropped_frames) for c in game_clients])
+        
+        players = sum(1 for c in self.game_clients.values() if c.mode == GameMode.PLAYER)
+        metric('pcapnyan_connected_clients', 'gauge', 'Connected clients by type', [
+            ({'type': 'capture'}, len(self.capture_clients)),
+            ({'type': 'player'}, players),
+            ({'type': 'spectator'}, len(self.game_clients) - players)
+        ])
+        return '\n'.join(lines) + '\n'
+    
+    async def handle_metrics_request(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        """メトリクスHTTPリクエスト処理（GET /metrics のみ）"""
+        try:
+            request_line = await asyncio.wait_for(reader.readline(), timeout=5.0)
+            # ヘッダーは読み捨てる
+            while True:
+                line = await asyncio.wait_for(reader.readline(), timeout=5.0)
+                if line in (b'\r\n', b'\n', b''):
+                    break
+            
+            parts = request_line.decode('latin-1').split()
+            if len(parts) >= 2 and parts[0] == 'GET' and parts[1].split('?')[0] == '/metrics':
+                status = '200 OK'
+                body = self.render_metrics().encode('utf-8')
+                content_type = 'text/plain; version=0.0.4; charset=utf-8'
+            else:
+                status = '404 Not Found'
+                body = b'Not Found\n'
+                content_type = 'text/plain'
+            
+            writer.write(
+                f"HTTP/1.1 {status}\r\nContent-Type: {content_type}\r\n"
+                f"Content-Length: {len(body)}\r\nConnection: close\r\n\r\n".encode('latin-1') + body
+            )
+            await writer.drain()
+        except (asyncio.TimeoutError, ConnectionError):
+            pass
+        finally:
+            writer.close()
+    
     def start_discovery_service(self):
         """マルチキャスト検索サービス開始"""
         def discovery_thread():
@@ -657,6 +2096,7 @@ class HubServer:
                             'name': 'PCAP-Nyan Hub Server',
                             'players_online': len([c for c in self.game_clients.values() if c.mode == GameMode.PLAYER]),
                             'captures_active': len(self.capture_clients),
+                            'spawn_scale': round(self.spawn_scale, 3),  # 負荷に応じた生成目標の倍率（キャプチャクライアントのHub選択用）
                             'game_mode': 'multiplayer'
                         }
                         
@@ -678,6 +2118,12 @@ class HubServer:
         # マルチキャスト検索サービス開始
         self.start_discovery_service()
         
+        # メトリクスエンドポイント起動
+        metrics_line = 'disabled'
+        if self.metrics_port:
+            await asyncio.start_server(self.handle_metrics_request, '0.0.0.0', self.metrics_port)
+            metrics_line = f"http://{local_ip}:{self.metrics_port}/metrics"
+        
         print(f"""
 ========================================
 PCAP-Nyan Hub Server Started!
@@ -685,6 +2131,7 @@ PCAP-Nyan Hub Server Started!
 
 WebSocket Server: ws://{local_ip}:{WEBSOCKET_PORT}
 Discovery Service: {MULTICAST_GROUP}:{MULTICAST_PORT}
+Metrics: {metrics_line}
 
 アクセス方法:
 1. ブラウザで http://{local_ip}:3000 を開く
@@ -703,12 +2150,31 @@ Discovery Service: {MULTICAST_GROUP}:{MULTICAST_PORT}
             # ゲーム更新ループ起動
             await self.game_update_loop()
 
-async def main():
-    hub = HubServer()
+async def main(args: argparse.Namespace):
+    hub = HubServer(bullet_store=args.bullet_store, authoritative=args.authoritative,
+                    metrics_port=args.metrics_port, source_share=args.source_share,
+                    source_spawn_rate=args.source_rate, global_spawn_rate=args.global_rate)
     await hub.start()
 
+def parse_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description='PCAP-Nyan Hub Server')
+    parser.add_argument('--bullet-store', choices=['list', 'numpy'], default='list',
+                        help='Bullet storage engine (numpy: vectorized struct-of-arrays, requires numpy)')
+    parser.add_argument('--authoritative', action='store_true',
+                        help='Detect hits and grazes on the hub instead of trusting game clients')
+    parser.add_argument('--metrics-port', type=int, default=METRICS_PORT,
+                        help=f'Prometheus metrics HTTP port (default: {METRICS_PORT}, 0 to disable)')
+    parser.add_argument('--source-share', type=float, default=None,
+                        help='Max fraction of MAX_BULLETS a single capture source may hold '
+                             '(default: split fairly only when the pool is full)')
+    parser.add_argument('--source-rate', type=float, default=SOURCE_SPAWN_RATE,
+                        help=f'Bullets per second admitted from each capture source (default: {SOURCE_SPAWN_RATE:g})')
+    parser.add_argument('--global-rate', type=float, default=GLOBAL_SPAWN_RATE,
+                        help=f'Bullets per second admitted from all sources combined (default: {GLOBAL_SPAWN_RATE:g})')
+    return parser.parse_args()
+
 if __name__ == '__main__':
     try:
-        asyncio.run(main())
+        asyncio.run(main(parse_args()))
     except KeyboardInterrupt:
         print("\nHub server stopped.")
\ No newline at end of file
@@ -199,6 +199,13 @@ export default class DodgeScene extends Phaser.Scene {
         // Handle player movement (only if game is started and not over)
         if (this.gameStarted && !this.gameOver) {
             this.playerManager.updateMovement(this.cursors, this.shiftKey);
+            if (this.wsManager) {
+                const bounds = this.physics.world.bounds;
+                this.wsManager.updatePlayerPosition(
+                    this.playerManager.nyancat.x, this.playerManager.nyancat.y,
+                    bounds.width, bounds.height, this.time.now
+                );
+            }
         }
         
         // Check combo timeout
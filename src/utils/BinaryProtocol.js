@@ -0,0 +1,99 @@
+// Decoder for the hub's binary game_state / game_delta frames (encoding: 'binary').
+// Layout must match encode_binary_state() in packet_hub.py (little-endian, 4-byte aligned sections).
+
+const MAGIC = 'PN';
+const VERSION = 1;
+const HEADER_SIZE = 32;
+const PLAYER_SIZE = 32;
+const KINDS = { 1: 'game_state', 2: 'game_delta' };
+const BULLET_FLOATS = ['x', 'y', 'vx', 'vy', 'size'];
+const BULLET_PORTS = ['port', 'src_port', 'dst_port'];
+const BULLET_STRINGS = ['protocol', 'source', 'source_name', 'color', 'src_ip', 'dst_ip', 'src_name'];
+
+const textDecoder = new TextDecoder('utf-8');
+
+export function decodeBinaryState(buffer) {
+    const view = new DataView(buffer);
+    const magic = String.fromCharCode(view.getUint8(0), view.getUint8(1));
+    const version = view.getUint8(2);
+    if (magic !== MAGIC || version !== VERSION) {
+        throw new Error(`Unsupported binary frame (magic=${magic}, version=${version})`);
+    }
+
+    const type = KINDS[view.getUint8(3)];
+    const seq = view.getUint32(4, true);
+    const timestamp = view.getFloat64(8, true);
+    const playerCount = view.getUint32(16, true);
+    const bulletCount = view.getUint32(20, true);
+    const despawnedCount = view.getUint32(24, true);
+    const metaLength = view.getUint32(28, true);
+
+    let offset = HEADER_SIZE;
+    const meta = JSON.parse(textDecoder.decode(new Uint8Array(buffer, offset, metaLength)));
+    const strings = meta.strings;
+    offset += metaLength;
+
+    const players = {};
+    for (let i = 0; i < playerCount; i++, offset += PLAYER_SIZE) {
+        const flags = view.getUint8(offset + 6);
+        players[strings[view.getUint16(offset, true)]] = {
+            name: strings[view.getUint16(offset + 2, true)],
+            avatar: strings[view.getUint16(offset + 4, true)],
+            alive: (flags & 1) !== 0,
+            invulnerable: (flags & 2) !== 0,
+            hp: view.getInt8(offset + 7),
+            x: view.getFloat32(offset + 8, true),
+            y: view.getFloat32(offset + 12, true),
+            score: view.getInt32(offset + 16, true),
+            graze_count: view.getUint32(offset + 20, true),
+            death_time: (flags & 4) !== 0 ? view.getFloat64(offset + 24, true) : null
+        };
+    }
+
+    // Bullets are stored column by column
+    const ids = new Uint32Array(buffer, offset, bulletCount);
+    offset += bulletCount * 4;
+    const floats = {};
+    BULLET_FLOATS.forEach(name => {
+        floats[name] = new Float32Array(buffer, offset, bulletCount);
+        offset += bulletCount * 4;
+    });
+    const createdAt = new Float32Array(buffer, offset, bulletCount);
+    offset += bulletCount * 4;
+    const ports = {};
+    BULLET_PORTS.forEach(name => {
+        ports[name] = new Uint16Array(buffer, offset, bulletCount);
+        offset += bulletCount * 2;
+    });
+    const stringIndices = {};
+    BULLET_STRINGS.forEach(name => {
+        stringIndices[name] = new Uint16Array(buffer, offset, bulletCount);
+        offset += bulletCount * 2;
+    });
+
+    const bullets = new Array(bulletCount);
+    for (let i = 0; i < bulletCount; i++) {
+        const bullet = { id: `b_${ids[i]}` };
+        BULLET_FLOATS.forEach(name => { bullet[name] = floats[name][i]; });
+        BULLET_PORTS.forEach(name => { bullet[name] = ports[name][i]; });
+        BULLET_STRINGS.forEach(name => { bullet[name] = strings[stringIndices[name][i]]; });
+        if (type === 'game_delta') {
+            bullet.created_at = timestamp + createdAt[i];
+        }
+        bullets[i] = bullet;
+    }
+
+    const message = { type, seq, timestamp, players };
+    if (meta.capture_sources) {
+        message.capture_sources = meta.capture_sources;
+    }
+
+    if (type === 'game_state') {
+        message.bullets = bullets;
+    } else {
+        message.spawned = bullets;
+        message.despawned = Array.from(new Uint32Array(buffer, offset, despawnedCount), id => `b_${id}`);
+        message.players_removed = meta.players_removed || [];
+    }
+    return message;
+}
@@ -1,3 +1,5 @@
+import { decodeBinaryState } from './BinaryProtocol.js';
+
 export default class WebSocketManager {
     constructor() {
         this.ws = null;
@@ -18,11 +20,29 @@ export default class WebSocketManager {
             packetsPerMinute: 0
         };
         this.playerId = null;
+        this.gameConfig = null; // game_config from auth_success (hub coordinate space)
+        this.moveInterval = 1000 / 30; // player_move throttle (ms), matches the hub tick rate
+        this.lastMoveTime = 0;
+        this.lastMoveX = null;
+        this.lastMoveY = null;
         this.playerName = 'Player' + Math.floor(Math.random() * 1000);
         this.gameMode = 'player'; // 'player' or 'spectator'
+        this.preferredStateMode = 'delta'; // 'snapshot' or 'delta', requested in game_auth
+        this.stateMode = 'snapshot'; // Mode confirmed by the hub in auth_success
+        this.preferredEncoding = 'binary'; // 'json' or 'binary' for game_state / game_delta frames
+        this.resetDeltaState();
         this.connect();
     }
 
+    resetDeltaState() {
+        // Local mirror of hub state for delta mode
+        this.deltaBullets = new Map();
+        this.deltaPlayers = {};
+        this.deltaSources = {};
+        this.lastSeq = null;
+        this.awaitingKeyframe = true;
+    }
+
     getHubUrl() {
         // 同一ホストのHubサーバーに接続
         const protocol = 'ws:';
@@ -35,10 +55,12 @@ export default class WebSocketManager {
         const hubUrl = this.getHubUrl();
         // console.log(`Connecting to Hub: ${hubUrl}`);
         this.ws = new WebSocket(hubUrl);
+        this.ws.binaryType = 'arraybuffer';
         
         this.ws.onopen = () => {
             // console.log('WebSocket connected to Hub');
             this.updateStatus('connected');
+            this.resetDeltaState();
             
             // Authenticate as game client
             this.authenticate();
@@ -53,100 +75,38 @@ export default class WebSocketManager {
         };
         
         this.ws.onmessage = (event) => {
-            const data = JSON.parse(event.data);
+            let data;
+            try {
+                data = event.data instanceof ArrayBuffer
+                    ? decodeBinaryState(event.data)
+                    : JSON.parse(event.data);
+            } catch (error) {
+                console.error('Failed to decode hub message:', error);
+                return;
+            }
             
             switch(data.type) {
                 case 'auth_success':
                     this.playerId = data.player_id;
+                    this.stateMode = data.state_mode || 'snapshot';
+                    this.gameConfig = data.game_config || null;
                     // console.log(`Authenticated as player: ${this.playerId}`);
                     break;
                     
                 case 'game_state':
-                    // Convert bullets to obstacles format for compatibility
-                    const obstacles = (data.bullets || []).map(bullet => ({
-                        x_percent: (bullet.x / 800) * 100, // Convert to percentage
-                        size: bullet.size * 10, // Adjust size
-                        protocol: bullet.protocol,
-                        src_ip: bullet.src_ip || bullet.source,  // Use actual IP if available
-                        dst_ip: bullet.dst_ip || '',
-                        src_port: bullet.src_port || bullet.port,
-                        dst_port: bullet.dst_port || bullet.port,
-                        age: 0,
-                        game_port: bullet.port,
-                        source: bullet.source,
-                        source_name: bullet.source_name,
-                        src_name: bullet.src_name || bullet.source_name,  // Add src_name for label
-                        source_id: bullet.source_id || bullet.source, // Add source_id for spawn position
-                        color: bullet.color
-                    }));
-                    
-                    // Update packet stats from capture sources
-                    const sources = data.capture_sources || {};
-                    const activeSourceCount = Object.values(sources).filter(s => s.active).length;
-                    
-                    this.packetStats = {
-                        count: data.bullets ? data.bullets.length : 0,
-                        isCapturing: activeSourceCount > 0,
-                        isReceivingPackets: activeSourceCount > 0,
-                        packetsPerMinute: 0
-                    };
-                    
-                    this.updatePacketStats();
-                    
-                    if (this.callbacks.onCaptureStatusChange) {
-                        this.callbacks.onCaptureStatusChange(activeSourceCount > 0);
+                    if (this.stateMode === 'delta') {
+                        this.applyKeyframe(data);
                     }
+                    this.handleGameState(data);
+                    break;
                     
-                    if (this.callbacks.onMapUpdate) {
-                        this.callbacks.onMapUpdate(obstacles);
-                    }
-                    
-                    if (this.callbacks.onGameState) {
-                        // Convert capture_sources object to active_sources array for SourceManager
-                        const active_sources = [];
-                        if (data.capture_sources) {
-                            let sourceIndex = 0;
-                            Object.entries(data.capture_sources).forEach(([id, source]) => {
-                                if (source.active) {
-                                    // Try different field names for IP address
-                                    let ipAddress = source.ip || source.ip_address || source.host;
-                                    
-                                    // Check if IP looks like just the 4th octet (e.g., "100")
-                                    if (ipAddress && !ipAddress.includes('.')) {
-                                        // Convert single number to full IP
-                                        ipAddress = `192.168.1.${ipAddress}`;
-                                        // console.log(`Converted octet ${source.ip} to full IP: ${ipAddress}`);
-                                    }
-                                    
-                                    // If still no valid IP, generate a test IP based on index for positioning
-                                    if (!ipAddress || ipAddress === 'unknown') {
-                                        // Generate test IP like 192.168.1.X where X varies
-                                        const testOctet = 10 + (sourceIndex * 50); // Spread sources across screen
-                                        ipAddress = `192.168.1.${testOctet % 256}`;
-                                        // console.log(`Generated test IP for ${id}: ${ipAddress}`);
-                                    }
-                                    
-                                    // console.log(`Source ${id}: IP=${ipAddress}, raw data:`, source);
-                                    
-                                    active_sources.push({
-                                        source_id: id,
-                                        source_name: source.name || id,
-                                        ip_address: ipAddress,
-                                        packet_rate: source.packets_per_second || 0
-                                    });
-                                    sourceIndex++;
-                                }
-                            });
-                        }
-                        
-                        const gameStateWithSources = {
-                            ...data,
-                            active_sources: active_sources
-                        };
-                        
-                        this.callbacks.onGameState(gameStateWithSources);
+                case 'game_delta': {
+                    const state = this.applyDelta(data);
+                    if (state) {
+                        this.handleGameState(state);
                     }
                     break;
+                }
                     
                 case 'player_event':
                     if (this.callbacks.onPlayerEvent) {
@@ -183,6 +143,149 @@ export default class WebSocketManager {
         };
     }
     
+    applyKeyframe(data) {
+        // Full state: rebuild the local mirror, positions are as of data.timestamp
+        this.deltaBullets = new Map();
+        (data.bullets || []).forEach(bullet => {
+            this.deltaBullets.set(bullet.id, { bullet, t0: data.timestamp });
+        });
+        this.deltaPlayers = { ...(data.players || {}) };
+        this.deltaSources = data.capture_sources || {};
+        this.lastSeq = data.seq;
+        this.awaitingKeyframe = false;
+    }
+    
+    applyDelta(data) {
+        if (this.awaitingKeyframe) {
+            return null;
+        }
+        if (this.lastSeq !== null && data.seq !== this.lastSeq + 1) {
+            // Missed a delta: drop the mirror and ask the hub for a keyframe
+            this.awaitingKeyframe = true;
+            this.requestResync();
+            return null;
+        }
+        this.lastSeq = data.seq;
+        
+        (data.despawned || []).forEach(id => this.deltaBullets.delete(id));
+        // Spawned bullets carry their origin as of created_at
+        (data.spawned || []).forEach(bullet => {
+            this.deltaBullets.set(bullet.id, { bullet, t0: bullet.created_at });
+        });
+        
+        Object.entries(data.players || {}).forEach(([id, fields]) => {
+            this.deltaPlayers[id] = { ...(this.deltaPlayers[id] || {}), ...fields };
+        });
+        (data.players_removed || []).forEach(id => delete this.deltaPlayers[id]);
+        
+        if (data.capture_sources) {
+            this.deltaSources = data.capture_sources;
+        }
+        
+        // Bullets move in straight lines, so extrapolate from origin and velocity
+        const bullets = [];
+        this.deltaBullets.forEach(({ bullet, t0 }) => {
+            const dt = (data.timestamp - t0) / 1000;
+            bullets.push({ ...bullet, x: bullet.x + bullet.vx * dt, y: bullet.y + bullet.vy * dt });
+        });
+        
+        return {
+            type: 'game_state',
+            timestamp: data.timestamp,
+            seq: data.seq,
+            players: this.deltaPlayers,
+            bullets: bullets,
+            capture_sources: this.deltaSources
+        };
+    }
+    
+    handleGameState(data) {
+        // Convert bullets to obstacles format for compatibility
+        const obstacles = (data.bullets || []).map(bullet => ({
+            x_percent: (bullet.x / 800) * 100, // Convert to percentage
+            size: bullet.size * 10, // Adjust size
+            protocol: bullet.protocol,
+            src_ip: bullet.src_ip || bullet.source,  // Use actual IP if available
+            dst_ip: bullet.dst_ip || '',
+            src_port: bullet.src_port || bullet.port,
+            dst_port: bullet.dst_port || bullet.port,
+            age: 0,
+            game_port: bullet.port,
+            source: bullet.source,
+            source_name: bullet.source_name,
+            src_name: bullet.src_name || bullet.source_name,  // Add src_name for label
+            source_id: bullet.source_id || bullet.source, // Add source_id for spawn position
+            color: bullet.color
+        }));
+        
+        // Update packet stats from capture sources
+        const sources = data.capture_sources || {};
+        const activeSourceCount = Object.values(sources).filter(s => s.active).length;
+        
+        this.packetStats = {
+            count: data.bullets ? data.bullets.length : 0,
+            isCapturing: activeSourceCount > 0,
+            isReceivingPackets: activeSourceCount > 0,
+            packetsPerMinute: 0
+        };
+        
+        this.updatePacketStats();
+        
+        if (this.callbacks.onCaptureStatusChange) {
+            this.callbacks.onCaptureStatusChange(activeSourceCount > 0);
+        }
+        
+        if (this.callbacks.onMapUpdate) {
+            this.callbacks.onMapUpdate(obstacles);
+        }
+        
+        if (this.callbacks.onGameState) {
+            // Convert capture_sources object to active_sources array for SourceManager
+            const active_sources = [];
+            if (data.capture_sources) {
+                let sourceIndex = 0;
+                Object.entries(data.capture_sources).forEach(([id, source]) => {
+                    if (source.active) {
+                        // Try different field names for IP address
+                        let ipAddress = source.ip || source.ip_address || source.host;
+                        
+                        // Check if IP looks like just the 4th octet (e.g., "100")
+                        if (ipAddress && !ipAddress.includes('.')) {
+                            // Convert single number to full IP
+                            ipAddress = `192.168.1.${ipAddress}`;
+                            // console.log(`Converted octet ${source.ip} to full IP: ${ipAddress}`);
+                        }
+                        
+                        // If still no valid IP, generate a test IP based on index for positioning
+                        if (!ipAddress || ipAddress === 'unknown') {
+                            // Generate test IP like 192.168.1.X where X varies
+                            const testOctet = 10 + (sourceIndex * 50); // Spread sources across screen
+                            ipAddress = `192.168.1.${testOctet % 256}`;
+                            // console.log(`Generated test IP for ${id}: ${ipAddress}`);
+                        }
+                        
+                        // console.log(`Source ${id}: IP=${ipAddress}, raw data:`, source);
+                        
+                        active_sources.push({
+                            source_id: id,
+                            source_name: source.name || id,
+                            ip_address: ipAddress,
+                            packet_rate: source.packets_per_second || 0
+                        });
+                        sourceIndex++;
+                    }
+                });
+            }
+            
+            const gameStateWithSources = {
+                ...data,
+                active_sources: active_sources
+            };
+            
+            this.callbacks.onGameState(gameStateWithSources);
+        }
+    }
+    
     updateStatus(status) {
         const wsStatus = document.getElementById('ws-status');
         if (wsStatus) {
@@ -239,7 +342,17 @@ export default class WebSocketManager {
                 client_type: 'game',
                 mode: this.gameMode,
                 player_name: this.playerName,
-                avatar: 'nyan_cat'
+                avatar: 'nyan_cat',
+                state_mode: this.preferredStateMode,
+                encoding: this.preferredEncoding
+            }));
+        }
+    }
+    
+    requestResync() {
+        if (this.ws && this.ws.readyState === WebSocket.OPEN) {
+            this.ws.send(JSON.stringify({
+                type: 'state_resync'
             }));
         }
     }
@@ -255,6 +368,20 @@ export default class WebSocketManager {
         }
     }
     
+    // Report the local player position in hub coordinates so authoritative hubs judge
+    // hits and grazes at the right place. Throttled, and a still player is resent
+    // every 500ms so the hub does not treat the position as stale.
+    updatePlayerPosition(x, y, worldWidth, worldHeight, now) {
+        if (!this.gameConfig || now - this.lastMoveTime < this.moveInterval) return;
+        const hubX = x * this.gameConfig.game_width / worldWidth;
+        const hubY = y * this.gameConfig.game_height / worldHeight;
+        if (hubX === this.lastMoveX && hubY === this.lastMoveY && now - this.lastMoveTime < 500) return;
+        this.sendPlayerMove(hubX, hubY);
+        this.lastMoveTime = now;
+        this.lastMoveX = hubX;
+        this.lastMoveY = hubY;
+    }
+    
     sendPlayerHit(bulletId) {
         if (this.ws && this.ws.readyState === WebSocket.OPEN && this.playerId) {
             this.ws.send(JSON.stringify({
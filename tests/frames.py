@@ -0,0 +1,37 @@
+"""テスト用のフレーム組み立て（チェックサムは0のまま）"""
+
+import socket
+import struct
+
+ETH_SRC = bytes.fromhex('020000000001')
+ETH_DST = bytes.fromhex('020000000002')
+
+
+def udp(src_port: int, dst_port: int, payload: bytes = b'') -> bytes:
+    return struct.pack('!HHHH', src_port, dst_port, 8 + len(payload), 0) + payload
+
+
+def tcp(src_port: int, dst_port: int, flags: int = 0x18, payload: bytes = b'') -> bytes:
+    return struct.pack('!HHIIBBHHH', src_port, dst_port, 0, 0, 5 << 4, flags, 65535, 0, 0) + payload
+
+
+def icmp(payload: bytes = b'') -> bytes:
+    return struct.pack('!BBHHH', 8, 0, 0, 1, 1) + payload
+
+
+def ipv4(protocol: int, payload: bytes, src: str = '192.0.2.1', dst: str = '198.51.100.2',
+         flags_frag: int = 0, options: bytes = b'') -> bytes:
+    ihl = 5 + len(options) // 4
+    header = struct.pack('!BBHHHBBH4s4s', 0x40 | ihl, 0, ihl * 4 + len(payload), 1, flags_frag, 64, protocol, 0,
+                         socket.inet_aton(src), socket.inet_aton(dst))
+    return header + options + payload
+
+
+def ipv6(next_header: int, payload: bytes, src: str = '2001:db8::1', dst: str = '2001:db8::2') -> bytes:
+    return struct.pack('!IHBB16s16s', 6 << 28, len(payload), next_header, 64,
+                       socket.inet_pton(socket.AF_INET6, src), socket.inet_pton(socket.AF_INET6, dst)) + payload
+
+
+def ethernet(ethertype: int, payload: bytes, vlan: int = None) -> bytes:
+    tag = struct.pack('!HH', 0x8100, vlan) if vlan is not None else b''
+    return ETH_DST + ETH_SRC + tag + struct.pack('!H', ethertype) + payload
@@ -0,0 +1,79 @@
+"""サーバー側当たり判定（--authoritative）と player_move による位置更新のテスト"""
+
+import asyncio
+
+from packet_hub import (
+    GAME_HEIGHT, GAME_WIDTH, GRAZE_SCORE, MAX_HP, PLAYER_MOVE_TIMEOUT,
+    Bullet, GameClient, GameMode, HubServer, PlayerState
+)
+
+
+def hub_with_player(authoritative: bool = True):
+    hub = HubServer(authoritative=authoritative)
+    client = GameClient(id='client_0', mode=GameMode.PLAYER, websocket=None,
+                        player_state=PlayerState(id='client_0', name='player'))
+    hub.game_clients[client.id] = client
+    hub.bullets.add([Bullet(id='b1', x=100, y=100, vx=0, vy=0, size=10, protocol='UDP',
+                            source='capture_0', port=50000, color='#FF4444')])
+    return hub, client
+
+
+def move(hub, client, x, y):
+    asyncio.run(hub.handle_game_message(client, {'type': 'player_move', 'x': x, 'y': y}))
+
+
+def test_moved_player_is_judged_at_reported_position():
+    hub, client = hub_with_player()
+    move(hub, client, 100, 100)
+    assert hub.detect_collisions() == [(client, 'b1')]
+
+
+def test_moves_are_clamped_to_game_area():
+    hub, client = hub_with_player()
+    move(hub, client, -50, GAME_HEIGHT + 50)
+    assert (client.player_state.x, client.player_state.y) == (0, GAME_HEIGHT)
+    move(hub, client, GAME_WIDTH * 2, 10)
+    assert client.player_state.x == GAME_WIDTH
+
+
+def graze(hub, client):
+    asyncio.run(hub.handle_game_message(client, {'type': 'player_graze', 'bullet_id': 'b1'}))
+
+
+def hit(hub, client):
+    asyncio.run(hub.handle_game_message(client, {'type': 'player_hit', 'bullet_id': 'b1'}))
+
+
+def test_player_without_moves_is_not_judged_or_trusted():
+    hub, client = hub_with_player()
+    client.player_state.x, client.player_state.y = 100, 100  # 初期位置に弾幕があっても判定しない
+    assert hub.detect_collisions() == []
+    graze(hub, client)
+    hit(hub, client)
+    assert client.player_state.score == 0 and client.player_state.graze_count == 0
+    assert client.player_state.hp == MAX_HP  # クライアント申告は無視する
+
+
+def test_stale_position_is_not_judged():
+    hub, client = hub_with_player()
+    move(hub, client, 100, 100)
+    client.player_state.last_move_time -= PLAYER_MOVE_TIMEOUT + 0.1
+    assert hub.detect_collisions() == []
+    graze(hub, client)
+    assert client.player_state.score == 0
+
+
+def test_client_reports_are_ignored_while_judged():
+    hub, client = hub_with_player()
+    move(hub, client, 700, 500)
+    graze(hub, client)
+    hit(hub, client)
+    assert client.player_state.score == 0 and client.player_state.hp == MAX_HP
+
+
+def test_non_authoritative_hub_trusts_client_reports():
+    hub, client = hub_with_player(authoritative=False)
+    graze(hub, client)
+    hit(hub, client)
+    assert client.player_state.score == GRAZE_SCORE
+    assert client.player_state.hp == MAX_HP - 1
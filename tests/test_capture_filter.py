@@ -0,0 +1,134 @@
+"""カーネル側キャプチャフィルタ（build_capture_filter / build_bpf_program）のテスト"""
+
+import struct
+
+import pytest
+
+from packet_capture_client import (
+    BPF_ACCEPT, DLT_EN10MB, DLT_RAW, build_bpf_program, build_capture_filter, interface_linktype, parse_frame
+)
+from tests.frames import ethernet, icmp, ipv4, ipv6, tcp, udp
+
+ETH_P_IP = 0x0800
+ETH_P_IPV6 = 0x86DD
+
+
+def run_bpf(program, packet: bytes) -> int:
+    """build_bpf_program が使う命令だけを実行するclassic BPFインタプリタ（範囲外の読み込みは破棄）"""
+    a = x = 0
+    pc = 0
+    while True:
+        code, jt, jf, k = program[pc]
+        pc += 1
+        try:
+            if code == 0x28:    # ldh [k]
+                a, = struct.unpack_from('!H', packet, k)
+            elif code == 0x30:  # ldb [k]
+                a = packet[k]
+            elif code == 0x48:  # ldh [x + k]
+                a, = struct.unpack_from('!H', packet, x + k)
+            elif code == 0x50:  # ldb [x + k]
+                a = packet[x + k]
+            elif code == 0xb1:  # ldx 4 * ([k] & 0xf)
+                x = (packet[k] & 0x0F) * 4
+            elif code == 0x54:  # and #k
+                a &= k
+            elif code == 0x06:  # ret k
+                return k
+            elif code in (0x15, 0x35, 0x45):
+                taken = {0x15: a == k, 0x35: a >= k, 0x45: bool(a & k)}[code]
+                pc += jt if taken else jf
+            else:
+                raise AssertionError(f'unexpected opcode {code:#x}')
+        except (struct.error, IndexError):
+            return 0
+
+
+FRAMES = {
+    'ipv4_udp_high_port': (ethernet(ETH_P_IP, ipv4(17, udp(53, 40000))), True),
+    'ipv4_udp_well_known': (ethernet(ETH_P_IP, ipv4(17, udp(40000, 53))), False),
+    'ipv4_udp_dst_port_0': (ethernet(ETH_P_IP, ipv4(17, udp(40000, 0))), True),
+    'ipv4_tcp_high_port': (ethernet(ETH_P_IP, ipv4(6, tcp(443, 50000))), True),
+    'ipv4_tcp_rst': (ethernet(ETH_P_IP, ipv4(6, tcp(443, 50000, flags=0x04))), False),
+    'ipv4_tcp_options': (ethernet(ETH_P_IP, ipv4(6, tcp(443, 50000), options=b'\x01' * 8)), True),
+    'ipv4_icmp': (ethernet(ETH_P_IP, ipv4(1, icmp())), True),
+    'ipv4_later_fragment': (ethernet(ETH_P_IP, ipv4(17, b'\x00' * 16, flags_frag=0x0010)), False),
+    'ipv6_udp_high_port': (ethernet(ETH_P_IPV6, ipv6(17, udp(53, 40000))), True),
+    'ipv6_tcp_rst': (ethernet(ETH_P_IPV6, ipv6(6, tcp(443, 50000, flags=0x04))), False),
+    'ipv6_tcp_well_known': (ethernet(ETH_P_IPV6, ipv6(6, tcp(50000, 443))), False),
+    'ipv6_icmp': (ethernet(ETH_P_IPV6, ipv6(58, icmp())), True),
+    'ipv6_extension_header': (ethernet(ETH_P_IPV6, ipv6(0, b'\x11\x00' + b'\x00' * 6 + udp(53, 40000))), True),
+    'vlan_ipv4': (ethernet(ETH_P_IP, ipv4(17, udp(40000, 53)), vlan=10), True),
+    'arp': (ethernet(0x0806, b'\x00' * 28), False),
+}
+
+
+@pytest.mark.parametrize('name', sorted(FRAMES))
+def test_bpf_program_matches_spawn_rules(name):
+    frame, accepted = FRAMES[name]
+    assert (run_bpf(build_bpf_program(), frame) == BPF_ACCEPT) == accepted
+
+
+@pytest.mark.parametrize('name', sorted(FRAMES))
+def test_bpf_program_agrees_with_parser(name):
+    """ユーザー空間の parse_frame が弾幕にするフレームをカーネル側で捨てない"""
+    frame, _ = FRAMES[name]
+    packet_info = parse_frame(frame, len(frame))
+    if packet_info is None:
+        return
+    port = packet_info['dst_port'] or packet_info['src_port']
+    if packet_info['protocol'] == 'ICMP' or port > 1023:
+        assert run_bpf(build_bpf_program(), frame) == BPF_ACCEPT
+
+
+# リンク層ヘッダのないインターフェース（tun、WireGuard、SIT）ではIPヘッダから始まる
+RAW_FRAMES = {name: (frame[14:], accepted) for name, (frame, accepted) in FRAMES.items()
+              if name not in ('vlan_ipv4', 'arp')}
+
+
+@pytest.mark.parametrize('name', sorted(RAW_FRAMES))
+def test_raw_ip_bpf_program(name):
+    frame, accepted = RAW_FRAMES[name]
+    assert (run_bpf(build_bpf_program(linktype=DLT_RAW), frame) == BPF_ACCEPT) == accepted
+    packet_info = parse_frame(frame, len(frame), DLT_RAW)
+    if packet_info is not None and accepted:
+        assert packet_info['src_ip'] in ('192.0.2.1', '2001:db8::1')
+
+
+def test_raw_ip_bpf_drops_non_ip():
+    assert run_bpf(build_bpf_program(linktype=DLT_RAW), b'\x00' * 40) == 0
+
+
+def test_bpf_program_rejects_unknown_linktype():
+    with pytest.raises(ValueError):
+        build_bpf_program(linktype=113)
+
+
+def test_interface_linktype(tmp_path, monkeypatch):
+    types = {'eth0': 1, 'lo': 772, 'wg0': 65534, 'sit0': 776, 'wlan0mon': 803}
+    for name, hatype in types.items():
+        (tmp_path / name).mkdir()
+        (tmp_path / name / 'type').write_text(f'{hatype}\n')
+    monkeypatch.setattr('packet_capture_client.SYSFS_NET_DIR', str(tmp_path))
+    assert [interface_linktype(name) for name in types] == [DLT_EN10MB, DLT_EN10MB, DLT_RAW, DLT_RAW, None]
+    assert interface_linktype(None) == DLT_EN10MB
+
+
+def test_capture_filter_puts_vlan_last():
+    """libpcapの vlan は以降の条件のオフセットをずらすため、最後の節でなければならない"""
+    clauses = build_capture_filter().split(' or ')
+    assert clauses[-1] == 'vlan'
+    assert sum('vlan' in clause for clause in clauses) == 1
+
+
+def test_capture_filter_uses_min_port():
+    assert 'portrange 2000-65535' in build_capture_filter(2000)
+
+
+def test_capture_filter_compiles():
+    compile_filter = pytest.importorskip('scapy.arch.common').compile_filter
+    try:
+        program = compile_filter(build_capture_filter(), iface='lo')
+    except ImportError as e:
+        pytest.skip(str(e))  # libpcap・tcpdumpがない環境
+    assert program.bf_len > 0
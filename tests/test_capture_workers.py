@@ -0,0 +1,56 @@
+"""インターフェースごとのキャプチャスレッド（start_capture_workers）のテスト"""
+
+import threading
+import time
+
+from packet_capture_client import PacketCaptureClient
+
+
+def fake_client(failing: set) -> PacketCaptureClient:
+    """失敗するインターフェースはすぐにFalseを返し、それ以外は停止されるまでキャプチャを続ける"""
+    client = PacketCaptureClient(interface='eth0,eth1,eth2')
+    started = threading.Barrier(len(client.interfaces) + 1)
+
+    def start_capture(interface):
+        started.wait()
+        if interface in failing:
+            return False
+        while client.is_capturing:
+            time.sleep(0.01)
+        return True
+
+    client.start_capture = start_capture
+    client.started = started
+    return client
+
+
+def wait_for(condition, timeout=2.0):
+    deadline = time.monotonic() + timeout
+    while not condition() and time.monotonic() < deadline:
+        time.sleep(0.01)
+    return condition()
+
+
+def test_failed_interface_does_not_stop_the_others():
+    client = fake_client({'eth1'})
+    workers = client.start_capture_workers()
+    client.started.wait()
+    assert wait_for(lambda: client.worker_states['eth1'] == 'failed')
+    time.sleep(0.05)
+    assert client.is_capturing
+    assert client.worker_states == {'eth0': 'running', 'eth1': 'failed', 'eth2': 'running'}
+
+    client.is_capturing = False
+    for worker in workers:
+        worker.join(timeout=1)
+    assert client.worker_states == {'eth0': 'stopped', 'eth1': 'failed', 'eth2': 'stopped'}
+
+
+def test_capture_stops_when_every_worker_has_exited():
+    client = fake_client({'eth0', 'eth1', 'eth2'})
+    workers = client.start_capture_workers()
+    client.started.wait()
+    for worker in workers:
+        worker.join(timeout=1)
+    assert set(client.worker_states.values()) == {'failed'}
+    assert client.is_capturing is False
@@ -0,0 +1,71 @@
+"""flow_data（フロー集計モード）の処理と不正なレコードの扱いのテスト"""
+
+import asyncio
+
+import pytest
+
+from packet_hub import CaptureClient, HubServer, validate_flow_record
+
+
+def flow(**fields) -> dict:
+    record = {'protocol': 'UDP', 'src_ip': '192.0.2.1', 'dst_ip': '198.51.100.2',
+              'src_port': 53, 'dst_port': 40000, 'packets': 4, 'bytes': 400}
+    record.update(fields)
+    return record
+
+
+def hub_with_client():
+    hub = HubServer()
+    client = CaptureClient(id='client_0', source_id='capture_0', source_name='host_capture', websocket=None)
+    hub.capture_clients[client.id] = client
+    sent = []
+
+    async def send_capture_message(target, message):
+        sent.append(message)
+
+    hub.send_capture_message = send_capture_message
+    return hub, client
+
+
+def test_valid_record_is_normalized():
+    assert validate_flow_record(flow(protocol='ICMP', src_port=None, dst_port=None, interface='eth1')) == {
+        'protocol': 'ICMP', 'src_ip': '192.0.2.1', 'dst_ip': '198.51.100.2', 'src_port': 0, 'dst_port': 0,
+        'packets': 4, 'bytes': 400, 'interface': 'eth1'}
+    assert validate_flow_record(flow(packets=0))['packets'] == 1
+
+
+@pytest.mark.parametrize('record', [
+    None,
+    [],
+    'flow',
+    flow(packets='many'),
+    flow(packets=-1),
+    flow(packets=2.5),
+    flow(packets=True),
+    flow(bytes=None),
+    flow(bytes='400'),
+    flow(dst_port=70000),
+    flow(dst_port='40000'),
+    flow(protocol=6),
+    flow(src_ip=None),
+    flow(interface=['eth0']),
+])
+def test_malformed_record_is_rejected(record):
+    assert validate_flow_record(record) is None
+
+
+def test_malformed_records_are_counted_and_skipped():
+    hub, client = hub_with_client()
+    flows = [flow(), flow(packets='x'), flow(dst_port=40001, bytes=None), flow(dst_port=40002, interface='eth1')]
+    asyncio.run(hub.process_flow_data(client, {'type': 'flow_data', 'flows': flows}))
+    assert client.invalid_flows == 2
+    assert client.total_packets == 8
+    assert client.interface_packets == {'eth1': 4}
+    assert sorted({bullet['dst_port'] for bullet in hub.bullets.to_dicts(hub.sources.names)}) == [40000, 40002]
+    assert 'pcapnyan_invalid_flows_total{source="capture_0",name="host_capture"} 2' in hub.render_metrics()
+
+
+def test_non_list_flows_is_counted():
+    hub, client = hub_with_client()
+    asyncio.run(hub.process_flow_data(client, {'type': 'flow_data', 'flows': {'packets': 3}}))
+    assert client.invalid_flows == 1 and len(hub.bullets) == 0
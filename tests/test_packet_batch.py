@@ -0,0 +1,81 @@
+"""送信バッチの取り出し（take_packet_batch）のテスト"""
+
+import threading
+from collections import deque
+
+from packet_capture_client import PacketCaptureClient
+
+
+class LockCheckingBuffer(deque):
+    """取り出し・持ち越しが enqueue_lock を保持したまま行われることを確認するバッファ"""
+
+    def __init__(self, lock: threading.Lock, maxlen: int):
+        super().__init__(maxlen=maxlen)
+        self.lock = lock
+
+    def popleft(self):
+        assert self.lock.locked()
+        return super().popleft()
+
+    def extendleft(self, items):
+        assert self.lock.locked()
+        super().extendleft(items)
+
+
+def packet(flow: int, seq: int) -> dict:
+    return {'flow_key': ('10.0.0.1', '10.0.0.2', flow), 'seq': seq}
+
+
+def client_with(packets, maxlen=10) -> PacketCaptureClient:
+    client = PacketCaptureClient()
+    client.packet_buffer = LockCheckingBuffer(client.enqueue_lock, maxlen)
+    client.packet_buffer.extend(packets)
+    return client
+
+
+def test_same_flow_is_limited_and_deferred_in_order():
+    client = client_with([packet(1, i) for i in range(4)] + [packet(2, 4)])
+    batch, sent_connections = client.take_packet_batch(10)
+    assert [p['seq'] for p in batch] == [0, 1, 4]
+    assert [p['seq'] for p in client.packet_buffer] == [2, 3]  # 元の順序で先頭に戻る
+    assert client.stats.batch_deferred == 2
+    assert sent_connections == {('10.0.0.1', '10.0.0.2', 1): 2, ('10.0.0.1', '10.0.0.2', 2): 1}
+
+    # 2回目は持ち越し済みのパケットを送り、それ以上は持ち越さない
+    batch, _ = client.take_packet_batch(1)
+    assert [p['seq'] for p in batch] == [2]
+    assert not client.packet_buffer.lock.locked()
+
+
+def test_deferred_packets_are_dropped_on_second_deferral():
+    client = client_with([dict(packet(1, i), deferred=True) for i in range(3)])
+    batch, _ = client.take_packet_batch(10)
+    assert len(batch) == 2 and not client.packet_buffer
+    assert client.stats.batch_dropped == 1
+
+
+def test_every_packet_is_accounted_for_with_concurrent_producers():
+    """送信・バッファ残り・押し出し・持ち越し破棄の合計がキャプチャスレッドの追加件数と一致する"""
+    client = PacketCaptureClient()
+    client.packet_buffer = deque(maxlen=50)
+    client.flow_table.allow = lambda key, timestamp: True  # 接続ごとのレート制限なし
+    client.is_capturing = True
+    threads, per_thread = 4, 5000
+
+    def produce(worker: int):
+        for i in range(per_thread):
+            client.enqueue_packet_info({'protocol': 'UDP', 'src_ip': '10.0.0.1', 'dst_ip': '10.0.0.2',
+                                        'src_port': 40000 + i % 3, 'dst_port': 5000 + worker, 'timestamp': 0})
+
+    producers = [threading.Thread(target=produce, args=(i,)) for i in range(threads)]
+    for producer in producers:
+        producer.start()
+    sent = 0
+    while any(producer.is_alive() for producer in producers):
+        batch, _ = client.take_packet_batch(8)
+        sent += len(batch)
+    for producer in producers:
+        producer.join()
+    stats = client.stats
+    assert stats.batch_deferred > 0
+    assert sent + len(client.packet_buffer) + stats.buffer_overflow + stats.batch_dropped == threads * per_thread
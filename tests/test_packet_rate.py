@@ -0,0 +1,41 @@
+"""キャプチャソースのパケットレート（EWMAと受信停止時の減衰）のテスト"""
+
+import math
+
+from packet_hub import PACKET_RATE_TIME_CONSTANT, CaptureClient, HubServer
+
+
+def capture_client(now: float) -> CaptureClient:
+    client = CaptureClient(id='client_0', source_id='capture_0', source_name='host_capture', websocket=None)
+    client.last_packet_time = now
+    return client
+
+
+def test_rate_converges_to_steady_input():
+    client = capture_client(1000.0)
+    for i in range(1, 200):
+        client.update_packet_rate(100, 1000.0 + i)
+        client.last_packet_time = 1000.0 + i
+    assert math.isclose(client.packet_rate, 100, rel_tol=1e-6)
+    assert math.isclose(client.current_packet_rate(1000.0 + 199), 100, rel_tol=1e-6)
+
+
+def test_idle_source_decays_toward_zero():
+    client = capture_client(1000.0)
+    client.packet_rate = 100.0
+    assert client.current_packet_rate(1000.0) == 100.0
+    assert math.isclose(client.current_packet_rate(1000.0 + PACKET_RATE_TIME_CONSTANT), 100 / math.e)
+    assert client.current_packet_rate(1000.0 + 20 * PACKET_RATE_TIME_CONSTANT) < 1e-6
+    assert client.packet_rate == 100.0  # 表示用の減衰は保存値を変えない
+
+
+def test_metrics_report_decayed_rate(monkeypatch):
+    hub = HubServer()
+    client = capture_client(1000.0)
+    client.packet_rate = 100.0
+    hub.capture_clients[client.id] = client
+    monkeypatch.setattr('packet_hub.time.time', lambda: 1000.0 + 60)
+    metrics = hub.render_metrics()
+    assert 'pcapnyan_source_packet_rate{source="capture_0",name="host_capture"} 0.0' in metrics
+    state = hub.get_capture_sources_state()['capture_0']
+    assert state['active'] is False and state['packet_rate'] < 1e-3
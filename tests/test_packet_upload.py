@@ -0,0 +1,99 @@
+"""バイナリ packet_data（クライアントの encode_packet_upload と Hubの scan/decode）のテスト"""
+
+import pytest
+
+import packet_capture_client as client
+import packet_hub as hub
+from packet_capture_client import encode_packet_upload
+from packet_hub import decode_packet_record, scan_packet_upload
+
+INTERFACES = ['eth0', 'eth1']
+INTERFACE_INDEX = {name: index + 1 for index, name in enumerate(INTERFACES)}
+
+
+def packet(protocol, src_ip, dst_ip, src_port, dst_port, size=100, interface=None):
+    return {'protocol': protocol, 'src_ip': src_ip, 'dst_ip': dst_ip,
+            'src_port': src_port, 'dst_port': dst_port, 'size': size, 'interface': interface}
+
+
+PACKETS = [
+    packet('UDP', '192.0.2.1', '198.51.100.2', 53, 40000, interface='eth0'),
+    packet('TCP', '2001:db8::1', '2001:db8::2', 443, 50000, interface='eth1'),
+    packet('ICMP', '192.0.2.1', '198.51.100.3', None, None),
+    packet('TCP', '192.0.2.1', '198.51.100.4', 50000, 443),  # ウェルノウンポート宛て（弾幕にしない）
+    packet('UDP', '192.0.2.1', '198.51.100.5', 40000, 0),  # 宛先ポート0は送信元ポートで判定
+    packet('UDP', '2001:db8::1', '2001:db8::3', 5353, 45000, size=70000),  # 0xFFFFに切り詰め
+    packet('ICMP', '2001:db8::1', '2001:db8::4', None, None, interface='eth0'),
+]
+
+
+def expected(packet_info):
+    """Hubでデコードした結果（ポートなしは0、サイズはuint16に切り詰め）"""
+    decoded = {
+        'protocol': packet_info['protocol'],
+        'src_port': packet_info['src_port'] or 0,
+        'dst_port': packet_info['dst_port'] or 0,
+        'size': min(packet_info['size'], 0xFFFF),
+        'src_ip': packet_info['src_ip'],
+        'dst_ip': packet_info['dst_ip']
+    }
+    if packet_info['interface']:
+        decoded['interface'] = packet_info['interface']
+    return decoded
+
+
+def test_layouts_match():
+    """同じ形式を2つのモジュールで定義しているため、定数が一致することを確認"""
+    assert client.PACKET_UPLOAD_MAGIC == hub.PACKET_UPLOAD_MAGIC
+    assert client.PACKET_UPLOAD_VERSION == hub.PACKET_UPLOAD_VERSION
+    for name in ('PACKET_UPLOAD_HEADER', 'PACKET_UPLOAD_V4', 'PACKET_UPLOAD_V6'):
+        assert getattr(client, name).format == getattr(hub, name).format
+    assert client.PROTOCOL_NAMES == hub.PACKET_PROTOCOLS
+
+
+def test_round_trip():
+    payload = encode_packet_upload(PACKETS, INTERFACE_INDEX)
+    total, offsets, v6_start, interface_counts = scan_packet_upload(payload)
+    assert total == len(PACKETS)
+    assert interface_counts == {1: 2, 2: 1}
+
+    # IPv4レコードが先、IPv6レコードが後に並ぶ
+    ordered = [p for p in PACKETS if ':' not in p['src_ip']] + [p for p in PACKETS if ':' in p['src_ip']]
+    eligible = [p for p in ordered if p['dst_port'] != 443]
+    assert [decode_packet_record(payload, offset, v6_start, INTERFACES) for offset in offsets] == \
+        [expected(p) for p in eligible]
+
+
+def test_record_sizes():
+    payload = encode_packet_upload(PACKETS, INTERFACE_INDEX)
+    assert len(payload) == 8 + 4 * 16 + 3 * 40
+
+
+def test_empty_upload():
+    assert scan_packet_upload(encode_packet_upload([], {})) == (0, [], 8, {})
+
+
+def test_unknown_interface_index_is_dropped():
+    payload = encode_packet_upload([packet('UDP', '192.0.2.1', '198.51.100.2', 53, 40000, interface='eth1')],
+                                   INTERFACE_INDEX)
+    _, offsets, v6_start, _ = scan_packet_upload(payload)
+    assert 'interface' not in decode_packet_record(payload, offsets[0], v6_start, ['eth0'])
+
+
+@pytest.mark.parametrize('cut', [0, 4, 7, 8 + 15, -1])
+def test_truncated_frame_is_rejected(cut):
+    payload = encode_packet_upload(PACKETS, INTERFACE_INDEX)
+    with pytest.raises(ValueError):
+        scan_packet_upload(payload[:cut])
+
+
+def test_trailing_bytes_are_rejected():
+    with pytest.raises(ValueError):
+        scan_packet_upload(encode_packet_upload(PACKETS, INTERFACE_INDEX) + b'\x00')
+
+
+@pytest.mark.parametrize('header', [b'PN', b'PU\x02'])
+def test_wrong_magic_or_version_is_rejected(header):
+    payload = encode_packet_upload(PACKETS, INTERFACE_INDEX)
+    with pytest.raises(ValueError):
+        scan_packet_upload(header + payload[len(header):])
@@ -0,0 +1,79 @@
+"""parse_frame（raw/ring/pcapバックエンド共通のフレーム解析）のテスト"""
+
+import pytest
+
+from packet_capture_client import (
+    DLT_LINUX_SLL, DLT_NULL, DLT_RAW, RAW_SNAPLEN, PipelineStats, parse_frame
+)
+from tests.frames import ethernet, icmp, ipv4, ipv6, tcp, udp
+
+ETH_P_IP = 0x0800
+ETH_P_IPV6 = 0x86DD
+
+
+def parse(frame: bytes, **kwargs):
+    return parse_frame(frame, len(frame), **kwargs)
+
+
+def test_ipv4_udp():
+    packet_info = parse(ethernet(ETH_P_IP, ipv4(17, udp(5353, 40000, b'x' * 10))))
+    assert packet_info['protocol'] == 'UDP'
+    assert (packet_info['src_ip'], packet_info['dst_ip']) == ('192.0.2.1', '198.51.100.2')
+    assert (packet_info['src_port'], packet_info['dst_port']) == (5353, 40000)
+    assert packet_info['size'] == 14 + 20 + 18
+    assert packet_info['is_fragment'] is False
+
+
+def test_ipv6_tcp_behind_vlan_tags():
+    frame = ethernet(0x8100, b'\x00\x14' + ethernet(ETH_P_IPV6, ipv6(6, tcp(443, 50000)))[12:], vlan=10)
+    packet_info = parse(frame)
+    assert packet_info['protocol'] == 'TCP'
+    assert (packet_info['src_ip'], packet_info['dst_ip']) == ('2001:db8::1', '2001:db8::2')
+    assert (packet_info['src_port'], packet_info['dst_port']) == (443, 50000)
+
+
+def test_icmp_has_no_ports():
+    packet_info = parse(ethernet(ETH_P_IP, ipv4(1, icmp())))
+    assert packet_info['protocol'] == 'ICMP'
+    assert packet_info['src_port'] is None and packet_info['dst_port'] is None
+
+
+@pytest.mark.parametrize('linktype, header', [
+    (DLT_RAW, b''),
+    (DLT_NULL, b'\x02\x00\x00\x00'),
+    (DLT_LINUX_SLL, b'\x00' * 14 + b'\x08\x00'),
+])
+def test_other_linktypes(linktype, header):
+    packet_info = parse(header + ipv4(17, udp(1234, 40000)), linktype=linktype)
+    assert (packet_info['src_port'], packet_info['dst_port']) == (1234, 40000)
+
+
+def test_skipped_frames_are_counted():
+    stats = PipelineStats()
+    assert parse(ethernet(ETH_P_IP, ipv4(17, b'\x00' * 16, flags_frag=0x0010)), stats=stats) is None
+    assert parse(ethernet(ETH_P_IP, ipv4(6, tcp(443, 50000, flags=0x04))), stats=stats) is None
+    assert (stats.fragment_skipped, stats.rst_skipped) == (1, 1)
+
+
+FULL_FRAME = ethernet(ETH_P_IP, ipv4(6, tcp(443, 50000)))
+
+
+@pytest.mark.parametrize('length', [0, 5, 13, 14, 20, 33, 34 + 3, 34 + 13])
+def test_truncated_frames(length):
+    assert parse(FULL_FRAME[:length]) is None
+
+
+@pytest.mark.parametrize('length', [14 + 39, 14 + 40 + 3])
+def test_truncated_ipv6_frames(length):
+    assert parse(ethernet(ETH_P_IPV6, ipv6(17, udp(53, 40000)))[:length]) is None
+
+
+def test_short_frame_does_not_read_previous_frame():
+    """raw バックエンドは受信バッファを使い回すため、受信長までのスライスだけを解析する"""
+    buffer = bytearray(RAW_SNAPLEN)
+    view = memoryview(buffer)
+    buffer[:len(FULL_FRAME)] = FULL_FRAME
+    short = ethernet(ETH_P_IP, ipv4(6, b''))  # TCPヘッダのないIPv4
+    buffer[:len(short)] = short
+    assert parse_frame(view, len(FULL_FRAME)) is not None  # スライスしなければ前のフレームのポートを読んでしまう
+    assert parse_frame(view[:min(len(short), RAW_SNAPLEN)], len(short)) is None
@@ -0,0 +1,103 @@
+"""pcap/pcapngの読み込み（read_pcap_records）と再生（replay_pcap）のテスト"""
+
+import struct
+from collections import deque
+
+import pytest
+
+from packet_capture_client import PacketCaptureClient, read_pcap_records
+from tests.frames import ethernet, ipv4, ipv6, tcp, udp
+
+ETH_P_IP = 0x0800
+ETH_P_IPV6 = 0x86DD
+LINKTYPE_ETHERNET = 1
+
+FRAME_V4 = ethernet(ETH_P_IP, ipv4(17, udp(5353, 40000, b'x' * 10)))
+FRAME_V6 = ethernet(ETH_P_IPV6, ipv6(6, tcp(443, 50000)))
+
+
+def classic_pcap(records, endian='<', nanoseconds=False) -> bytes:
+    """records: (秒, 端数, フレーム, 実パケット長)"""
+    magic = 0xA1B23C4D if nanoseconds else 0xA1B2C3D4
+    data = struct.pack(endian + 'IHHiIII', magic, 2, 4, 0, 0, 65535, LINKTYPE_ETHERNET)
+    for seconds, fraction, frame, length in records:
+        data += struct.pack(endian + 'IIII', seconds, fraction, len(frame), length) + frame
+    return data
+
+
+def pcapng_block(block_type: int, body: bytes, endian='<') -> bytes:
+    body += b'\x00' * (-len(body) % 4)
+    length = 12 + len(body)
+    return struct.pack(endian + 'II', block_type, length) + body + struct.pack(endian + 'I', length)
+
+
+def pcapng(packets, endian='<', tsresol=None) -> bytes:
+    """SHB + IDB + EPB。packets: (タイムスタンプ単位の整数, フレーム, 実パケット長)"""
+    data = pcapng_block(0x0A0D0D0A, struct.pack(endian + 'IHHq', 0x1A2B3C4D, 1, 0, -1), endian)
+    options = b''
+    if tsresol is not None:
+        options = struct.pack(endian + 'HH', 9, 1) + bytes([tsresol]) + b'\x00' * 3
+        options += struct.pack(endian + 'HH', 0, 0)
+    data += pcapng_block(1, struct.pack(endian + 'HHI', LINKTYPE_ETHERNET, 0, 65535) + options, endian)
+    for timestamp, frame, length in packets:
+        body = struct.pack(endian + '5I', 0, timestamp >> 32, timestamp & 0xFFFFFFFF, len(frame), length) + frame
+        data += pcapng_block(6, body, endian)
+    return data
+
+
+def write(tmp_path, data: bytes) -> str:
+    path = tmp_path / 'capture.pcap'
+    path.write_bytes(data)
+    return str(path)
+
+
+@pytest.mark.parametrize('endian', ['<', '>'])
+def test_classic_pcap_records(tmp_path, endian):
+    path = write(tmp_path, classic_pcap([(100, 250000, FRAME_V4, len(FRAME_V4)),
+                                         (101, 500000, FRAME_V6[:40], len(FRAME_V6))], endian))
+    records = list(read_pcap_records(path))
+    assert records == [(100.25, LINKTYPE_ETHERNET, FRAME_V4, len(FRAME_V4)),
+                       (101.5, LINKTYPE_ETHERNET, FRAME_V6[:40], len(FRAME_V6))]
+
+
+def test_classic_pcap_nanosecond_timestamps(tmp_path):
+    path = write(tmp_path, classic_pcap([(7, 500000000, FRAME_V4, len(FRAME_V4))], nanoseconds=True))
+    assert [timestamp for timestamp, *_ in read_pcap_records(path)] == [7.5]
+
+
+@pytest.mark.parametrize('endian', ['<', '>'])
+def test_pcapng_records(tmp_path, endian):
+    path = write(tmp_path, pcapng([(1_500_000, FRAME_V4, len(FRAME_V4)),
+                                   (2_000_000, FRAME_V6, len(FRAME_V6))], endian))
+    records = list(read_pcap_records(path))
+    assert records == [(1.5, LINKTYPE_ETHERNET, FRAME_V4, len(FRAME_V4)),
+                       (2.0, LINKTYPE_ETHERNET, FRAME_V6, len(FRAME_V6))]
+
+
+def test_pcapng_timestamp_resolution_option(tmp_path):
+    path = write(tmp_path, pcapng([(3_250_000_000, FRAME_V4, len(FRAME_V4))], tsresol=9))
+    assert [timestamp for timestamp, *_ in read_pcap_records(path)] == [3.25]
+
+
+def test_empty_and_unknown_files(tmp_path):
+    assert list(read_pcap_records(write(tmp_path, b''))) == []
+    with pytest.raises(ValueError):
+        list(read_pcap_records(write(tmp_path, b'not a capture file')))
+
+
+@pytest.mark.parametrize('data', [
+    classic_pcap([(100, 0, FRAME_V4, len(FRAME_V4)), (100, 1000, FRAME_V6, len(FRAME_V6))]),
+    pcapng([(100_000_000, FRAME_V4, len(FRAME_V4)), (100_001_000, FRAME_V6, len(FRAME_V6))]),
+])
+def test_replay_pcap_produces_packet_info(tmp_path, data):
+    client = PacketCaptureClient(capture_backend='pcap', pcap_file=write(tmp_path, data), replay_speed=0)
+    client.packet_buffer = deque(maxlen=100)
+    client.is_capturing = True
+    client.replay_pcap()
+
+    v4, v6 = client.packet_buffer
+    assert (v4['protocol'], v4['src_ip'], v4['dst_ip']) == ('UDP', '192.0.2.1', '198.51.100.2')
+    assert (v4['src_port'], v4['dst_port'], v4['size']) == (5353, 40000, len(FRAME_V4))
+    assert (v6['protocol'], v6['src_ip'], v6['dst_ip']) == ('TCP', '2001:db8::1', '2001:db8::2')
+    assert (v6['src_port'], v6['dst_port'], v6['size']) == (443, 50000, len(FRAME_V6))
+    assert client.capture_stats_total().captured == 2
@@ -0,0 +1,76 @@
+"""capture_pipeline（クライアントの段階別統計とHubでの検証・メトリクス）のテスト"""
+
+import threading
+
+import pytest
+
+from packet_capture_client import PacketCaptureClient
+from packet_hub import CaptureClient, HubServer, validate_capture_pipeline
+from tests.frames import ethernet, ipv4, udp
+
+
+def hub_with_pipeline(pipeline: dict) -> HubServer:
+    hub = HubServer()
+    client = CaptureClient(id='client_0', source_id='capture_0', source_name='host_capture', websocket=None)
+    client.pipeline = pipeline
+    hub.capture_clients[client.id] = client
+    return hub
+
+
+def test_client_snapshot_is_valid_and_rendered():
+    snapshot = PacketCaptureClient().pipeline_snapshot()
+    pipeline = validate_capture_pipeline(dict(snapshot, type='capture_pipeline', source_id='capture_0'))
+    assert pipeline == {'stages': snapshot['stages'], 'handler_time_us': snapshot['handler_time_us']}
+    metrics = hub_with_pipeline(pipeline).render_metrics()
+    assert 'pcapnyan_capture_pipeline_packets_total{source="capture_0",name="host_capture",stage="sent"} 0' in metrics
+    assert 'pcapnyan_capture_handler_seconds_count{source="capture_0",name="host_capture"} 0' in metrics
+
+
+def test_histogram_is_optional():
+    assert validate_capture_pipeline({'stages': {'captured': 3}}) == {'stages': {'captured': 3}}
+
+
+VALID_HISTOGRAM = {'buckets': [1, 2], 'counts': [1, 0, 2], 'sum': 10.5}
+
+
+@pytest.mark.parametrize('data', [
+    {},
+    {'stages': []},
+    {'stages': {'captured': -1}},
+    {'stages': {'captured': '3'}},
+    {'stages': {'captured': True}},
+    {'stages': {'captured': 1.5}},
+    {'stages': {f'stage_{i}': 0 for i in range(100)}},
+    {'stages': {}, 'handler_time_us': []},
+    {'stages': {}, 'handler_time_us': dict(VALID_HISTOGRAM, buckets=None)},
+    {'stages': {}, 'handler_time_us': dict(VALID_HISTOGRAM, buckets=[2, 1])},
+    {'stages': {}, 'handler_time_us': dict(VALID_HISTOGRAM, buckets=['1', '2'])},
+    {'stages': {}, 'handler_time_us': dict(VALID_HISTOGRAM, counts=[1, 0])},
+    {'stages': {}, 'handler_time_us': dict(VALID_HISTOGRAM, counts=[1, 0, -2])},
+    {'stages': {}, 'handler_time_us': dict(VALID_HISTOGRAM, sum=None)},
+    {'stages': {}, 'handler_time_us': {'buckets': [1, 2], 'counts': [1, 0, 2]}},
+])
+def test_malformed_pipeline_is_rejected(data):
+    assert validate_capture_pipeline(data) is None
+
+
+def test_capture_counts_are_not_lost_across_threads():
+    """インターフェースごとのキャプチャスレッドが同時に数えても件数が失われない"""
+    client = PacketCaptureClient()
+    client.is_capturing = True
+    frame = ethernet(0x0800, ipv4(17, udp(53, 40000)))  # 同じ接続なので2件目以降はレート制限される
+    threads, frames = 8, 20000
+
+    def capture():
+        for _ in range(frames):
+            client.handle_frame(frame, len(frame))
+
+    workers = [threading.Thread(target=capture) for _ in range(threads)]
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+    total = client.capture_stats_total()
+    assert total.captured == threads * frames
+    assert sum(total.handler_counts) == threads * frames
+    assert client.pipeline_snapshot()['stages']['captured'] == threads * frames
@@ -0,0 +1,146 @@
+"""ringバックエンド（PACKET_RX_RING / TPACKET_V3）とrawバックエンドのテスト（Linuxでrootの時のみ、veth・tunを作成）"""
+
+import fcntl
+import os
+import socket
+import struct
+import subprocess
+import sys
+import threading
+import time
+from collections import deque
+
+import pytest
+
+import packet_capture_client
+from packet_capture_client import PacketCaptureClient
+from tests.frames import ethernet, ipv4, ipv6, tcp, udp
+
+pytestmark = pytest.mark.skipif(
+    not sys.platform.startswith('linux') or not hasattr(os, 'geteuid') or os.geteuid() != 0,
+    reason='requires root on Linux')
+
+ETH_P_IP = 0x0800
+ETH_P_IPV6 = 0x86DD
+ACCEPTED_V4 = 60
+ACCEPTED_V6 = 20
+FILTERED = 30  # ウェルノウンポート宛て（カーネル側フィルタで捨てる）
+
+
+def ip(*args):
+    subprocess.run(['ip', *args], check=True, capture_output=True)
+
+
+@pytest.fixture
+def veth():
+    """キャプチャ側と送信側のvethペア（IPv6を無効にして余計なパケットが流れないようにする）"""
+    capture, peer = f'pnc{os.getpid() % 10000}', f'pns{os.getpid() % 10000}'
+    try:
+        ip('link', 'add', capture, 'type', 'veth', 'peer', 'name', peer)
+    except (OSError, subprocess.CalledProcessError) as e:
+        pytest.skip(f'cannot create veth pair: {e}')
+    try:
+        for name in (capture, peer):
+            subprocess.run(['sysctl', '-q', '-w', f'net.ipv6.conf.{name}.disable_ipv6=1'], capture_output=True)
+            ip('link', 'set', name, 'up')
+        yield capture, peer
+    finally:
+        subprocess.run(['ip', 'link', 'del', capture], capture_output=True)
+
+
+def test_ring_capture_parses_frames_and_counts_kernel_stats(veth, monkeypatch):
+    capture, peer = veth
+    monkeypatch.setattr(packet_capture_client, 'RING_STATS_INTERVAL', 0.1)
+    client = PacketCaptureClient(interface=capture, capture_backend='ring',
+                                 ring_block_size=1 << 16, ring_block_count=4, ring_frame_size=2048)
+    client.packet_buffer = deque(maxlen=1000)
+    client.is_capturing = True
+    worker = threading.Thread(target=client.start_ring_capture, args=(capture,), daemon=True)
+    worker.start()
+    time.sleep(0.5)  # リングの準備とbindを待つ
+
+    sender = socket.socket(socket.AF_PACKET, socket.SOCK_RAW)
+    sender.bind((peer, 0))
+    try:
+        for i in range(ACCEPTED_V4):
+            sender.send(ethernet(ETH_P_IP, ipv4(17, udp(5353, 40000 + i, b'x' * 20), src='10.99.0.1')))
+        for i in range(ACCEPTED_V6):
+            sender.send(ethernet(ETH_P_IPV6, ipv6(6, tcp(443, 50000 + i), src='2001:db8:99::1')))
+        for i in range(FILTERED):
+            sender.send(ethernet(ETH_P_IP, ipv4(17, udp(40000 + i, 53), src='10.99.0.1')))
+    finally:
+        sender.close()
+
+    deadline = time.monotonic() + 5
+    while len(client.packet_buffer) < ACCEPTED_V4 + ACCEPTED_V6 and time.monotonic() < deadline:
+        time.sleep(0.05)
+    time.sleep(0.3)  # カーネル統計の報告を待つ
+    client.is_capturing = False
+    worker.join(timeout=3)
+
+    packets = list(client.packet_buffer)
+    v4 = [p for p in packets if p['src_ip'] == '10.99.0.1']
+    v6 = [p for p in packets if p['src_ip'] == '2001:db8:99::1']
+    assert len(v4) == ACCEPTED_V4 and len(v6) == ACCEPTED_V6
+    assert sorted(p['dst_port'] for p in v4) == list(range(40000, 40000 + ACCEPTED_V4))
+    assert all(p['protocol'] == 'UDP' and p['size'] == 14 + 20 + 28 and p['interface'] == capture for p in v4)
+    assert all(p['protocol'] == 'TCP' and p['dst_ip'] == '2001:db8::2' and p['src_port'] == 443 for p in v6)
+
+    # フィルタを通過したフレームだけがリングに入り、ドロップはない
+    assert client.kernel_packets == ACCEPTED_V4 + ACCEPTED_V6
+    assert client.kernel_drops == 0
+    assert client.capture_stats_total().captured == ACCEPTED_V4 + ACCEPTED_V6
+
+
+TUNSETIFF = 0x400454CA
+IFF_TUN = 0x0001
+IFF_NO_PI = 0x1000
+
+
+@pytest.fixture
+def tun():
+    """リンク層ヘッダのないtunデバイス（書き込んだIPパケットがインターフェースの受信になる）"""
+    name = f'pnt{os.getpid() % 10000}'
+    try:
+        fd = os.open('/dev/net/tun', os.O_RDWR)
+    except OSError as e:
+        pytest.skip(f'cannot open /dev/net/tun: {e}')
+    try:
+        fcntl.ioctl(fd, TUNSETIFF, struct.pack('16sH', name.encode(), IFF_TUN | IFF_NO_PI))
+        subprocess.run(['sysctl', '-q', '-w', f'net.ipv6.conf.{name}.disable_ipv6=1'], capture_output=True)
+        ip('link', 'set', name, 'up')
+        yield name, fd
+    finally:
+        os.close(fd)
+
+
+@pytest.mark.parametrize('backend', ['raw', 'ring'])
+def test_capture_on_raw_ip_interface(tun, backend):
+    """tun・WireGuardなどはEthernetヘッダなしのIPとして解析し、カーネル側フィルタもIPヘッダ基準で判定する"""
+    name, fd = tun
+    assert packet_capture_client.interface_linktype(name) == packet_capture_client.DLT_RAW
+    client = PacketCaptureClient(interface=name, capture_backend=backend,
+                                 ring_block_size=1 << 16, ring_block_count=4, ring_frame_size=2048)
+    client.packet_buffer = deque(maxlen=1000)
+    client.is_capturing = True
+    capture = client.start_ring_capture if backend == 'ring' else client.start_raw_capture
+    worker = threading.Thread(target=capture, args=(name,), daemon=True)
+    worker.start()
+    time.sleep(0.5)
+
+    for i in range(ACCEPTED_V4):
+        os.write(fd, ipv4(17, udp(5353, 40000 + i), src='10.98.0.1'))
+    for i in range(FILTERED):
+        os.write(fd, ipv4(17, udp(40000 + i, 53), src='10.98.0.1'))
+
+    deadline = time.monotonic() + 5
+    while len(client.packet_buffer) < ACCEPTED_V4 and time.monotonic() < deadline:
+        time.sleep(0.05)
+    time.sleep(0.2)
+    client.is_capturing = False
+    worker.join(timeout=3)
+
+    packets = [p for p in client.packet_buffer if p['src_ip'] == '10.98.0.1']
+    assert sorted(p['dst_port'] for p in packets) == list(range(40000, 40000 + ACCEPTED_V4))
+    assert all(p['protocol'] == 'UDP' and p['src_port'] == 5353 and p['interface'] == name for p in packets)
+    assert client.capture_stats_total().captured == ACCEPTED_V4  # ウェルノウンポート宛てはカーネルで捨てる
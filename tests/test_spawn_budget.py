@@ -0,0 +1,55 @@
+"""ソースごとの生成目標（update_spawn_budget / target_spawn_rate）のテスト"""
+
+import pytest
+
+from packet_hub import SPAWN_MIN_SCALE, Bullet, CaptureClient, HubServer
+
+
+def add_bullets(hub: HubServer, source_id: str, count: int):
+    hub.bullets.add([Bullet(id=hub.generate_bullet_id(), x=100, y=100, vx=0, vy=10, size=10, protocol='UDP',
+                            source=source_id, port=50000, color='#FF4444') for _ in range(count)])
+
+
+def hub_with_sources(*counts: int, bullet_store: str = 'list') -> HubServer:
+    hub = HubServer(bullet_store=bullet_store)
+    for i, count in enumerate(counts):
+        client = CaptureClient(id=f'client_{i}', source_id=f'capture_{i}', source_name=f'host_{i}', websocket=None)
+        hub.capture_clients[client.id] = client
+        add_bullets(hub, client.source_id, count)
+    hub.update_spawn_budget()
+    return hub
+
+
+@pytest.mark.parametrize('bullet_store', ['list', 'numpy'])
+def test_source_over_its_share_is_throttled_first(bullet_store):
+    if bullet_store == 'numpy':
+        pytest.importorskip('numpy')
+    # 最大500、2ソースで取り分は250。capture_0 は取り分を使い切り、capture_1 はほとんど使っていない
+    hub = hub_with_sources(260, 40, bullet_store=bullet_store)
+    heavy, light = hub.capture_clients['client_0'], hub.capture_clients['client_1']
+    assert heavy.share_load == pytest.approx(260 / 250)
+    assert heavy.spawn_scale == SPAWN_MIN_SCALE
+    assert light.spawn_scale == 1.0
+    assert hub.target_spawn_rate(heavy) < hub.target_spawn_rate(light)
+    assert hub.get_spawn_allowance(light)['rate'] == hub.target_spawn_rate(light)
+
+
+def test_throttling_starts_at_load_target():
+    hub = hub_with_sources(225, 0)  # 取り分の90% → (1 - 0.9) / (1 - 0.8) = 0.5
+    assert hub.capture_clients['client_0'].spawn_scale == pytest.approx(0.5)
+    assert hub.capture_clients['client_1'].spawn_scale == 1.0
+
+
+def test_tick_headroom_throttles_every_source():
+    hub = hub_with_sources(0, 0)
+    hub.tick_stats.samples['total'].extend([hub.tick_stats.budget * 0.75] * 100)  # 余裕25% → 0.5倍
+    hub.update_spawn_budget()
+    assert [c.spawn_scale for c in hub.capture_clients.values()] == [pytest.approx(0.5)] * 2
+
+
+def test_metrics_report_target_per_source():
+    hub = hub_with_sources(260, 40)
+    metrics = hub.render_metrics()
+    for client in hub.capture_clients.values():
+        labels = f'source="{client.source_id}",name="{client.source_name}"'
+        assert f'pcapnyan_spawn_target_rate{{{labels}}} {round(hub.target_spawn_rate(client), 3)}' in metrics
@@ -0,0 +1,56 @@
+"""weighted_allocation（フローのバイト数に比例した弾幕の割り当て）のテスト"""
+
+import random
+
+import pytest
+
+from packet_hub import weighted_allocation
+
+
+@pytest.mark.parametrize('weights, caps, total, expected', [
+    ([1, 1], [10, 10], 10, [5, 5]),
+    ([3, 1], [100, 100], 8, [6, 2]),
+    ([1, 2, 5], [100, 100, 100], 16, [2, 4, 10]),
+])
+def test_proportional_split(weights, caps, total, expected):
+    assert weighted_allocation(weights, caps, total) == expected
+
+
+def test_capped_entry_passes_remainder_to_others():
+    """上限に達した要素の残りは他の要素に再配分される"""
+    assert weighted_allocation([10, 1], [2, 100], 10) == [2, 8]
+    assert weighted_allocation([10, 10, 1], [1, 3, 100], 12) == [1, 3, 8]
+
+
+def test_zero_cap_and_zero_weight_get_nothing():
+    assert weighted_allocation([5, 0, 1], [10, 10, 0], 10) == [10, 0, 0]
+    assert weighted_allocation([0, 0], [10, 10], 10) == [0, 0]
+
+
+def test_total_larger_than_caps_returns_caps():
+    assert weighted_allocation([1, 2], [3, 4], 100) == [3, 4]
+
+
+def test_remainder_goes_to_largest_fraction():
+    assert weighted_allocation([1, 1, 1], [5, 5, 5], 2) == [1, 1, 0]
+    assert weighted_allocation([1, 3], [10, 10], 3) == [1, 2]
+
+
+def test_empty_and_zero_total():
+    assert weighted_allocation([], [], 5) == []
+    assert weighted_allocation([2, 1], [10, 10], 0) == [0, 0]
+
+
+def test_allocation_invariants():
+    """合計は min(total, 有効な上限の合計) と一致し、各要素は上限を超えない"""
+    rng = random.Random(0)
+    for _ in range(500):
+        n = rng.randint(1, 8)
+        weights = [rng.choice([0, rng.uniform(0.1, 1000)]) for _ in range(n)]
+        caps = [rng.randint(0, 50) for _ in range(n)]
+        total = rng.randint(0, 300)
+        allocation = weighted_allocation(weights, caps, total)
+        active_caps = sum(c for w, c in zip(weights, caps) if w > 0)
+        assert sum(allocation) == min(total, active_caps)
+        assert all(0 <= a <= c for a, c in zip(allocation, caps))
+        assert all(a == 0 for w, a in zip(weights, allocation) if w <= 0)